@@ -0,0 +1,96 @@
+"""Benchmark chunk coalescing for `StreamingResponse`.
+
+Streams tokens from many concurrent `StreamingResponse` instances into a fake
+ASGI `send` and reports the number of ASGI sends per second, CPU time and the
+p99 inter-token latency observed by the client, with and without coalescing.
+
+Usage:
+    python benchmarks/coalescing.py --streams 200 --tokens 200
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from sse_starlette.sse import AppStatus
+
+from lanarky.events import Events, ServerSentEvent
+from lanarky.logging import get_logger
+from lanarky.responses import CoalescingPolicy, StreamingResponse
+
+SEND_COST_SECONDS = 0.00002  # simulated per-send syscall cost
+
+
+async def run_stream(coalescing, tokens: int, interval: float, stats: dict) -> None:
+    async def content():
+        for i in range(tokens):
+            await asyncio.sleep(interval)
+            yield ServerSentEvent(data=f"token-{i}", event=Events.COMPLETION)
+
+    delivered: list[float] = []
+
+    async def send(message):
+        if message["type"] != "http.response.body" or not message["body"]:
+            return
+        stats["sends"] += 1
+        # busy-wait to mimic the CPU cost of a socket write
+        deadline = time.perf_counter() + SEND_COST_SECONDS
+        while time.perf_counter() < deadline:
+            pass
+        now = time.perf_counter()
+        delivered.extend([now] * message["body"].count(b"\r\n\r\n"))
+
+    async def receive():
+        await asyncio.sleep(3600)
+
+    response = StreamingResponse(content=content(), coalescing=coalescing, ping=3600)
+    await response({"type": "http"}, receive, send)
+
+    stats["gaps"].extend(b - a for a, b in zip(delivered, delivered[1:]))
+
+
+async def run(coalescing, streams: int, tokens: int, interval: float) -> dict:
+    stats = {"sends": 0, "gaps": []}
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.gather(
+        *(run_stream(coalescing, tokens, interval, stats) for _ in range(streams))
+    )
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+    gaps = sorted(stats["gaps"])
+    return {
+        "sends": stats["sends"],
+        "sends/s": stats["sends"] / wall,
+        "cpu (s)": cpu,
+        "p99 inter-token (ms)": gaps[int(len(gaps) * 0.99)] * 1000,
+        "median inter-token (ms)": statistics.median(gaps) * 1000,
+    }
+
+
+def main() -> None:
+    get_logger(level="INFO")
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.001)
+    parser.add_argument("--max-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    scenarios = {
+        "baseline": None,
+        "coalescing": CoalescingPolicy(max_delay=args.max_delay),
+    }
+    for name, policy in scenarios.items():
+        # sse-starlette binds its exit event to the first event loop
+        AppStatus.should_exit_event = None
+        result = asyncio.run(run(policy, args.streams, args.tokens, args.interval))
+        print(
+            f"{name:>10}: "
+            + ", ".join(f"{key}={value:,.2f}" for key, value in result.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
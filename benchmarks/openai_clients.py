@@ -0,0 +1,126 @@
+"""Benchmark pooled `AsyncOpenAI` clients against a local stub server.
+
+Starts a minimal HTTP/1.1 keep-alive server which answers every request with a
+fixed chat completion, then sends concurrent chat completion requests through
+`ChatCompletionResource`, once with a new client per resource (the previous
+behaviour) and once with clients from the process-wide registry. Reports the
+number of upstream TCP connections opened and the request throughput.
+
+Usage:
+    python benchmarks/openai_clients.py --requests 2000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from openai import AsyncOpenAI
+
+from lanarky.adapters.openai.clients import OpenAIClientRegistry
+from lanarky.adapters.openai.resources import ChatCompletionResource
+from lanarky.logging import get_logger
+
+COMPLETION = json.dumps(
+    {
+        "id": "chat-completion-id",
+        "object": "chat.completion",
+        "created": 1700936386,
+        "model": "gpt-3.5-turbo",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "Hello!"},
+            }
+        ],
+    }
+).encode()
+
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"content-type: application/json\r\n"
+    b"content-length: " + str(len(COMPLETION)).encode() + b"\r\n\r\n" + COMPLETION
+)
+
+
+class StubServer:
+    """HTTP/1.1 server which counts accepted connections."""
+
+    def __init__(self) -> None:
+        self.connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    name, _, value = line.partition(b":")
+                    if name.lower() == b"content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                writer.write(RESPONSE)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def run(make_client, base_url: str, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def request():
+        async with semaphore:
+            # resources are created per request, as with `Depends(endpoint)`
+            resource = ChatCompletionResource(client=make_client())
+            await resource(messages)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+async def main(requests: int, concurrency: int) -> None:
+    stub = StubServer()
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}/v1"
+
+    unpooled: list[AsyncOpenAI] = []
+
+    def new_client() -> AsyncOpenAI:
+        client = AsyncOpenAI(api_key="stub", base_url=base_url, max_retries=0)
+        unpooled.append(client)
+        return client
+
+    registry = OpenAIClientRegistry()
+
+    def pooled_client() -> AsyncOpenAI:
+        return registry.get(api_key="stub", base_url=base_url, max_retries=0)
+
+    print(f"{'clients':<12} {'connections':>12} {'req/s':>10}")
+    for name, make_client in [("per-request", new_client), ("pooled", pooled_client)]:
+        stub.connections = 0
+        elapsed = await run(make_client, base_url, requests, concurrency)
+        print(f"{name:<12} {stub.connections:>12} {requests / elapsed:>10.0f}")
+
+    for client in unpooled:
+        await client.close()
+    await registry.aclose()
+    server.close()
+    await server.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    get_logger(level="INFO")
+
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,111 @@
+"""Benchmark CPU-bound chains on a thread pool against a process pool.
+
+Runs a chain which burns CPU between streamed tokens, once on a `ChainExecutor`
+(`ChainRunMode.SYNC`) and once on a `ChainProcessPool` (`ChainRunMode.PROCESS`),
+and reports the chain throughput. Threads are serialized by the GIL, while
+worker processes scale with the number of cores.
+
+Usage:
+    python benchmarks/process_chains.py --requests 32 --workers 4
+"""
+
+import argparse
+import asyncio
+import time
+from functools import partial
+from typing import Any, Optional
+
+from langchain.callbacks.manager import CallbackManagerForChainRun
+from langchain.chains.base import Chain
+
+from lanarky.adapters.langchain.callbacks import TokenStreamingCallbackHandler
+from lanarky.adapters.langchain.executors import (
+    ChainExecutor,
+    ChainProcessPool,
+    ThreadSafeBridge,
+)
+from lanarky.logging import get_logger
+
+
+class CPUChain(Chain):
+    """Chain which burns CPU before every streamed token."""
+
+    @property
+    def input_keys(self) -> list[str]:
+        return ["query"]
+
+    @property
+    def output_keys(self) -> list[str]:
+        return ["answer"]
+
+    def _call(
+        self,
+        inputs: dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> dict[str, Any]:
+        [llm_run] = run_manager.get_child().on_llm_start({}, [inputs["query"]])
+        for token in inputs["query"].split():
+            sum(i * i for i in range(200_000))
+            llm_run.on_llm_new_token(token)
+        return {"answer": inputs["query"]}
+
+
+def cpu_chain_factory() -> CPUChain:
+    return CPUChain()
+
+
+async def discard(message: Any) -> None:
+    pass
+
+
+async def run_threads(executor: ChainExecutor, requests: int) -> float:
+    chain = cpu_chain_factory()
+
+    async def request():
+        async with ThreadSafeBridge(discard) as bridge:
+            handler = TokenStreamingCallbackHandler(output_key="answer", send=bridge)
+            call = partial(chain, {"query": "a b c d e"}, callbacks=[handler])
+            await executor.run(call)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+async def run_processes(pool: ChainProcessPool, requests: int) -> float:
+    process_chain = pool.bind(cpu_chain_factory)
+    await process_chain.warm_up()
+
+    async def request():
+        handler = TokenStreamingCallbackHandler(output_key="answer", send=discard)
+        await process_chain.run({"query": "a b c d e"}, [handler])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+async def main(requests: int, workers: int) -> None:
+    executor = ChainExecutor(max_workers=workers)
+    pool = ChainProcessPool(max_workers=workers)
+
+    print(f"{'run mode':<10} {'chains/s':>10}")
+    try:
+        elapsed = await run_threads(executor, requests)
+        print(f"{'sync':<10} {requests / elapsed:>10.1f}")
+        elapsed = await run_processes(pool, requests)
+        print(f"{'process':<10} {requests / elapsed:>10.1f}")
+    finally:
+        executor.shutdown()
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    get_logger(level="INFO")
+
+    asyncio.run(main(args.requests, args.workers))
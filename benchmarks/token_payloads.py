@@ -0,0 +1,138 @@
+"""Benchmark the per-token CPU cost of `TokenStreamMode.JSON` token events.
+
+Measures the encoding of a token into a websocket frame on its own, then sends
+tokens through `TokenWebSocketCallbackHandler` and
+`TokenStreamingCallbackHandler` into a websocket and an ASGI `send` which only
+count messages. Reports the CPU time per token. The baseline uses the previous
+encoding, which serialized a `TokenEventData` model for every token and a
+message dict for every websocket frame.
+
+Usage:
+    python benchmarks/token_payloads.py --tokens 200000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Callable
+
+from starlette.types import Message
+
+from lanarky.adapters.langchain.callbacks import (
+    TokenEventData,
+    TokenStreamingCallbackHandler,
+    TokenStreamMode,
+    TokenWebSocketCallbackHandler,
+    encode_websocket_message,
+    get_token_data,
+)
+from lanarky.events import Events
+from lanarky.logging import get_logger
+from lanarky.utils import model_dump_json
+from lanarky.websockets import WebSocket
+
+TOKENS = [" Hello", " World", ",", ' "quoted"', " naïve", "\n", " 😀"]
+
+
+class NullWebSocket(WebSocket):
+    """Connected websocket which drops all frames."""
+
+    def __init__(self) -> None:
+        self.frames = 0
+
+    async def send(self, message: Message) -> None:
+        self.frames += 1
+
+
+class BaselineWebSocketHandler(TokenWebSocketCallbackHandler):
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        message = self._construct_message(
+            data=model_dump_json(TokenEventData(token=token)), event=Events.COMPLETION
+        )
+        await self.websocket.send_json(message)
+
+
+class BaselineStreamingHandler(TokenStreamingCallbackHandler):
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        message = self._construct_message(
+            data=model_dump_json(TokenEventData(token=token)), event=Events.COMPLETION
+        )
+        await self.send(message)
+
+
+async def discard(message: Message) -> None:
+    pass
+
+
+def baseline_frame(token: str, event: str) -> str:
+    message = dict(data=model_dump_json(TokenEventData(token=token)), event=event)
+    # what `WebSocket.send_json` does with the message dict
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def template_frame(
+    token: str, event: str, mode: TokenStreamMode = TokenStreamMode.JSON
+) -> str:
+    return encode_websocket_message(get_token_data(token, mode), event)
+
+
+def measure_encoding(encode: Callable[[str, str], str], tokens: int) -> float:
+    event = Events.COMPLETION.value
+    start = time.process_time()
+    for i in range(tokens):
+        encode(TOKENS[i % len(TOKENS)], event)
+    return (time.process_time() - start) / tokens
+
+
+async def measure(handler: Any, tokens: int) -> float:
+    start = time.process_time()
+    for i in range(tokens):
+        await handler.on_llm_new_token(TOKENS[i % len(TOKENS)])
+    return (time.process_time() - start) / tokens
+
+
+async def main(tokens: int) -> None:
+    for token in TOKENS:
+        assert template_frame(token, "completion") == baseline_frame(
+            token, "completion"
+        )
+
+    print(f"{'':<10} {'baseline us':>12} {'template us':>12} {'speedup':>8}")
+    baseline = measure_encoding(baseline_frame, tokens)
+    fast = measure_encoding(template_frame, tokens)
+    print(f"{'encoding':<10} {baseline * 1e6:>12.2f} {fast * 1e6:>12.2f}", end="")
+    print(f" {baseline / fast:>7.1f}x")
+
+    rows = [
+        (
+            "websocket",
+            BaselineWebSocketHandler(output_key="answer", websocket=NullWebSocket()),
+            TokenWebSocketCallbackHandler(
+                output_key="answer", websocket=NullWebSocket()
+            ),
+        ),
+        (
+            "sse",
+            BaselineStreamingHandler(output_key="answer", send=discard),
+            TokenStreamingCallbackHandler(output_key="answer", send=discard),
+        ),
+    ]
+
+    for name, baseline_handler, handler in rows:
+        baseline = await measure(baseline_handler, tokens)
+        fast = await measure(handler, tokens)
+        print(
+            f"{name:<10} {baseline * 1e6:>12.2f} {fast * 1e6:>12.2f}"
+            f" {baseline / fast:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=200_000)
+    args = parser.parse_args()
+
+    get_logger(level="INFO")
+
+    asyncio.run(main(args.tokens))
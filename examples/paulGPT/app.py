@@ -7,19 +7,39 @@ from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.vectorstores.faiss import FAISS
 
 from lanarky import Lanarky
+from lanarky.adapters.langchain.cache import (
+    CachedEmbeddings,
+    CachedRetriever,
+    normalize_query,
+)
 from lanarky.adapters.langchain.routing import LangchainAPIRouter
+from lanarky.cache import InMemoryCache
 from lanarky.clients import StreamingClient
 
 app = Lanarky()
 router = LangchainAPIRouter()
 
+embeddings_cache = InMemoryCache(maxsize=4096, ttl=3600)
+retriever_cache = InMemoryCache(maxsize=4096, ttl=600)
+
 
 @router.post("/chat")
 def chat() -> RetrievalQA:
-    db = FAISS.load_local("db/", OpenAIEmbeddings())
+    embeddings = CachedEmbeddings(
+        OpenAIEmbeddings(),
+        embeddings_cache,
+        normalize=normalize_query,
+        namespace="text-embedding-ada-002",
+    )
+    db = FAISS.load_local("db/", embeddings)
     return RetrievalQA.from_chain_type(
         ChatOpenAI(streaming=True),
-        retriever=db.as_retriever(search_kwargs={"k": 2}),
+        retriever=CachedRetriever(
+            retriever=db.as_retriever(search_kwargs={"k": 2}),
+            cache=retriever_cache,
+            normalize=normalize_query,
+            namespace="db",
+        ),
         return_source_documents=True,
     )
 
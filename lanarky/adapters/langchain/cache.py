@@ -0,0 +1,221 @@
+import re
+import uuid
+import weakref
+from typing import Any, Callable, Optional
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain.schema.document import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from lanarky.cache import BaseCache
+from lanarky.metrics import metrics
+from lanarky.utils import canonical_hash
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for cache lookups.
+
+    Case and repeated whitespace are ignored, so that near-identical queries
+    share cache entries.
+
+    Args:
+        query: The query text.
+    """
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+_identities: dict[int, str] = {}
+
+
+def get_identity(obj: Any) -> str:
+    """Get a unique identity of an object.
+
+    Unlike `id()`, identities are never reused after the object is garbage
+    collected. They are only valid within the current process.
+
+    Args:
+        obj: The object. Must support weak references.
+    """
+    key = id(obj)
+    if key not in _identities:
+        _identities[key] = uuid.uuid4().hex
+        weakref.finalize(obj, _identities.pop, key, None)
+    return _identities[key]
+
+
+def get_retriever_namespace(retriever: BaseRetriever) -> str:
+    """Get a cache namespace which determines the results of a retriever.
+
+    The namespace includes the identity of the vector store of the retriever,
+    or of the retriever itself if it has no vector store, so retrievers over
+    different indexes never share cache entries.
+
+    Args:
+        retriever: The retriever.
+    """
+    source = getattr(retriever, "vectorstore", retriever)
+    return canonical_hash(
+        dict(
+            type=type(retriever).__qualname__,
+            tags=retriever.tags,
+            search_type=getattr(retriever, "search_type", None),
+            search_kwargs=getattr(retriever, "search_kwargs", None),
+            source=get_identity(source),
+        )
+    )
+
+
+class CachedRetriever(BaseRetriever):
+    """Retriever which memoizes the documents of another retriever.
+
+    Repeated queries skip the query embedding and the vector store search.
+    Documents are cached as dicts and rebuilt on every cache hit, so callers
+    cannot modify cached documents.
+
+    Usage:
+        ```python
+        from lanarky.cache import InMemoryCache
+
+        cache = InMemoryCache(maxsize=4096, ttl=600)
+
+        retriever = CachedRetriever(
+            retriever=db.as_retriever(search_kwargs={"k": 2}),
+            cache=cache,
+            normalize=normalize_query,
+            metrics_name="retriever_cache",
+        )
+        ```
+    """
+
+    retriever: BaseRetriever
+    """The retriever to memoize."""
+    cache: BaseCache
+    """The cache of the retrieved documents."""
+    normalize: Optional[Callable[[str], str]] = None
+    """Optional function to normalize queries before the cache lookup."""
+    namespace: Optional[str] = None
+    """The namespace of the cache keys. Defaults to the type, search arguments
+    and vector store of `retriever` within the current process. Pass the same
+    namespace to retrievers over the same index to share cache entries, e.g.
+    when the retriever is built for every request."""
+    metrics_name: Optional[str] = None
+    """Optional name to register the cache stats with `lanarky.metrics.metrics`."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+
+        if self.namespace is None:
+            self.namespace = get_retriever_namespace(self.retriever)
+        if self.metrics_name is not None:
+            metrics.register(self.metrics_name, self.cache.stats)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        key = self._cache_key(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return [Document(**data) for data in cached]
+
+        documents = self.retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        self.cache.set(key, [document.dict() for document in documents])
+        return documents
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        key = self._cache_key(query)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            return [Document(**data) for data in cached]
+
+        documents = await self.retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        await self.cache.aset(key, [document.dict() for document in documents])
+        return documents
+
+    def _cache_key(self, query: str) -> str:
+        if self.normalize is not None:
+            query = self.normalize(query)
+        return canonical_hash(dict(namespace=self.namespace, query=query))
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings which memoize the query embeddings of another model.
+
+    Only queries are cached: documents are usually embedded once when an index
+    is built.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache: BaseCache,
+        *,
+        normalize: Optional[Callable[[str], str]] = None,
+        namespace: Optional[str] = None,
+        metrics_name: Optional[str] = None,
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            embeddings: The embeddings model to memoize.
+            cache: The cache of the query embeddings.
+            normalize: Optional function to normalize queries before the cache
+                lookup.
+            namespace: The namespace of the cache keys. Defaults to the
+                identity of `embeddings` within the current process. Pass the
+                same namespace to models with the same configuration to share
+                cache entries, e.g. when the model is built for every request.
+            metrics_name: Optional name to register the cache stats with
+                `lanarky.metrics.metrics`.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.normalize = normalize
+        self.namespace = namespace or canonical_hash(
+            dict(
+                type=type(embeddings).__qualname__,
+                source=get_identity(embeddings),
+            )
+        )
+
+        if metrics_name is not None:
+            metrics.register(metrics_name, cache.stats)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self._cache_key(text)
+        embedding = self.cache.get(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(text)
+            self.cache.set(key, embedding)
+        return embedding
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self._cache_key(text)
+        embedding = await self.cache.aget(key)
+        if embedding is None:
+            embedding = await self.embeddings.aembed_query(text)
+            await self.cache.aset(key, embedding)
+        return embedding
+
+    def _cache_key(self, text: str) -> str:
+        if self.normalize is not None:
+            text = self.normalize(text)
+        return canonical_hash(dict(namespace=self.namespace, query=text))
@@ -1,17 +1,29 @@
+import copy
+from functools import lru_cache
+from json.encoder import encode_basestring
 from typing import Any, Optional
 
 from fastapi.websockets import WebSocket
 from langchain.callbacks.base import AsyncCallbackHandler
 from langchain.callbacks.streaming_stdout_final_only import (
+    DEFAULT_ANSWER_PREFIX_TOKENS,
     FinalStreamingStdOutCallbackHandler,
 )
 from langchain.globals import get_llm_cache
 from langchain.schema.document import Document
+from langchain_core.messages import BaseMessage
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from starlette.types import Message, Send
 
-from lanarky.events import Events, ServerSentEvent, ensure_bytes
-from lanarky.utils import StrEnum, model_dump_json
+from lanarky.adapters.langchain.matching import AnswerPrefixMatcher
+from lanarky.events import Events, get_event_encoder
+from lanarky.utils import (
+    StrEnum,
+    canonical_hash,
+    json_dumps,
+    json_loads,
+)
 
 
 class LangchainEvents(StrEnum):
@@ -25,6 +37,10 @@ class LanarkyCallbackHandler(AsyncCallbackHandler):
         super().__init__(**kwargs)
         self.llm_cache_used = get_llm_cache() is not None
 
+    def reset(self) -> None:
+        """Reset the per-request state, so that the handler can be reused."""
+        self.llm_cache_used = get_llm_cache() is not None
+
     @property
     def always_verbose(self) -> bool:
         """Verbose mode is always enabled for Lanarky applications."""
@@ -53,6 +69,12 @@ class StreamingCallbackHandler(LanarkyCallbackHandler):
         self._send = send
         self.streaming = None
 
+    def reset(self) -> None:
+        """Reset the per-request state, so that the handler can be reused."""
+        super().reset()
+        self._send = None
+        self.streaming = None
+
     @property
     def send(self) -> Send:
         return self._send
@@ -71,14 +93,68 @@ class StreamingCallbackHandler(LanarkyCallbackHandler):
             data: The data payload.
             event: The event name.
         """
-        chunk = ServerSentEvent(data=data, event=event)
         return {
             "type": "http.response.body",
-            "body": ensure_bytes(chunk, None),
+            "body": get_event_encoder().encode(data, event=event),
             "more_body": True,
         }
 
 
+class CallbackHandlerPool:
+    """Free-list pool of per-request callback handlers.
+
+    Callback handlers hold per-request state, such as the ASGI send callable,
+    so they must not be shared by concurrent requests. The pool hands out
+    copies of the prototype handlers and reuses them once they are released,
+    which is cheaper than building the handlers for every request.
+    """
+
+    def __init__(
+        self, prototypes: list[LanarkyCallbackHandler], maxsize: int = 256
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            prototypes: The callback handlers to copy for every request.
+            maxsize: The maximum number of released handler lists to keep.
+        """
+        self.prototypes = prototypes
+        self.maxsize = maxsize
+
+        self._free: list[list[LanarkyCallbackHandler]] = []
+
+    def __len__(self) -> int:
+        return len(self._free)
+
+    def acquire(self) -> list[LanarkyCallbackHandler]:
+        """Get a list of callback handlers for a request."""
+        if self._free:
+            return self._free.pop()
+
+        handlers = []
+        for prototype in self.prototypes:
+            handler = copy.copy(prototype)
+            handler.reset()
+            handlers.append(handler)
+        return handlers
+
+    def release(self, handlers: list[LanarkyCallbackHandler]) -> None:
+        """Reset callback handlers and return them to the pool.
+
+        Args:
+            handlers: A list of callback handlers returned by `acquire`.
+        """
+        if len(self._free) >= self.maxsize:
+            return
+        for handler in handlers:
+            handler.reset()
+        self._free.append(handlers)
+
+    async def arelease(self, handlers: list[LanarkyCallbackHandler]) -> None:
+        """Async version of `release`."""
+        self.release(handlers)
+
+
 class TokenStreamMode(StrEnum):
     TEXT = "text"
     JSON = "json"
@@ -93,17 +169,119 @@ class TokenEventData(BaseModel):
 def get_token_data(token: str, mode: TokenStreamMode) -> str:
     """Get token data based on mode.
 
+    In JSON mode, the token is escaped into a fixed `TokenEventData` template
+    instead of serializing a model for every token.
+
     Args:
         token: The token to use.
         mode: The stream mode.
     """
-    if mode not in list(TokenStreamMode):
-        raise ValueError(f"Invalid stream mode: {mode}")
+    # compare with the plain values, which is faster than with enum members
+    if mode == "json":
+        return '{"token":' + encode_basestring(token) + "}"
+    if mode == "text":
+        return token
+    raise ValueError(f"Invalid stream mode: {mode}")
+
+
+@lru_cache(maxsize=None)
+def _encode_event_field(event: Optional[str]) -> str:
+    if event is None:
+        return ',"event":null}'
+    return ',"event":' + encode_basestring(event) + "}"
+
+
+def encode_websocket_message(data: str, event: Optional[str] = None) -> str:
+    """Encode a websocket message with string data into a JSON text frame.
+
+    The frame is the same as `WebSocket.send_json(dict(data=data, event=event))`
+    sends, without serializing a dict for every message.
+
+    Args:
+        data: The data payload.
+        event: The event name.
+    """
+    return '{"data":' + encode_basestring(data) + _encode_event_field(event)
+
+
+async def send_websocket_message(
+    websocket: Any, data: str, event: Optional[str] = None
+) -> None:
+    """Send a message with string data to a websocket or websocket-like sender.
+
+    Websockets receive a pre-encoded text frame. Other senders, e.g. a
+    `BufferedWebSocket`, receive the message dict with `send_json`.
+
+    Args:
+        websocket: A WebSocket or an object with a `send_json` method.
+        data: The data payload.
+        event: The event name.
+    """
+    if isinstance(websocket, WebSocket):
+        await websocket.send_text(encode_websocket_message(data, event))
+    else:
+        await websocket.send_json(dict(data=data, event=event))
+
+
+def merge_token_events(
+    first: dict[str, Any],
+    second: dict[str, Any],
+    mode: TokenStreamMode = TokenStreamMode.JSON,
+) -> Optional[dict[str, Any]]:
+    """Merge two consecutive websocket token events into one.
+
+    Used to coalesce buffered events with `BufferedWebSocket`.
+
+    Args:
+        first: The earlier event.
+        second: The later event.
+        mode: The stream mode of the events.
+
+    Returns:
+        The merged event, or `None` unless both are token completion events.
+    """
+    if first.get("event") != Events.COMPLETION or second.get("event") != (
+        Events.COMPLETION
+    ):
+        return None
 
     if mode == TokenStreamMode.TEXT:
-        return token
+        token = first["data"] + second["data"]
     else:
-        return model_dump_json(TokenEventData(token=token))
+        first_token = _get_event_token(first["data"])
+        second_token = _get_event_token(second["data"])
+        if first_token is None or second_token is None:
+            # e.g. dict chunks of runnables, which are not tokens
+            return None
+        token = first_token + second_token
+    return dict(data=get_token_data(token, mode), event=Events.COMPLETION)
+
+
+def _get_event_token(data: Any) -> Optional[str]:
+    try:
+        payload = json_loads(data)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(payload, dict) or payload.keys() != {"token"}:
+        return None
+    return payload["token"]
+
+
+def get_chunk_data(chunk: Any, mode: TokenStreamMode) -> str:
+    """Get event data for an output chunk of a runnable.
+
+    Strings and message chunks are tokens. Other chunks, e.g. dicts, are
+    encoded with the JSON codec of `lanarky.utils`.
+
+    Args:
+        chunk: The output chunk.
+        mode: The stream mode.
+    """
+    if isinstance(chunk, BaseMessage):
+        chunk = chunk.content
+    if isinstance(chunk, str):
+        return get_token_data(chunk, mode) if chunk else ""
+    return json_dumps(chunk)
 
 
 class TokenStreamingCallbackHandler(StreamingCallbackHandler):
@@ -172,30 +350,173 @@ class SourceDocumentsEventData(BaseModel):
     source_documents: list[dict[str, Any]]
 
 
+# payloads with more page content are serialized in a thread pool
+SOURCE_DOCUMENTS_OFFLOAD_THRESHOLD = 64 * 1024
+
+# request header with the IDs of source documents known to the client
+KNOWN_DOCUMENTS_HEADER = "X-Known-Documents"
+
+
+def get_document_id(document: Document) -> str:
+    """Get the content hash of a source document.
+
+    Args:
+        document: A `Document` instance.
+    """
+    return canonical_hash(
+        {"page_content": document.page_content, "metadata": document.metadata}
+    )
+
+
+def parse_document_ids(value: Optional[str]) -> set[str]:
+    """Parse a comma-separated list of document IDs, e.g. from a header.
+
+    Args:
+        value: The comma-separated document IDs.
+    """
+    if not value:
+        return set()
+    return {document_id.strip() for document_id in value.split(",")} - {""}
+
+
+def _dump_source_documents(
+    documents: list[Document],
+    max_content_length: Optional[int] = None,
+    known_document_ids: Optional[set[str]] = None,
+) -> str:
+    # NOTE: langchain is using pydantic_v1 for `Document`
+    source_documents: list[dict] = []
+    for document in documents:
+        if known_document_ids is not None:
+            document_id = get_document_id(document)
+            if document_id in known_document_ids:
+                source_documents.append({"id": document_id})
+                continue
+            known_document_ids.add(document_id)
+            data = {"id": document_id, **document.dict()}
+        else:
+            data = document.dict()
+        if max_content_length is not None:
+            data["page_content"] = data["page_content"][:max_content_length]
+        source_documents.append(data)
+    # same payload as `SourceDocumentsEventData`, encoded with the JSON codec
+    return json_dumps(dict(source_documents=source_documents))
+
+
+async def get_source_documents_data(
+    documents: Any,
+    max_content_length: Optional[int] = None,
+    known_document_ids: Optional[set[str]] = None,
+) -> str:
+    """Get event data for source documents.
+
+    With `known_document_ids`, every document carries its content hash as
+    `id`, and documents with a known ID are sent as `{"id": ...}` only. The
+    IDs of the other documents are added to `known_document_ids`.
+
+    Large payloads are serialized in a thread pool to keep the event loop
+    responsive.
+
+    Args:
+        documents: A list of `Document` instances.
+        max_content_length: Optional maximum length of the page contents.
+        known_document_ids: Optional IDs of documents already sent in full.
+    """
+    if not isinstance(documents, list):
+        raise ValueError("source_documents must be a list")
+    if not all(isinstance(document, Document) for document in documents):
+        raise ValueError("source_documents must be a list of Document")
+
+    content_length = sum(len(document.page_content) for document in documents)
+    if max_content_length is not None:
+        content_length = min(content_length, max_content_length * len(documents))
+    if content_length > SOURCE_DOCUMENTS_OFFLOAD_THRESHOLD:
+        return await run_in_threadpool(
+            _dump_source_documents, documents, max_content_length, known_document_ids
+        )
+    return _dump_source_documents(documents, max_content_length, known_document_ids)
+
+
 class SourceDocumentsStreamingCallbackHandler(StreamingCallbackHandler):
-    """Callback handler for streaming source documents."""
+    """Callback handler for streaming source documents.
+
+    In reference mode, documents already known to the client are streamed as
+    IDs only. The client declares the IDs of its documents with the
+    `X-Known-Documents` header.
+    """
+
+    def __init__(
+        self,
+        *,
+        emit_on_retrieval: bool = False,
+        max_content_length: Optional[int] = None,
+        reference_mode: bool = False,
+        **kwargs: dict[str, Any],
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            emit_on_retrieval: Whether to stream the documents as soon as the
+                retriever returns them, instead of after the chain output.
+            max_content_length: Optional maximum length of the page contents.
+            reference_mode: Whether to stream known documents as IDs only.
+            **kwargs: Keyword arguments to pass to the parent constructor.
+        """
+        super().__init__(**kwargs)
+
+        self.emit_on_retrieval = emit_on_retrieval
+        self.max_content_length = max_content_length
+        self.reference_mode = reference_mode
+        self._default_reference_mode = reference_mode
+        self.known_document_ids: set[str] = set()
+        self.documents_sent = False
+
+    def reset(self) -> None:
+        """Reset the per-request state, so that the handler can be reused."""
+        super().reset()
+        # reference mode is switched on per request by the client
+        self.reference_mode = self._default_reference_mode
+        self.known_document_ids = set()
+        self.documents_sent = False
+
+    async def on_retriever_end(self, documents: Any, **kwargs: Any) -> None:
+        """Run when retriever ends running."""
+        if self.emit_on_retrieval and documents:
+            await self._send_documents(documents)
 
     async def on_chain_end(
         self, outputs: dict[str, Any], **kwargs: dict[str, Any]
     ) -> None:
         """Run when chain ends running."""
-        if "source_documents" in outputs:
-            if not isinstance(outputs["source_documents"], list):
-                raise ValueError("source_documents must be a list")
-            if not isinstance(outputs["source_documents"][0], Document):
-                raise ValueError("source_documents must be a list of Document")
-
-            # NOTE: langchain is using pydantic_v1 for `Document`
-            source_documents: list[dict] = [
-                document.dict() for document in outputs["source_documents"]
-            ]
-            message = self._construct_message(
-                data=model_dump_json(
-                    SourceDocumentsEventData(source_documents=source_documents)
-                ),
-                event=LangchainEvents.SOURCE_DOCUMENTS,
-            )
-            await self.send(message)
+        if "source_documents" in outputs and not self.documents_sent:
+            await self._send_documents(outputs["source_documents"])
+
+    async def _send_documents(self, documents: Any) -> None:
+        data = await get_source_documents_data(
+            documents,
+            self.max_content_length,
+            self.known_document_ids if self.reference_mode else None,
+        )
+        message = self._construct_message(
+            data=data, event=LangchainEvents.SOURCE_DOCUMENTS
+        )
+        self.documents_sent = True
+        await self.send(message)
+
+
+def get_answer_prefixes(
+    answer_prefix_tokens: Optional[list[str]] = None,
+    answer_prefixes: Optional[list[str]] = None,
+) -> list[str]:
+    """Get the answer prefixes of final token callback handlers.
+
+    Args:
+        answer_prefix_tokens: The answer prefix tokens. Defaults to the tokens
+            of `"Final Answer:"`.
+        answer_prefixes: Additional answer prefixes.
+    """
+    prefix = "".join(answer_prefix_tokens or DEFAULT_ANSWER_PREFIX_TOKENS)
+    return [prefix, *(answer_prefixes or [])]
 
 
 class FinalTokenStreamingCallbackHandler(
@@ -210,6 +531,7 @@ class FinalTokenStreamingCallbackHandler(
         self,
         *,
         answer_prefix_tokens: Optional[list[str]] = None,
+        answer_prefixes: Optional[list[str]] = None,
         strip_tokens: bool = True,
         stream_prefix: bool = False,
         **kwargs: dict[str, Any],
@@ -218,7 +540,8 @@ class FinalTokenStreamingCallbackHandler(
 
         Args:
             answer_prefix_tokens: The answer prefix tokens to use.
-            strip_tokens: Whether to strip tokens.
+            answer_prefixes: Additional answer prefixes, e.g. `["AI:"]`.
+            strip_tokens: Whether to ignore whitespace when matching prefixes.
             stream_prefix: Whether to stream the answer prefix.
             **kwargs: Keyword arguments to pass to the parent constructor.
         """
@@ -231,35 +554,60 @@ class FinalTokenStreamingCallbackHandler(
             stream_prefix=stream_prefix,
         )
 
+        self.answer_prefixes = get_answer_prefixes(
+            answer_prefix_tokens, answer_prefixes
+        )
+        self.matcher = AnswerPrefixMatcher(
+            self.answer_prefixes, ignore_whitespace=strip_tokens
+        )
+
+    def reset(self) -> None:
+        """Reset the per-request state, so that the handler can be reused."""
+        super().reset()
+        self.answer_reached = False
+        self.matcher = copy.copy(self.matcher)
+        self.matcher.reset()
+
+    def append_to_last_tokens(self, token: str) -> None:
+        """Pass a token to the answer prefix matcher."""
+        self.matcher.feed(token)
+
+    def check_if_answer_reached(self) -> bool:
+        """Check if the last token completed an answer prefix."""
+        return self.matcher.match is not None
+
     async def on_llm_start(self, *args: Any, **kwargs: dict[str, Any]) -> None:
         """Run when LLM starts running."""
         self.answer_reached = False
         self.streaming = False
+        self.matcher.reset()
 
     async def on_llm_new_token(self, token: str, **kwargs: dict[str, Any]) -> None:
         """Run on new LLM token. Only available when streaming is enabled."""
         if not self.streaming:
             self.streaming = True
 
-        # Remember the last n tokens, where n = len(answer_prefix_tokens)
-        self.append_to_last_tokens(token)
+        if not self.answer_reached:
+            self.append_to_last_tokens(token)
+            if not self.check_if_answer_reached():
+                return
 
-        # Check if the last n tokens match the answer_prefix_tokens list ...
-        if self.check_if_answer_reached():
             self.answer_reached = True
+            prefix, token = self.matcher.match or (token, "")
             if self.stream_prefix:
                 message = self._construct_message(
-                    data=get_token_data("".join(self.last_tokens), self.mode),
+                    data=get_token_data(prefix, self.mode),
                     event=Events.COMPLETION,
                 )
                 await self.send(message)
+            # only the text after the prefix belongs to the answer
+            if not token:
+                return
 
-        # ... if yes, then print tokens from now on
-        if self.answer_reached:
-            message = self._construct_message(
-                data=get_token_data(token, self.mode), event=Events.COMPLETION
-            )
-            await self.send(message)
+        message = self._construct_message(
+            data=get_token_data(token, self.mode), event=Events.COMPLETION
+        )
+        await self.send(message)
 
 
 class WebSocketCallbackHandler(LanarkyCallbackHandler):
@@ -288,6 +636,12 @@ class WebSocketCallbackHandler(LanarkyCallbackHandler):
         self._websocket = websocket
         self.streaming = None
 
+    def reset(self) -> None:
+        """Reset the per-request state, so that the handler can be reused."""
+        super().reset()
+        self._websocket = None
+        self.streaming = None
+
     @property
     def websocket(self) -> WebSocket:
         return self._websocket
@@ -308,6 +662,22 @@ class WebSocketCallbackHandler(LanarkyCallbackHandler):
         """
         return dict(data=data, event=event)
 
+    async def _send_message(self, data: str, event: Optional[str] = None) -> None:
+        """Sends a message to the websocket.
+
+        Messages are sent to websockets as pre-encoded text frames. Other
+        senders, e.g. a `BufferedWebSocket`, receive the message dict with
+        `send_json`.
+
+        Args:
+            data: The data payload.
+            event: The event name.
+        """
+        if isinstance(self.websocket, WebSocket):
+            await self.websocket.send_text(encode_websocket_message(data, event))
+        else:
+            await self.websocket.send_json(self._construct_message(data, event))
+
 
 class TokenWebSocketCallbackHandler(WebSocketCallbackHandler):
     """Callback handler for sending tokens in websocket sessions."""
@@ -335,10 +705,9 @@ class TokenWebSocketCallbackHandler(WebSocketCallbackHandler):
         if self.llm_cache_used:  # cache missed (or was never enabled) if we are here
             self.llm_cache_used = False
 
-        message = self._construct_message(
+        await self._send_message(
             data=get_token_data(token, self.mode), event=Events.COMPLETION
         )
-        await self.websocket.send_json(message)
 
     async def on_chain_end(
         self, outputs: dict[str, Any], **kwargs: dict[str, Any]
@@ -349,39 +718,81 @@ class TokenWebSocketCallbackHandler(WebSocketCallbackHandler):
         """
         if self.llm_cache_used or not self.streaming:
             if self.output_key in outputs:
-                message = self._construct_message(
+                await self._send_message(
                     data=get_token_data(outputs[self.output_key], self.mode),
                     event=Events.COMPLETION,
                 )
-                await self.websocket.send_json(message)
             else:
                 raise KeyError(f"missing outputs key: {self.output_key}")
 
 
 class SourceDocumentsWebSocketCallbackHandler(WebSocketCallbackHandler):
-    """Callback handler for sending source documents in websocket sessions."""
+    """Callback handler for sending source documents in websocket sessions.
+
+    In reference mode, documents already sent in the session are sent as IDs
+    only.
+    """
+
+    def __init__(
+        self,
+        *,
+        emit_on_retrieval: bool = False,
+        max_content_length: Optional[int] = None,
+        reference_mode: bool = False,
+        **kwargs: dict[str, Any],
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            emit_on_retrieval: Whether to send the documents as soon as the
+                retriever returns them, instead of after the chain output.
+            max_content_length: Optional maximum length of the page contents.
+            reference_mode: Whether to send known documents as IDs only.
+            **kwargs: Keyword arguments to pass to the parent constructor.
+        """
+        super().__init__(**kwargs)
+
+        self.emit_on_retrieval = emit_on_retrieval
+        self.max_content_length = max_content_length
+        self.reference_mode = reference_mode
+        self._default_reference_mode = reference_mode
+        self.known_document_ids: set[str] = set()
+        self.documents_sent = False
+
+    def reset(self) -> None:
+        """Reset the per-request state, so that the handler can be reused."""
+        super().reset()
+        # reference mode is switched on per request by the client
+        self.reference_mode = self._default_reference_mode
+        self.known_document_ids = set()
+        self.documents_sent = False
+
+    async def on_chain_start(self, *args: Any, **kwargs: dict[str, Any]) -> None:
+        """Run when chain starts running."""
+        if kwargs.get("parent_run_id") is None:
+            # websocket handlers are reused for every message of a session
+            self.documents_sent = False
+
+    async def on_retriever_end(self, documents: Any, **kwargs: Any) -> None:
+        """Run when retriever ends running."""
+        if self.emit_on_retrieval and documents:
+            await self._send_documents(documents)
 
     async def on_chain_end(
         self, outputs: dict[str, Any], **kwargs: dict[str, Any]
     ) -> None:
         """Run when chain ends running."""
-        if "source_documents" in outputs:
-            if not isinstance(outputs["source_documents"], list):
-                raise ValueError("source_documents must be a list")
-            if not isinstance(outputs["source_documents"][0], Document):
-                raise ValueError("source_documents must be a list of Document")
-
-            # NOTE: langchain is using pydantic_v1 for `Document`
-            source_documents: list[dict] = [
-                document.dict() for document in outputs["source_documents"]
-            ]
-            message = self._construct_message(
-                data=model_dump_json(
-                    SourceDocumentsEventData(source_documents=source_documents)
-                ),
-                event=LangchainEvents.SOURCE_DOCUMENTS,
-            )
-            await self.websocket.send_json(message)
+        if "source_documents" in outputs and not self.documents_sent:
+            await self._send_documents(outputs["source_documents"])
+
+    async def _send_documents(self, documents: Any) -> None:
+        data = await get_source_documents_data(
+            documents,
+            self.max_content_length,
+            self.known_document_ids if self.reference_mode else None,
+        )
+        self.documents_sent = True
+        await self._send_message(data=data, event=LangchainEvents.SOURCE_DOCUMENTS)
 
 
 class FinalTokenWebSocketCallbackHandler(
@@ -396,6 +807,7 @@ class FinalTokenWebSocketCallbackHandler(
         self,
         *,
         answer_prefix_tokens: Optional[list[str]] = None,
+        answer_prefixes: Optional[list[str]] = None,
         strip_tokens: bool = True,
         stream_prefix: bool = False,
         **kwargs: dict[str, Any],
@@ -404,7 +816,8 @@ class FinalTokenWebSocketCallbackHandler(
 
         Args:
             answer_prefix_tokens: The answer prefix tokens to use.
-            strip_tokens: Whether to strip tokens.
+            answer_prefixes: Additional answer prefixes, e.g. `["AI:"]`.
+            strip_tokens: Whether to ignore whitespace when matching prefixes.
             stream_prefix: Whether to stream the answer prefix.
             **kwargs: Keyword arguments to pass to the parent constructor.
         """
@@ -417,32 +830,54 @@ class FinalTokenWebSocketCallbackHandler(
             stream_prefix=stream_prefix,
         )
 
-    async def on_llm_start(self, *args, **kwargs) -> None:
+        self.answer_prefixes = get_answer_prefixes(
+            answer_prefix_tokens, answer_prefixes
+        )
+        self.matcher = AnswerPrefixMatcher(
+            self.answer_prefixes, ignore_whitespace=strip_tokens
+        )
+
+    def reset(self) -> None:
+        """Reset the per-request state, so that the handler can be reused."""
+        super().reset()
+        self.answer_reached = False
+        self.matcher = copy.copy(self.matcher)
+        self.matcher.reset()
+
+    def append_to_last_tokens(self, token: str) -> None:
+        """Pass a token to the answer prefix matcher."""
+        self.matcher.feed(token)
+
+    def check_if_answer_reached(self) -> bool:
+        """Check if the last token completed an answer prefix."""
+        return self.matcher.match is not None
+
+    async def on_llm_start(self, *args: Any, **kwargs: dict[str, Any]) -> None:
         """Run when LLM starts running."""
         self.answer_reached = False
         self.streaming = False
+        self.matcher.reset()
 
     async def on_llm_new_token(self, token: str, **kwargs: dict[str, Any]) -> None:
         """Run on new LLM token. Only available when streaming is enabled."""
         if not self.streaming:
             self.streaming = True
 
-        # Remember the last n tokens, where n = len(answer_prefix_tokens)
-        self.append_to_last_tokens(token)
+        if not self.answer_reached:
+            self.append_to_last_tokens(token)
+            if not self.check_if_answer_reached():
+                return
 
-        # Check if the last n tokens match the answer_prefix_tokens list ...
-        if self.check_if_answer_reached():
             self.answer_reached = True
+            prefix, token = self.matcher.match or (token, "")
             if self.stream_prefix:
-                message = self._construct_message(
-                    data=get_token_data("".join(self.last_tokens), self.mode),
-                    event=Events.COMPLETION,
+                await self._send_message(
+                    data=get_token_data(prefix, self.mode), event=Events.COMPLETION
                 )
-                await self.websocket.send_json(message)
-
-        # ... if yes, then print tokens from now on
-        if self.answer_reached:
-            message = self._construct_message(
-                data=get_token_data(token, self.mode), event=Events.COMPLETION
-            )
-            await self.websocket.send_json(message)
+            # only the text after the prefix belongs to the answer
+            if not token:
+                return
+
+        await self._send_message(
+            data=get_token_data(token, self.mode), event=Events.COMPLETION
+        )
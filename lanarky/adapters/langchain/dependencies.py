@@ -2,7 +2,9 @@ from typing import Any, Callable, Optional
 
 from fastapi import params
 from langchain.chains.base import Chain
+from langchain_core.runnables import Runnable
 
+from lanarky.adapters.langchain.responses import get_runnable_input
 from lanarky.adapters.langchain.utils import create_request_model, create_response_model
 from lanarky.utils import model_dump
 
@@ -25,10 +27,23 @@ def Depends(
     except TypeError:
         raise TypeError("set default values for all dependency parameters")
 
-    if not isinstance(chain, Chain):
-        raise TypeError("dependency must return a Chain instance")
+    if not isinstance(chain, Runnable):
+        raise TypeError("dependency must return a Chain or Runnable instance")
 
     request_model = create_request_model(chain)
+
+    if not isinstance(chain, Chain):
+
+        async def runnable_dependency(
+            request: request_model,
+            runnable: Runnable = params.Depends(dependency, use_cache=use_cache),
+        ) -> Any:
+            return await runnable.ainvoke(
+                get_runnable_input(runnable, model_dump(request)), **dependency_kwargs
+            )
+
+        return params.Depends(runnable_dependency, use_cache=use_cache)
+
     response_model = create_response_model(chain)
 
     async def chain_dependency(
@@ -0,0 +1,499 @@
+import asyncio
+import inspect
+import multiprocessing
+import itertools
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.context import BaseContext
+from multiprocessing.queues import SimpleQueue
+from typing import Any, Awaitable, Callable, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from lanarky.applications import register_shutdown_callback
+from lanarky.logging import logger
+from lanarky.metrics import metrics
+
+# seconds to wait for the callback events of a finished process chain
+PROCESS_EVENTS_TIMEOUT = 1.0
+
+
+class ChainExecutor:
+    """Bounded thread pool for chains running in `ChainRunMode.SYNC`.
+
+    Unlike the default executor of the event loop, the pool is dedicated to
+    chains, so slow chains cannot starve other blocking work and vice versa.
+    Calls beyond `max_workers` wait in the queue of the pool, and the number of
+    queued and active calls is reported in `stats`.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        *,
+        name: Optional[str] = None,
+        thread_name_prefix: str = "lanarky-chain",
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            max_workers: The maximum number of worker threads.
+            name: Optional name to register the executor stats with
+                `lanarky.metrics.metrics`.
+            thread_name_prefix: The name prefix of the worker threads.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be greater than 0")
+
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.max_queued = 0
+
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        if name is not None:
+            metrics.register(name, self.stats)
+        register_shutdown_callback(self.ashutdown)
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a function in a worker thread.
+
+        Args:
+            func: The function to run.
+            *args: Positional arguments to pass to the function.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=self.thread_name_prefix,
+            )
+
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        future = self._executor.submit(self._call, func, *args)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict[str, int]:
+        return dict(
+            max_workers=self.max_workers,
+            queued=self.queued,
+            active=self.active,
+            completed=self.completed,
+            max_queued=self.max_queued,
+        )
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shut down the worker threads. The pool is recreated on the next run.
+
+        Args:
+            wait: Whether to wait for running calls to finish.
+        """
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    async def ashutdown(self) -> None:
+        """Shut down the worker threads without waiting for running calls."""
+        self.shutdown(wait=False)
+
+    def _on_done(self, future: Future) -> None:
+        if future.cancelled():
+            # cancelled before it started, e.g. after a client disconnect
+            with self._lock:
+                self.queued -= 1
+
+    def _call(self, func: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+
+class ThreadSafeBridge:
+    """Forwards calls of an async callable from worker threads to the event loop.
+
+    Callback handlers of chains running in a worker thread are awaited on an
+    event loop of that thread, so they cannot write to the ASGI `send` or the
+    websocket of the request directly. The bridge is awaitable from any thread:
+    items are put into a queue with `call_soon_threadsafe` and a writer task on
+    the event loop of the request passes them on in order.
+
+    Usage:
+        ```python
+        async with ThreadSafeBridge(send) as bridge:
+            await executor.run(partial(chain, inputs, callbacks=callbacks))
+        ```
+    """
+
+    def __init__(self, func: Callable[[Any], Awaitable[Any]]) -> None:
+        """Constructor method.
+
+        Args:
+            func: The async callable to forward items to, e.g. an ASGI `send`.
+        """
+        self.func = func
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def __call__(self, item: Any) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+
+    # duck-typed websocket for websocket callback handlers
+    send_json = __call__
+
+    async def __aenter__(self) -> "ThreadSafeBridge":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, *args: Any) -> None:
+        if exc_type is None:
+            await self.join()
+        self.close()
+
+    def start(self) -> None:
+        """Start the writer task on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._writer = self._loop.create_task(self._write())
+
+    async def join(self) -> None:
+        """Wait until all items put so far are forwarded."""
+        join = asyncio.ensure_future(self._queue.join())
+        await asyncio.wait([join, self._writer], return_when=asyncio.FIRST_COMPLETED)
+        join.cancel()
+        if self._writer.done():
+            self._writer.result()
+
+    def close(self) -> None:
+        """Stop the writer task and drop pending items."""
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+
+    async def _write(self) -> None:
+        while True:
+            item = await self._queue.get()
+            try:
+                await self.func(item)
+            except Exception as e:
+                logger.error(f"thread-safe bridge error: {e}")
+                raise
+            finally:
+                self._queue.task_done()
+
+
+class ChainProcessPool:
+    """Warm process pool for CPU-bound chains in `ChainRunMode.PROCESS`.
+
+    Chains run in worker processes, so they do not hold the GIL of the server
+    process and throughput scales across cores. Every worker process builds a
+    chain once per factory and reuses it. Callback events of the chain are
+    sent back over a pipe shared by the worker processes, which a dedicated
+    reader thread dispatches to the callback handlers of the request, so
+    tokens stream as with the other run modes.
+
+    Worker processes are started with `forkserver` where available, and
+    `spawn` otherwise, so they do not fork the threads of the server process.
+    Factories must be picklable, i.e. defined at module level.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        *,
+        name: Optional[str] = None,
+        mp_context: Optional[BaseContext] = None,
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            max_workers: The number of worker processes. Defaults to the number
+                of CPUs.
+            name: Optional name to register the pool stats with
+                `lanarky.metrics.metrics`.
+            mp_context: The multiprocessing context of the worker processes.
+                Defaults to `get_process_context()`.
+        """
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.mp_context = mp_context
+
+        self.queued = 0
+        self.completed = 0
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._events: Optional[SimpleQueue] = None
+        self._requests: dict[int, tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+        self._request_ids = itertools.count()
+
+        if name is not None:
+            metrics.register(name, self.stats)
+        register_shutdown_callback(self.ashutdown)
+
+    def bind(self, factory: Callable[[], Any]) -> "ProcessChain":
+        """Bind a chain factory to the pool.
+
+        Args:
+            factory: A picklable chain factory function.
+        """
+        return ProcessChain(self, factory)
+
+    async def run(
+        self,
+        factory: Callable[[], Any],
+        inputs: dict[str, Any],
+        callbacks: Optional[list[Any]] = None,
+    ) -> dict[str, Any]:
+        """Run a chain in a worker process.
+
+        Args:
+            factory: A picklable chain factory function.
+            inputs: The chain inputs.
+            callbacks: Callback handlers to dispatch the chain events to.
+        """
+        executor = self._get_executor()
+        request_id = next(self._request_ids)
+        events: asyncio.Queue = asyncio.Queue()
+
+        loop = asyncio.get_running_loop()
+        self._requests[request_id] = (loop, events)
+        self.queued += 1
+        try:
+            future = loop.run_in_executor(
+                executor, _run_process_chain, factory, inputs, request_id
+            )
+            await self._dispatch(events, future, callbacks or [])
+            return await future
+        finally:
+            del self._requests[request_id]
+            self.queued -= 1
+            self.completed += 1
+
+    async def warm_up(self, factory: Callable[[], Any]) -> None:
+        """Build chains in the worker processes ahead of the first request.
+
+        Args:
+            factory: A picklable chain factory function.
+        """
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, _build_process_chain, factory)
+                for _ in range(self.max_workers)
+            )
+        )
+
+    def stats(self) -> dict[str, int]:
+        return dict(
+            max_workers=self.max_workers, queued=self.queued, completed=self.completed
+        )
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shut down the worker processes. The pool is recreated on the next run.
+
+        Args:
+            wait: Whether to wait for running chains to finish.
+        """
+        executor, self._executor = self._executor, None
+        events, self._events = self._events, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if events is not None:
+            # stop the reader thread
+            events.put(None)
+
+    async def ashutdown(self) -> None:
+        """Shut down the worker processes without waiting for running chains."""
+        self.shutdown(wait=False)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = self.mp_context or get_process_context()
+            self._events = context.SimpleQueue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_process_worker,
+                initargs=(self._events,),
+            )
+            threading.Thread(
+                target=self._read_events,
+                args=(self._events,),
+                name="lanarky-process-events",
+                daemon=True,
+            ).start()
+        return self._executor
+
+    def _read_events(self, events: SimpleQueue) -> None:
+        try:
+            while True:
+                item = events.get()
+                if item is None:
+                    return
+                request_id, event = item
+                target = self._requests.get(request_id)
+                if target is None:
+                    # the request was cancelled
+                    continue
+                loop, queue = target
+                try:
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+                except RuntimeError:
+                    # the event loop is closed
+                    continue
+        finally:
+            events.close()
+
+    async def _dispatch(
+        self, events: asyncio.Queue, future: asyncio.Future, callbacks: list[Any]
+    ) -> None:
+        while True:
+            if future.done():
+                if future.exception() is not None and events.empty():
+                    # the worker process may have died before the end event
+                    return
+                try:
+                    # events and results are sent over different pipes
+                    event = await asyncio.wait_for(events.get(), PROCESS_EVENTS_TIMEOUT)
+                except asyncio.TimeoutError:
+                    return
+            else:
+                get = asyncio.ensure_future(events.get())
+                await asyncio.wait([get, future], return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    continue
+                event = get.result()
+            if event is None:
+                return
+
+            name, args, kwargs = event
+            for callback in callbacks:
+                method = getattr(callback, name, None)
+                if method is None:
+                    continue
+                result = method(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    await result
+
+
+class ProcessChain:
+    """A chain factory bound to a `ChainProcessPool`."""
+
+    def __init__(self, pool: ChainProcessPool, factory: Callable[[], Any]) -> None:
+        """Constructor method.
+
+        Args:
+            pool: The process pool.
+            factory: A picklable chain factory function.
+        """
+        self.pool = pool
+        self.factory = factory
+
+    async def run(
+        self, inputs: dict[str, Any], callbacks: Optional[list[Any]] = None
+    ) -> dict[str, Any]:
+        """Run the chain in a worker process.
+
+        Args:
+            inputs: The chain inputs.
+            callbacks: Callback handlers to dispatch the chain events to.
+        """
+        return await self.pool.run(self.factory, inputs, callbacks)
+
+    async def warm_up(self) -> None:
+        """Build the chain in the worker processes."""
+        await self.pool.warm_up(self.factory)
+
+
+def get_process_context() -> BaseContext:
+    """Get the default multiprocessing context of `ChainProcessPool`.
+
+    Forking a server process copies its threads in an undefined state, so the
+    `forkserver` start method is used where available, and `spawn` otherwise.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+# chains built in a worker process, keyed by factory
+_process_chains: dict[Callable[[], Any], Any] = {}
+
+# the pipe of callback events to the server process
+_process_events: Optional[SimpleQueue] = None
+
+
+def _init_process_worker(events: SimpleQueue) -> None:
+    global _process_events
+
+    _process_events = events
+
+
+def _build_process_chain(factory: Callable[[], Any]) -> None:
+    if factory not in _process_chains:
+        _process_chains[factory] = factory()
+
+
+def _run_process_chain(
+    factory: Callable[[], Any], inputs: dict[str, Any], request_id: int
+) -> dict[str, Any]:
+    _build_process_chain(factory)
+    try:
+        return _process_chains[factory](
+            inputs, callbacks=[_EventRelay(_process_events, request_id)]
+        )
+    finally:
+        _process_events.put((request_id, None))
+
+
+class _EventRelay(BaseCallbackHandler):
+    """Sends the callback events of a chain in a worker process to the server.
+
+    Chain events are only sent for the outermost chain, since the callback
+    handlers of Lanarky react to the final outputs.
+    """
+
+    def __init__(self, events: SimpleQueue, request_id: int) -> None:
+        self.events = events
+        self.request_id = request_id
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **_):
+        if parent_run_id is None:
+            self._put("on_chain_start", ({}, inputs), run_id, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, parent_run_id=None, **_):
+        if parent_run_id is None:
+            self._put("on_chain_end", (outputs,), run_id, parent_run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **_):
+        self._put("on_llm_start", ({}, prompts), run_id, parent_run_id)
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, parent_run_id=None, **_
+    ):
+        self._put("on_chat_model_start", ({}, messages), run_id, parent_run_id)
+
+    def on_llm_new_token(self, token, *, run_id, parent_run_id=None, **_):
+        self._put("on_llm_new_token", (token,), run_id, parent_run_id)
+
+    def on_retriever_end(self, documents, *, run_id, parent_run_id=None, **_):
+        self._put("on_retriever_end", (documents,), run_id, parent_run_id)
+
+    def _put(self, name: str, args: tuple, run_id, parent_run_id) -> None:
+        event = (name, args, dict(run_id=run_id, parent_run_id=parent_run_id))
+        self.events.put((self.request_id, event))
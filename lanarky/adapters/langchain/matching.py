@@ -0,0 +1,135 @@
+from collections import deque
+from typing import NamedTuple, Optional
+
+
+class PrefixMatch(NamedTuple):
+    """An answer prefix found in a token stream.
+
+    Attributes:
+        prefix: The matched text of the stream, including ignored whitespace.
+        remainder: The text of the last token after the prefix.
+    """
+
+    prefix: str
+    remainder: str
+
+
+class AnswerPrefixMatcher:
+    """Incremental matcher for several answer prefixes in a token stream.
+
+    Prefixes are matched on characters rather than tokens, so a match does not
+    depend on how the tokenizer splits the prefix. The matcher is an
+    Aho–Corasick automaton: every character of the stream is processed once,
+    and only a window of the length of the longest prefix is kept, so the cost
+    per token does not grow with the length of the stream.
+
+    Usage:
+        ```python
+        matcher = AnswerPrefixMatcher(["Final Answer:", "AI:"])
+        for token in tokens:
+            if match := matcher.feed(token):
+                break
+        ```
+    """
+
+    def __init__(self, prefixes: list[str], ignore_whitespace: bool = True) -> None:
+        """Constructor method.
+
+        Args:
+            prefixes: The answer prefixes to match.
+            ignore_whitespace: Whether to ignore whitespace in the prefixes and
+                in the stream.
+        """
+        self.ignore_whitespace = ignore_whitespace
+        self.prefixes = [self._normalize(prefix) for prefix in prefixes]
+        if not self.prefixes or not all(self.prefixes):
+            raise ValueError("answer prefixes must not be empty")
+
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # length of the longest prefix which ends at a state, 0 if none
+        self._output: list[int] = [0]
+        self._build()
+
+        self.reset()
+
+    def reset(self) -> None:
+        """Reset the matcher to the start of a new stream."""
+        self.match: Optional[PrefixMatch] = None
+        self._state = 0
+        # stream text since the first character in the window
+        self._text = ""
+        self._offset = 0
+        # stream positions of the last matched characters
+        self._positions: deque[int] = deque(maxlen=max(map(len, self.prefixes)))
+
+    def feed(self, token: str) -> Optional[PrefixMatch]:
+        """Process the next token of the stream.
+
+        Args:
+            token: The token text.
+
+        Returns:
+            The first match of an answer prefix, if it ends in this token.
+        """
+        if self.match is not None:
+            return None
+
+        start = self._offset + len(self._text)
+        self._text += token
+        for i, char in enumerate(token):
+            if self.ignore_whitespace and char.isspace():
+                continue
+            self._positions.append(start + i)
+
+            state = self._state
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            self._state = state = self._goto[state].get(char, 0)
+
+            length = self._output[state]
+            if length:
+                begin = self._positions[-length] - self._offset
+                self.match = PrefixMatch(
+                    prefix=self._text[begin : start + i + 1 - self._offset],
+                    remainder=token[i + 1 :],
+                )
+                return self.match
+
+        # keep the text of the window only
+        end = self._positions[0] if self._positions else start + len(token)
+        self._text = self._text[end - self._offset :]
+        self._offset = end
+        return None
+
+    def _normalize(self, text: str) -> str:
+        if self.ignore_whitespace:
+            return "".join(char for char in text if not char.isspace())
+        return text
+
+    def _build(self) -> None:
+        for prefix in self.prefixes:
+            state = 0
+            for char in prefix:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(0)
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state] = max(self._output[state], len(prefix))
+
+        # breadth-first, so that the fail states are built before their children
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                if state:
+                    self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = max(
+                    self._output[child], self._output[self._fail[child]]
+                )
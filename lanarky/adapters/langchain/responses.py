@@ -1,15 +1,26 @@
 import asyncio
+import threading
 from functools import partial
-from typing import Any
+from typing import Any, Callable, Optional, Union
 
+import anyio
 from fastapi import status
 from langchain.chains.base import Chain
-from starlette.types import Send
+from langchain_core.runnables import Runnable
+from starlette.types import Message, Send
 
-from lanarky.events import Events, ServerSentEvent, ensure_bytes
+from lanarky.adapters.langchain.callbacks import TokenStreamMode, get_chunk_data
+from lanarky.adapters.langchain.executors import (
+    ChainExecutor,
+    ProcessChain,
+    ThreadSafeBridge,
+)
+from lanarky.cache import BaseCache
+from lanarky.events import Events
 from lanarky.logging import logger
 from lanarky.responses import HTTPStatusDetail
 from lanarky.responses import StreamingResponse as _StreamingResponse
+from lanarky.responses import aclose_iterator
 from lanarky.utils import StrEnum
 
 
@@ -18,6 +29,7 @@ class ChainRunMode(StrEnum):
 
     ASYNC = "async"
     SYNC = "sync"
+    PROCESS = "process"
 
 
 class StreamingResponse(_StreamingResponse):
@@ -25,17 +37,32 @@ class StreamingResponse(_StreamingResponse):
 
     def __init__(
         self,
-        chain: Chain,
+        chain: Union[Chain, Runnable],
         config: dict[str, Any],
         run_mode: ChainRunMode = ChainRunMode.ASYNC,
+        stream_mode: TokenStreamMode = TokenStreamMode.JSON,
+        executor: Optional[Union[ChainExecutor, ProcessChain]] = None,
+        cache: Optional[BaseCache] = None,
+        cache_key: Optional[str] = None,
         *args: Any,
         **kwargs: dict[str, Any],
     ) -> None:
         """Constructor method.
 
         Args:
-            chain: A LangChain instance.
-            config: A config dict.
+            chain: A LangChain instance. `Chain` instances are called with
+                callbacks; other runnables (e.g. LCEL chains) are streamed
+                with `astream`.
+            config: A config dict with `inputs` and optional `callbacks`.
+            run_mode: The run mode of `Chain` instances.
+            stream_mode: The stream mode of runnable output chunks.
+            executor: The thread pool of `ChainRunMode.SYNC`, which defaults to
+                the default executor of the event loop, or the `ProcessChain`
+                required by `ChainRunMode.PROCESS`.
+            cache: Opt-in cache of the streamed events. Completed streams are
+                stored under `cache_key`, and cache hits replay the events
+                without running the chain.
+            cache_key: The cache key of the response, required with `cache`.
             *args: Positional arguments to pass to the parent constructor.
             **kwargs: Keyword arguments to pass to the parent constructor.
         """
@@ -49,17 +76,65 @@ class StreamingResponse(_StreamingResponse):
                 f"Invalid run mode '{run_mode}'. Must be one of {list(ChainRunMode)}"
             )
 
+        if run_mode == ChainRunMode.PROCESS and not isinstance(executor, ProcessChain):
+            raise ValueError("ChainRunMode.PROCESS requires a ProcessChain executor")
+
         self.run_mode = run_mode
 
+        if stream_mode not in list(TokenStreamMode):
+            raise ValueError(f"Invalid stream mode: {stream_mode}")
+        self.stream_mode = stream_mode
+        self.executor = executor
+
+        if cache is not None and cache_key is None:
+            raise ValueError("cache_key is required with cache")
+        self.cache = cache
+        self.cache_key = cache_key
+
+        self._worker_call: Optional[_WorkerCall] = None
+
     async def stream_response(self, send: Send) -> None:
         """Stream LangChain outputs.
 
+        Runnables which are not `Chain` instances are iterated with `astream`,
+        and every output chunk is sent as a completion event. `Chain` instances
+        stream through the callback handlers in `config`.
+
         If an exception occurs while iterating over the LangChain, an
-        internal server error is sent to the client.
+        internal server error is sent to the client. If the client disconnects,
+        the chain task is cancelled and the background task receives empty
+        `outputs`.
+
+        Chains running in `ChainRunMode.SYNC` stream their tokens through a
+        `ThreadSafeBridge`, since their callback handlers run in a worker thread.
+
+        Chains running in `ChainRunMode.PROCESS` are built from their factory
+        in a worker process, and their callback events are dispatched to the
+        callback handlers in `config`.
+
+        Note: chains running in `ChainRunMode.SYNC` or `ChainRunMode.PROCESS`
+        cannot be interrupted and run to completion in the executor. Since
+        chains in `ChainRunMode.SYNC` keep calling their callback handlers,
+        the completion callbacks, which release the handlers and the chain,
+        are deferred until the worker thread returns.
+
+        With `cache`, the events of completed streams are cached, and cache hits
+        are replayed event by event. The background task of a cache hit
+        receives empty `outputs`.
 
         Args:
             send: The ASGI send callable.
         """
+        chunks: Optional[list[bytes]] = None
+        if self.cache is not None:
+            cached = await self.cache.aget(self.cache_key)
+            if cached is not None:
+                await self._replay(cached, send)
+                return
+
+            chunks = []
+            send = partial(record_chunks, chunks, send)
+
         await send(
             {
                 "type": "http.response.start",
@@ -74,22 +149,32 @@ class StreamingResponse(_StreamingResponse):
                     callback.send = send
 
         try:
-            # TODO: migrate to `.ainvoke` when adding support
-            # for LCEL
-            if self.run_mode == ChainRunMode.ASYNC:
+            if not isinstance(self.chain, Chain):
+                outputs = await self._stream_runnable(send)
+            elif self.run_mode == ChainRunMode.ASYNC:
                 outputs = await self.chain.acall(**self.config)
-            else:
-                loop = asyncio.get_event_loop()
-                outputs = await loop.run_in_executor(
-                    None, partial(self.chain, **self.config)
+            elif self.run_mode == ChainRunMode.PROCESS:
+                outputs = await self.executor.run(
+                    self.config["inputs"], self.config.get("callbacks")
                 )
+            else:
+                outputs = await self._run_sync(send)
             if self.background is not None:
                 self.background.kwargs.update({"outputs": outputs})
+            if chunks is not None:
+                await self.cache.aset(
+                    self.cache_key, [chunk.decode("utf-8") for chunk in chunks]
+                )
+        except anyio.get_cancelled_exc_class():
+            logger.info("chain cancelled")
+            if self.background is not None:
+                self.background.kwargs.setdefault("outputs", {})
+            raise
         except Exception as e:
             logger.error(f"chain runtime error: {e}")
             if self.background is not None:
                 self.background.kwargs.update({"outputs": {}, "error": e})
-            chunk = ServerSentEvent(
+            chunk = self.encoder.encode(
                 data=dict(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail=HTTPStatusDetail.INTERNAL_SERVER_ERROR,
@@ -99,9 +184,169 @@ class StreamingResponse(_StreamingResponse):
             await send(
                 {
                     "type": "http.response.body",
-                    "body": ensure_bytes(chunk, None),
+                    "body": chunk,
                     "more_body": True,
                 }
             )
 
         await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _replay(self, chunks: list[str], send: Send) -> None:
+        if self.background is not None:
+            self.background.kwargs.update({"outputs": {}})
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        for chunk in chunks:
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk.encode("utf-8"),
+                    "more_body": True,
+                }
+            )
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _complete(self) -> None:
+        call, self._worker_call = self._worker_call, None
+        if call is not None and call.abandon():
+            task = asyncio.get_running_loop().create_task(
+                self._complete_after(call.finished)
+            )
+            _deferred_completions.add(task)
+            task.add_done_callback(_deferred_completions.discard)
+            return
+        await super()._complete()
+
+    async def _complete_after(self, finished: asyncio.Event) -> None:
+        await finished.wait()
+        logger.info("abandoned chain finished, releasing its resources")
+        await super()._complete()
+
+    async def _run_sync(self, send: Send) -> Any:
+        call = self._worker_call = _WorkerCall(partial(self.chain, **self.config))
+        async with ThreadSafeBridge(send) as bridge:
+            for callback in self.config.get("callbacks", []):
+                if hasattr(callback, "send"):
+                    callback.send = bridge
+
+            if self.executor is not None:
+                return await self.executor.run(call)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, call)
+
+    async def _stream_runnable(self, send: Send) -> Any:
+        config = None
+        if self.config.get("callbacks"):
+            config = {"callbacks": self.config["callbacks"]}
+
+        chunks = []
+        iterator = self.chain.astream(
+            get_runnable_input(self.chain, self.config["inputs"]), config=config
+        )
+        try:
+            async for chunk in iterator:
+                chunks.append(chunk)
+                data = get_chunk_data(chunk, self.stream_mode)
+                if not data:
+                    continue
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": self.encoder.encode(data=data, event=Events.COMPLETION),
+                        "more_body": True,
+                    }
+                )
+        finally:
+            await aclose_iterator(iterator)
+
+        return merge_chunks(chunks)
+
+
+# completions waiting for abandoned chains in worker threads
+_deferred_completions: set[asyncio.Task] = set()
+
+
+class _WorkerCall:
+    """Call in a worker thread which the request can abandon.
+
+    Calls abandoned before they start are skipped. Calls abandoned while
+    running set `finished` when they return.
+    """
+
+    def __init__(self, func: Callable[[], Any]) -> None:
+        self.func = func
+        self.finished = asyncio.Event()
+
+        self._loop = asyncio.get_running_loop()
+        self._lock = threading.Lock()
+        self._started = False
+        self._abandoned = False
+
+    def __call__(self) -> Any:
+        with self._lock:
+            if self._abandoned:
+                return None
+            self._started = True
+        try:
+            return self.func()
+        finally:
+            self._loop.call_soon_threadsafe(self.finished.set)
+
+    def abandon(self) -> bool:
+        """Abandon the call and return whether it is still running."""
+        with self._lock:
+            self._abandoned = True
+            return self._started and not self.finished.is_set()
+
+
+async def record_chunks(chunks: list[bytes], send: Send, message: Message) -> None:
+    """Record the body chunks of ASGI messages before sending them.
+
+    Args:
+        chunks: The list to append the body chunks to.
+        send: The ASGI send callable.
+        message: The ASGI message.
+    """
+    if message["type"] == "http.response.body" and message.get("body"):
+        chunks.append(message["body"])
+    await send(message)
+
+
+def merge_chunks(chunks: list[Any]) -> Any:
+    """Merge the output chunks of a runnable into its final output.
+
+    Args:
+        chunks: The output chunks.
+    """
+    if chunks and all(isinstance(chunk, str) for chunk in chunks):
+        return "".join(chunks)
+
+    output = None
+    for chunk in chunks:
+        try:
+            output = chunk if output is None else output + chunk
+        except TypeError:
+            # chunks which cannot be added, e.g. plain dicts, replace the output
+            output = chunk
+    return output
+
+
+def get_runnable_input(chain: Runnable, inputs: dict[str, Any]) -> Any:
+    """Get the input of a runnable from the validated request inputs.
+
+    Runnables whose input schema is not an object, e.g. runnables which take
+    a string, receive the value of the single `input` key.
+
+    Args:
+        chain: A runnable which is not a `Chain` instance.
+        inputs: The request inputs.
+    """
+    if chain.input_schema.schema().get("type") == "object" or "input" not in inputs:
+        return inputs
+    return inputs["input"]
@@ -1,10 +1,16 @@
-import inspect
-from typing import Any, Callable, Optional, Sequence
+from functools import partial
+from typing import Any, Callable, Optional, Sequence, Union
 
 from fastapi import params
-from fastapi.datastructures import Default
+from fastapi.datastructures import Default, DefaultPlaceholder
 from fastapi.routing import APIRoute, APIRouter, APIWebSocketRoute
+from langchain_core.runnables import Runnable
 
+from lanarky.cache import BaseCache
+from lanarky.factories import FactoryScope, is_factory
+from lanarky.streams import Broadcast
+
+from .executors import ChainExecutor, ChainProcessPool
 from .utils import build_factory_api_endpoint, build_factory_websocket_endpoint
 
 
@@ -17,6 +23,14 @@ class LangchainAPIRoute(APIRoute):
         endpoint: Callable[..., Any],
         *,
         response_model: Any = Default(None),
+        single_flight: Optional[Broadcast] = None,
+        factory_scope: FactoryScope = FactoryScope.REQUEST,
+        pool_size: int = 4,
+        buffer_size: Optional[int] = None,
+        executor: Optional[Union[ChainExecutor, ChainProcessPool]] = None,
+        cache: Optional[BaseCache] = None,
+        emit_on_retrieval: bool = False,
+        max_content_length: Optional[int] = None,
         **kwargs: dict[str, Any],
     ) -> None:
         """Constructor method.
@@ -25,13 +39,40 @@ class LangchainAPIRoute(APIRoute):
             path: The path for the route.
             endpoint: The endpoint to call when the route is requested.
             response_model: The response model to use for the route.
+            single_flight: Opt-in hub to coalesce identical in-flight requests.
+            factory_scope: The lifecycle scope of the factory instances.
+            pool_size: The number of instances used with `FactoryScope.POOLED`.
+            buffer_size: Opt-in size of the buffer between the callback
+                handlers and the client. If set, events are sent by a separate
+                writer task and coalesced when the buffer is full.
+            executor: Opt-in thread or process pool. `Chain` instances run in
+                `ChainRunMode.SYNC` on a `ChainExecutor`, or in
+                `ChainRunMode.PROCESS` on a `ChainProcessPool`.
+            cache: Opt-in cache of the streamed events. Repeated requests with
+                the same body are replayed from the cache without running the
+                chain.
+            emit_on_retrieval: Whether to stream source documents as soon as
+                the retriever returns them.
+            max_content_length: Optional maximum length of the page contents
+                of source documents.
             **kwargs: Keyword arguments to pass to the parent constructor.
         """
         # NOTE: LangchainAPIRoute is initialised again when
         # router is included in app. This is a hack to
         # build the factory endpoint only once.
-        if not inspect.iscoroutinefunction(endpoint):
-            factory_endpoint = build_factory_api_endpoint(path, endpoint)
+        if is_factory(endpoint, Runnable):
+            factory_endpoint = build_factory_api_endpoint(
+                path,
+                endpoint,
+                single_flight=single_flight,
+                factory_scope=factory_scope,
+                pool_size=pool_size,
+                buffer_size=buffer_size,
+                executor=executor,
+                cache=cache,
+                emit_on_retrieval=emit_on_retrieval,
+                max_content_length=max_content_length,
+            )
             super().__init__(
                 path, factory_endpoint, response_model=response_model, **kwargs
             )
@@ -48,6 +89,12 @@ class LangchainAPIWebSocketRoute(APIWebSocketRoute):
         endpoint: Callable[..., Any],
         *,
         name: Optional[str] = None,
+        factory_scope: FactoryScope = FactoryScope.REQUEST,
+        pool_size: int = 4,
+        buffer_size: Optional[int] = None,
+        executor: Optional[Union[ChainExecutor, ChainProcessPool]] = None,
+        emit_on_retrieval: bool = False,
+        max_content_length: Optional[int] = None,
         **kwargs: dict[str, Any],
     ) -> None:
         """Constructor method.
@@ -56,14 +103,35 @@ class LangchainAPIWebSocketRoute(APIWebSocketRoute):
             path: The path for the route.
             endpoint: The endpoint to call when the route is requested.
             name: The name of the route.
+            factory_scope: The lifecycle scope of the factory instances.
+            pool_size: The number of instances used with `FactoryScope.POOLED`.
+            buffer_size: Opt-in size of the buffer between the callback
+                handlers and the client. If set, events are sent by a separate
+                writer task and coalesced when the buffer is full.
+            executor: Opt-in thread or process pool. `Chain` instances run in
+                `ChainRunMode.SYNC` on a `ChainExecutor`, or in
+                `ChainRunMode.PROCESS` on a `ChainProcessPool`.
+            emit_on_retrieval: Whether to send source documents as soon as the
+                retriever returns them.
+            max_content_length: Optional maximum length of the page contents
+                of source documents.
             **kwargs: Keyword arguments to pass to the parent constructor.
         """
         super().__init__(path, endpoint, name=name, **kwargs)
         # NOTE: LangchainAPIRoute is initialised again when
         # router is included in app. This is a hack to
         # build the factory endpoint only once.
-        if not inspect.iscoroutinefunction(endpoint):
-            factory_endpoint = build_factory_websocket_endpoint(path, endpoint)
+        if is_factory(endpoint, Runnable):
+            factory_endpoint = build_factory_websocket_endpoint(
+                path,
+                endpoint,
+                factory_scope=factory_scope,
+                pool_size=pool_size,
+                buffer_size=buffer_size,
+                executor=executor,
+                emit_on_retrieval=emit_on_retrieval,
+                max_content_length=max_content_length,
+            )
             super().__init__(path, factory_endpoint, name=name, **kwargs)
         else:
             super().__init__(path, endpoint, name=name, **kwargs)
@@ -72,9 +140,82 @@ class LangchainAPIWebSocketRoute(APIWebSocketRoute):
 class LangchainAPIRouter(APIRouter):
     """APIRouter class for LangChain."""
 
-    def __init__(self, *, route_class: type[APIRoute] = LangchainAPIRoute, **kwargs):
+    def __init__(
+        self,
+        *,
+        route_class: type[APIRoute] = LangchainAPIRoute,
+        single_flight: Optional[Broadcast] = None,
+        factory_scope: FactoryScope = FactoryScope.REQUEST,
+        pool_size: int = 4,
+        buffer_size: Optional[int] = None,
+        executor: Optional[Union[ChainExecutor, ChainProcessPool]] = None,
+        cache: Optional[BaseCache] = None,
+        emit_on_retrieval: bool = False,
+        max_content_length: Optional[int] = None,
+        **kwargs: dict[str, Any],
+    ):
+        """Constructor method.
+
+        Args:
+            route_class: The route class to use for API routes.
+            single_flight: Opt-in hub to coalesce identical in-flight requests.
+                Concurrent requests with the same route, configuration and
+                body share one upstream generation.
+            factory_scope: The lifecycle scope of the factory instances:
+                built per request, once (singleton) or as a bounded pool.
+            pool_size: The number of instances used with `FactoryScope.POOLED`.
+            buffer_size: Opt-in size of the buffer between the callback
+                handlers and the client. If set, events are sent by a separate
+                writer task and coalesced when the buffer is full.
+            executor: Opt-in thread or process pool. `Chain` instances run in
+                `ChainRunMode.SYNC` on a `ChainExecutor`, or in
+                `ChainRunMode.PROCESS` on a `ChainProcessPool`.
+            cache: Opt-in cache of the streamed events of API routes. Use the
+                `cache` argument of `add_api_route` to enable it per route.
+            emit_on_retrieval: Whether to stream source documents as soon as
+                the retriever returns them. Use the `emit_on_retrieval`
+                argument of `add_api_route` or `add_api_websocket_route` to
+                set it per route.
+            max_content_length: Optional maximum length of the page contents
+                of source documents. Use the `max_content_length` argument of
+                `add_api_route` or `add_api_websocket_route` to set it per
+                route.
+            **kwargs: Keyword arguments to pass to the parent constructor.
+        """
         super().__init__(route_class=route_class, **kwargs)
 
+        self.single_flight = single_flight
+        self.factory_scope = factory_scope
+        self.pool_size = pool_size
+        self.buffer_size = buffer_size
+        self.executor = executor
+        self.cache = cache
+        self.emit_on_retrieval = emit_on_retrieval
+        self.max_content_length = max_content_length
+
+    def add_api_route(
+        self, path: str, endpoint: Callable[..., Any], **kwargs: dict[str, Any]
+    ) -> None:
+        cache = kwargs.pop("cache", self.cache)
+        emit_on_retrieval = kwargs.pop("emit_on_retrieval", self.emit_on_retrieval)
+        max_content_length = kwargs.pop("max_content_length", self.max_content_length)
+        route_class = kwargs.pop("route_class_override", None) or self.route_class
+        if issubclass(route_class, LangchainAPIRoute):
+            route_class = partial(
+                route_class,
+                single_flight=self.single_flight,
+                factory_scope=self.factory_scope,
+                pool_size=self.pool_size,
+                buffer_size=self.buffer_size,
+                executor=self.executor,
+                cache=cache,
+                emit_on_retrieval=emit_on_retrieval,
+                max_content_length=max_content_length,
+            )
+        super().add_api_route(
+            path, endpoint, route_class_override=route_class, **kwargs
+        )
+
     def add_api_websocket_route(
         self,
         path: str,
@@ -82,7 +223,14 @@ class LangchainAPIRouter(APIRouter):
         name: Optional[str] = None,
         *,
         dependencies: Optional[Sequence[params.Depends]] = None,
+        emit_on_retrieval: Union[bool, DefaultPlaceholder] = Default(None),
+        max_content_length: Union[int, None, DefaultPlaceholder] = Default(None),
     ) -> None:
+        if isinstance(emit_on_retrieval, DefaultPlaceholder):
+            emit_on_retrieval = self.emit_on_retrieval
+        if isinstance(max_content_length, DefaultPlaceholder):
+            max_content_length = self.max_content_length
+
         current_dependencies = self.dependencies.copy()
         if dependencies:
             current_dependencies.extend(dependencies)
@@ -93,5 +241,11 @@ class LangchainAPIRouter(APIRouter):
             name=name,
             dependencies=current_dependencies,
             dependency_overrides_provider=self.dependency_overrides_provider,
+            factory_scope=self.factory_scope,
+            pool_size=self.pool_size,
+            buffer_size=self.buffer_size,
+            executor=self.executor,
+            emit_on_retrieval=emit_on_retrieval,
+            max_content_length=max_content_length,
         )
         self.routes.append(route)
@@ -1,115 +1,558 @@
+import inspect
 import re
-from typing import Any, Awaitable, Callable
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional, Union
 
-from fastapi import Depends
+from fastapi import Depends, Header, Request
 from langchain.agents import AgentExecutor
 from langchain.chains.base import Chain
 from langchain.schema.document import Document
+from langchain_core.runnables import Runnable
 from pydantic import BaseModel, create_model
 from starlette.routing import compile_path
 
 from lanarky.adapters.langchain.callbacks import (
+    KNOWN_DOCUMENTS_HEADER,
+    CallbackHandlerPool,
     FinalTokenStreamingCallbackHandler,
     FinalTokenWebSocketCallbackHandler,
+    LangchainEvents,
     SourceDocumentsStreamingCallbackHandler,
     SourceDocumentsWebSocketCallbackHandler,
     TokenStreamingCallbackHandler,
+    TokenStreamMode,
     TokenWebSocketCallbackHandler,
+    get_chunk_data,
+    merge_token_events,
+    parse_document_ids,
+    send_websocket_message,
 )
-from lanarky.adapters.langchain.responses import HTTPStatusDetail, StreamingResponse
+from lanarky.adapters.langchain.executors import (
+    ChainExecutor,
+    ChainProcessPool,
+    ProcessChain,
+    ThreadSafeBridge,
+)
+from lanarky.adapters.langchain.responses import (
+    ChainRunMode,
+    HTTPStatusDetail,
+    StreamingResponse,
+    get_runnable_input,
+)
+from lanarky.applications import register_startup_callback
+from lanarky.cache import BaseCache
 from lanarky.events import Events
+from lanarky.factories import FactoryProvider, FactoryScope
 from lanarky.logging import logger
-from lanarky.utils import model_dump
-from lanarky.websockets import WebSocket, WebsocketSession
+from lanarky.responses import BackpressurePolicy
+from lanarky.streams import Broadcast, BroadcastChannel
+from lanarky.utils import canonical_hash, model_dump, parse_request
+from lanarky.websockets import (
+    BufferedWebSocket,
+    DataMode,
+    MessagePackWebSocket,
+    WebSocket,
+    WebsocketSession,
+    get_data_mode,
+    send_json,
+)
 
 
 def build_factory_api_endpoint(
-    path: str, endpoint: Callable[..., Any]
+    path: str,
+    endpoint: Callable[..., Any],
+    single_flight: Optional[Broadcast] = None,
+    factory_scope: FactoryScope = FactoryScope.REQUEST,
+    pool_size: int = 4,
+    buffer_size: Optional[int] = None,
+    executor: Optional[Union[ChainExecutor, ChainProcessPool]] = None,
+    cache: Optional[BaseCache] = None,
+    emit_on_retrieval: bool = False,
+    max_content_length: Optional[int] = None,
 ) -> Callable[..., Awaitable[Any]]:
     """Build a factory endpoint for API routes.
 
+    Async factories are built when the application starts up. Until then, the
+    endpoint responds with status 503.
+
+    Clients which send the `X-Known-Documents` header receive source documents
+    in reference mode: documents with a declared ID are streamed as IDs only.
+
     Args:
         path: The path for the route.
         endpoint: LangChain instance factory function.
+        single_flight: Opt-in hub to coalesce identical in-flight requests.
+        factory_scope: The lifecycle scope of the chains.
+        pool_size: The number of chains used with `FactoryScope.POOLED`.
+        buffer_size: Opt-in size of the buffer between the callback handlers
+            and the client.
+        executor: Opt-in thread pool to run `Chain` instances in
+            `ChainRunMode.SYNC`, or process pool for `ChainRunMode.PROCESS`.
+        cache: Opt-in cache of the streamed events, keyed on the route, chain
+            configuration and validated request body.
+        emit_on_retrieval: Whether to stream source documents as soon as the
+            retriever returns them.
+        max_content_length: Optional maximum length of the page contents of
+            source documents.
     """
-    chain = compile_chain_factory(endpoint)
+    executor = bind_process_pool(endpoint, executor)
+    callback_options = dict(
+        emit_on_retrieval=emit_on_retrieval, max_content_length=max_content_length
+    )
+
+    def create_response(
+        chain: Runnable, request: BaseModel, known_documents: Optional[str]
+    ) -> StreamingResponse:
+        inputs = model_dump(request)
+        # callback handlers hold per-request state, so they are never shared
+        callbacks = compiled["callbacks"].acquire()
+        use_document_references(callbacks, known_documents)
+        config = {"inputs": inputs, "callbacks": callbacks}
+        if buffer_size is not None:
+            kwargs = dict(
+                backpressure=BackpressurePolicy.COALESCE, max_buffer_size=buffer_size
+            )
+        else:
+            kwargs = {}
+        if isinstance(executor, ProcessChain):
+            kwargs.update(run_mode=ChainRunMode.PROCESS, executor=executor)
+        elif executor is not None and isinstance(chain, Chain):
+            kwargs.update(run_mode=ChainRunMode.SYNC, executor=executor)
+        if single_flight is not None or cache is not None:
+            key = canonical_hash(
+                dict(
+                    route=path,
+                    config=get_chain_config(chain),
+                    body=inputs,
+                    known_documents=known_documents,
+                )
+            )
+            if single_flight is not None:
+                kwargs.update(broadcast=single_flight, broadcast_key=key)
+            if cache is not None:
+                kwargs.update(cache=cache, cache_key=key)
+        response = StreamingResponse(chain=chain, config=config, **kwargs)
+        response.call_on_complete(partial(compiled["callbacks"].arelease, callbacks))
+        if not isinstance(executor, ProcessChain):
+            response.call_on_complete(provider.hand_off(chain))
+        return response
+
+    if inspect.iscoroutinefunction(endpoint):
+        provider = FactoryProvider(endpoint, factory_scope, pool_size)
+        compiled = register_chain_warm_up(
+            path,
+            provider,
+            streaming_callbacks=True,
+            executor=executor,
+            callback_options=callback_options,
+        )
+
+        async def async_factory_endpoint(
+            request: Request,
+            _: None = Depends(provider.ensure_ready),
+            chain: Runnable = Depends(
+                get_chain_dependency(provider, compiled, executor, lease=True)
+            ),
+            known_documents: Optional[str] = Header(None, alias=KNOWN_DOCUMENTS_HEADER),
+        ):
+            return create_response(
+                chain,
+                await parse_request(request, compiled["request_model"]),
+                known_documents,
+            )
+
+        return async_factory_endpoint
+
+    chain = compile_chain_factory(endpoint, executor)
+    provider = FactoryProvider(endpoint, factory_scope, pool_size, instance=chain)
 
     # index 1 of `compile_path` contains path_format output
     model_prefix = compile_model_prefix(compile_path(path)[1], chain)
     request_model = create_request_model(chain, model_prefix)
 
-    callbacks = get_streaming_callbacks(chain)
+    compiled = {
+        "chain": chain,
+        "callbacks": CallbackHandlerPool(
+            get_streaming_callbacks(chain, **callback_options)
+        ),
+    }
 
     async def factory_endpoint(
-        request: request_model, chain: Chain = Depends(endpoint)
+        request: request_model,
+        chain: Runnable = Depends(
+            get_chain_dependency(provider, compiled, executor, lease=True)
+        ),
+        known_documents: Optional[str] = Header(None, alias=KNOWN_DOCUMENTS_HEADER),
     ):
-        return StreamingResponse(
-            chain=chain, config={"inputs": model_dump(request), "callbacks": callbacks}
-        )
+        return create_response(chain, request, known_documents)
 
     return factory_endpoint
 
 
 def build_factory_websocket_endpoint(
-    path: str, endpoint: Callable[..., Any]
+    path: str,
+    endpoint: Callable[..., Any],
+    factory_scope: FactoryScope = FactoryScope.REQUEST,
+    pool_size: int = 4,
+    buffer_size: Optional[int] = None,
+    executor: Optional[Union[ChainExecutor, ChainProcessPool]] = None,
+    emit_on_retrieval: bool = False,
+    max_content_length: Optional[int] = None,
 ) -> Callable[..., Awaitable[Any]]:
     """Build a factory endpoint for WebSocket routes.
 
+    Async factories are built when the application starts up. Until then,
+    connections are closed with code 1013 (try again later).
+
+    Clients which connect with the `X-Known-Documents` header or the
+    `known_documents` query parameter receive source documents in reference
+    mode: documents declared by the client or already sent in the session are
+    sent as IDs only.
+
+    Clients which connect with the `msgpack` subprotocol send and receive
+    messages in `DataMode.MSGPACK`.
+
     Args:
         path: The path for the route.
         endpoint: LangChain instance factory function.
+        factory_scope: The lifecycle scope of the chains.
+        pool_size: The number of chains used with `FactoryScope.POOLED`.
+        buffer_size: Opt-in size of the buffer between the callback handlers
+            and the client.
+        executor: Opt-in thread pool to run `Chain` instances in
+            `ChainRunMode.SYNC`, or process pool for `ChainRunMode.PROCESS`.
+        emit_on_retrieval: Whether to send source documents as soon as the
+            retriever returns them.
+        max_content_length: Optional maximum length of the page contents of
+            source documents.
     """
-    chain = compile_chain_factory(endpoint)
+    executor = bind_process_pool(endpoint, executor)
+    if inspect.iscoroutinefunction(endpoint):
+        provider = FactoryProvider(endpoint, factory_scope, pool_size)
+        compiled = register_chain_warm_up(path, provider, executor=executor)
+    else:
+        chain = compile_chain_factory(endpoint, executor)
+        provider = FactoryProvider(endpoint, factory_scope, pool_size, instance=chain)
 
-    # index 1 of `compile_path` contains path_format output
-    model_prefix = compile_model_prefix(compile_path(path)[1], chain)
-    request_model = create_request_model(chain, model_prefix)
+        # index 1 of `compile_path` contains path_format output
+        model_prefix = compile_model_prefix(compile_path(path)[1], chain)
+        compiled = {
+            "chain": chain,
+            "request_model": create_request_model(chain, model_prefix),
+        }
 
-    async def factory_endpoint(websocket: WebSocket, chain: Chain = Depends(endpoint)):
-        callbacks = get_websocket_callbacks(chain, websocket)
-        async with WebsocketSession().connect(websocket) as session:
-            async for data in session:
-                try:
-                    await chain.acall(
-                        inputs=model_dump(request_model(**data)),
-                        callbacks=callbacks,
-                    )
-                except Exception as e:
-                    logger.error(f"langchain error: {e}")
-                    await websocket.send_json(
-                        dict(
-                            data=dict(
-                                status=500,
-                                detail=HTTPStatusDetail(
-                                    code=500,
-                                    message="Internal Server Error",
-                                ),
-                            ),
-                            event=Events.ERROR,
-                        )
+    async def factory_endpoint(
+        websocket: WebSocket,
+        _: None = Depends(provider.ensure_ready),
+        chain: Runnable = Depends(get_chain_dependency(provider, compiled, executor)),
+    ):
+        request_model = compiled["request_model"]
+        mode = get_data_mode(websocket)
+        sender = buffered = bridge = None
+        if mode == DataMode.MSGPACK:
+            sender = MessagePackWebSocket(
+                websocket,
+                json_events=(Events.COMPLETION, LangchainEvents.SOURCE_DOCUMENTS),
+            )
+        if buffer_size is not None:
+            sender = buffered = BufferedWebSocket(
+                sender or websocket, max_size=buffer_size, merge=merge_token_events
+            )
+        if isinstance(executor, ChainExecutor) and isinstance(chain, Chain):
+            # callback handlers of sync chains run in a worker thread
+            sender = bridge = ThreadSafeBridge(partial(send_json, sender or websocket))
+            bridge.start()
+        sender = sender or websocket
+
+        callbacks = get_websocket_callbacks(
+            chain,
+            sender,
+            emit_on_retrieval=emit_on_retrieval,
+            max_content_length=max_content_length,
+        )
+        use_document_references(
+            callbacks,
+            websocket.headers.get(
+                KNOWN_DOCUMENTS_HEADER, websocket.query_params.get("known_documents")
+            ),
+        )
+        try:
+            async with WebsocketSession().connect(websocket, mode) as session:
+                async for data in session:
+                    await run_chain(
+                        chain,
+                        model_dump(request_model(**data)),
+                        sender,
+                        callbacks,
+                        executor=executor,
                     )
-                await websocket.send_json(dict(data="", event=Events.END))
+                    if bridge is not None:
+                        await bridge.join()
+                    if buffered is not None:
+                        await buffered.drain()
+        finally:
+            if bridge is not None:
+                bridge.close()
+            if buffered is not None:
+                buffered.close()
+            if not isinstance(executor, ProcessChain):
+                await provider.release(chain)
 
     return factory_endpoint
 
 
-def compile_chain_factory(endpoint: Callable[..., Any]):
+def use_document_references(
+    callbacks: list[Callable], known_documents: Optional[str]
+) -> None:
+    """Switch source documents callback handlers to reference mode.
+
+    Args:
+        callbacks: Callback handlers of a request or websocket session.
+        known_documents: Comma-separated IDs of the documents known to the
+            client. Reference mode is only used if not `None`.
+    """
+    if known_documents is None:
+        return
+    for callback in callbacks:
+        if isinstance(
+            callback,
+            (
+                SourceDocumentsStreamingCallbackHandler,
+                SourceDocumentsWebSocketCallbackHandler,
+            ),
+        ):
+            callback.reference_mode = True
+            callback.known_document_ids = parse_document_ids(known_documents)
+
+
+def register_chain_warm_up(
+    path: str,
+    provider: FactoryProvider,
+    streaming_callbacks: bool = False,
+    executor: Optional[Union[ChainExecutor, ProcessChain]] = None,
+    callback_options: Optional[dict[str, Any]] = None,
+) -> dict[str, Any]:
+    """Register the startup warm-up of an async LangChain instance factory.
+
+    Args:
+        path: The path for the route.
+        provider: The provider of the LangChain instance factory.
+        streaming_callbacks: Whether to build the streaming callbacks as well.
+        executor: The executor of the route, to check the run mode.
+        callback_options: Keyword arguments for `get_streaming_callbacks`.
+
+    Returns:
+        A dict which holds the `chain`, `request_model` (and `callbacks`) once
+        the warm-up completed.
+    """
+    compiled: dict[str, Any] = {}
+
+    async def warm_up() -> None:
+        if compiled:
+            return
+        chain = await provider.build()
+        check_chain(chain, executor)
+
+        # index 1 of `compile_path` contains path_format output
+        model_prefix = compile_model_prefix(compile_path(path)[1], chain)
+        if streaming_callbacks:
+            compiled["callbacks"] = CallbackHandlerPool(
+                get_streaming_callbacks(chain, **(callback_options or {}))
+            )
+        compiled["request_model"] = create_request_model(chain, model_prefix)
+        compiled["chain"] = chain
+
+    register_startup_callback(warm_up)
+    return compiled
+
+
+def get_chain_dependency(
+    provider: FactoryProvider,
+    compiled: dict[str, Any],
+    executor: Optional[Union[ChainExecutor, ProcessChain]] = None,
+    lease: bool = False,
+) -> Callable[..., Any]:
+    """Get the FastAPI dependency which provides the LangChain instance of a request.
+
+    Chains bound to a process pool are built in the worker processes, so no
+    chain is built per request: the instance compiled for the route is used
+    for its type, configuration and callbacks only.
+
+    Args:
+        provider: The provider of the LangChain instance factory.
+        compiled: The compiled route, which holds the `chain`.
+        executor: The executor of the route.
+        lease: Whether to use `provider.lease_dependency`, for API routes.
+    """
+    if isinstance(executor, ProcessChain):
+
+        async def compiled_chain() -> Runnable:
+            return compiled["chain"]
+
+        return compiled_chain
+    return provider.lease_dependency if lease else provider.dependency
+
+
+async def run_chain(
+    chain: Runnable,
+    inputs: dict[str, Any],
+    websocket: Union[WebSocket, BroadcastChannel],
+    callbacks: Optional[list[Callable]] = None,
+    executor: Optional[Union[ChainExecutor, ProcessChain]] = None,
+) -> None:
+    """Run a LangChain instance and send its events as JSON.
+
+    Runnables which are not `Chain` instances are iterated with `astream`, and
+    every output chunk is sent as a completion event.
+
+    If an exception occurs, an internal server error event is sent. The events
+    always end with an `end` event.
+
+    Args:
+        chain: A LangChain instance.
+        inputs: The chain inputs.
+        websocket: A WebSocket or a `BroadcastChannel` instance.
+        callbacks: Websocket callbacks. Defaults to `get_websocket_callbacks`.
+        executor: Opt-in thread pool to run `Chain` instances synchronously,
+            in which case the callbacks must send through a `ThreadSafeBridge`,
+            or a `ProcessChain` to run them in a worker process.
+    """
+    if callbacks is None:
+        callbacks = get_websocket_callbacks(chain, websocket)
+
+    try:
+        if isinstance(chain, Chain) and isinstance(executor, ProcessChain):
+            await executor.run(inputs, callbacks)
+        elif isinstance(chain, Chain) and executor is not None:
+            await executor.run(partial(chain, inputs, callbacks=callbacks))
+        elif isinstance(chain, Chain):
+            await chain.acall(inputs=inputs, callbacks=callbacks)
+        else:
+            config = {"callbacks": callbacks} if callbacks else None
+            runnable_input = get_runnable_input(chain, inputs)
+            async for chunk in chain.astream(runnable_input, config=config):
+                data = get_chunk_data(chunk, TokenStreamMode.JSON)
+                if data:
+                    await send_websocket_message(websocket, data, Events.COMPLETION)
+    except Exception as e:
+        logger.error(f"langchain error: {e}")
+        await send_json(
+            websocket,
+            dict(
+                data=dict(
+                    status=500,
+                    detail=HTTPStatusDetail(
+                        code=500,
+                        message="Internal Server Error",
+                    ),
+                ),
+                event=Events.ERROR,
+            ),
+        )
+    await send_json(websocket, dict(data="", event=Events.END))
+
+
+def bind_process_pool(
+    endpoint: Callable[..., Any],
+    executor: Optional[Union[ChainExecutor, ChainProcessPool]],
+) -> Optional[Union[ChainExecutor, ProcessChain]]:
+    """Bind a chain factory to a process pool and register its warm-up.
+
+    Args:
+        endpoint: LangChain instance factory function.
+        executor: A thread or process pool.
+
+    Returns:
+        A `ProcessChain` for process pools, otherwise `executor`.
+    """
+    if not isinstance(executor, ChainProcessPool):
+        return executor
+
+    process_chain = executor.bind(endpoint)
+    register_startup_callback(process_chain.warm_up)
+    return process_chain
+
+
+def build_broadcast_producer(
+    chain: Runnable, inputs: dict[str, Any]
+) -> Callable[[BroadcastChannel], Awaitable[None]]:
+    """Build a producer which publishes LangChain events to a channel.
+
+    Usage:
+        ```python
+        channel = broadcast.publish(key, build_broadcast_producer(chain, inputs))
+        ```
+
+    Args:
+        chain: A LangChain instance.
+        inputs: The chain inputs.
+    """
+    return partial(run_chain, chain, inputs)
+
+
+def compile_chain_factory(
+    endpoint: Callable[..., Any],
+    executor: Optional[Union[ChainExecutor, ProcessChain]] = None,
+):
     """Compile a LangChain instance factory function.
 
     Args:
         endpoint: LangChain instance factory function.
+        executor: The executor of the route, to check the run mode.
     """
     try:
         chain = endpoint()
     except TypeError:
         raise TypeError("set default values for all factory endpoint parameters")
 
-    if not isinstance(chain, Chain):
-        raise TypeError("factory endpoint must return a Chain instance")
+    check_chain(chain, executor)
     return chain
 
 
-def create_request_model(chain: Chain, prefix: str = "") -> BaseModel:
+def check_chain(
+    chain: Any, executor: Optional[Union[ChainExecutor, ProcessChain]] = None
+) -> None:
+    """Check the LangChain instance built by a factory.
+
+    Args:
+        chain: The instance built by the factory.
+        executor: The executor of the route.
+    """
+    if not isinstance(chain, Runnable):
+        raise TypeError("factory endpoint must return a Chain or Runnable instance")
+    if isinstance(executor, ProcessChain) and not isinstance(chain, Chain):
+        raise TypeError("process pools require a factory which returns a Chain")
+
+
+def get_chain_config(chain: Runnable) -> dict[str, Any]:
+    """Get the configuration of a LangChain instance.
+
+    Args:
+        chain: A LangChain instance.
+    """
+    try:
+        return chain.dict()
+    except Exception:
+        # some chains do not support serialization
+        return dict(chain=repr(chain))
+
+
+def get_input_keys(chain: Runnable) -> list[str]:
+    """Get the input keys of a LangChain instance.
+
+    The input keys of runnables are the properties of their input schema.
+    Runnables without properties get a single `input` key, whose value is
+    passed as the input of runnables which do not take an object.
+
+    Args:
+        chain: A LangChain instance.
+    """
+    if isinstance(chain, Chain):
+        return chain.input_keys
+    return list(chain.input_schema.schema().get("properties", {})) or ["input"]
+
+
+def create_request_model(chain: Runnable, prefix: str = "") -> BaseModel:
     """Create a pydantic request model for a LangChain instance.
 
     Args:
@@ -118,7 +561,7 @@ def create_request_model(chain: Chain, prefix: str = "") -> BaseModel:
     """
     request_fields = {}
 
-    for key in chain.input_keys:
+    for key in get_input_keys(chain):
         # TODO: add support for other input key types
         # based on demand
         if key == "chat_history":
@@ -153,7 +596,7 @@ def create_response_model(chain: Chain, prefix: str = None) -> BaseModel:
     return create_model(f"{prefix}Response", **response_fields)
 
 
-def compile_model_prefix(path: str, chain: Chain) -> str:
+def compile_model_prefix(path: str, chain: Runnable) -> str:
     """Compile a prefix for pydantic models.
 
     Args:
@@ -169,7 +612,11 @@ def compile_model_prefix(path: str, chain: Chain) -> str:
     return f"{path_prefix}{chain_prefix}"
 
 
-def get_streaming_callbacks(chain: Chain) -> list[Callable]:
+def get_streaming_callbacks(
+    chain: Runnable,
+    emit_on_retrieval: bool = False,
+    max_content_length: Optional[int] = None,
+) -> list[Callable]:
     """Get streaming callbacks for a LangChain instance.
 
     Note: This function might not support all LangChain
@@ -178,11 +625,24 @@ def get_streaming_callbacks(chain: Chain) -> list[Callable]:
 
     Args:
         chain: A LangChain instance.
+        emit_on_retrieval: Whether to stream source documents as soon as the
+            retriever returns them.
+        max_content_length: Optional maximum length of the page contents of
+            source documents.
     """
     callbacks = []
 
+    if not isinstance(chain, Chain):
+        # runnables stream their outputs with `astream`
+        return callbacks
+
     if "source_documents" in chain.output_keys:
-        callbacks.append(SourceDocumentsStreamingCallbackHandler())
+        callbacks.append(
+            SourceDocumentsStreamingCallbackHandler(
+                emit_on_retrieval=emit_on_retrieval,
+                max_content_length=max_content_length,
+            )
+        )
 
     if len(set(chain.output_keys) - {"source_documents"}) > 1:
         logger.warning(
@@ -204,7 +664,12 @@ def get_streaming_callbacks(chain: Chain) -> list[Callable]:
     return callbacks
 
 
-def get_websocket_callbacks(chain: Chain, websocket: WebSocket) -> list[Callable]:
+def get_websocket_callbacks(
+    chain: Runnable,
+    websocket: WebSocket,
+    emit_on_retrieval: bool = False,
+    max_content_length: Optional[int] = None,
+) -> list[Callable]:
     """Get websocket callbacks for a LangChain instance.
 
     Note: This function might not support all LangChain
@@ -214,11 +679,25 @@ def get_websocket_callbacks(chain: Chain, websocket: WebSocket) -> list[Callable
     Args:
         chain: A LangChain instance.
         websocket: A WebSocket instance.
+        emit_on_retrieval: Whether to send source documents as soon as the
+            retriever returns them.
+        max_content_length: Optional maximum length of the page contents of
+            source documents.
     """
     callbacks = []
 
+    if not isinstance(chain, Chain):
+        # runnables stream their outputs with `astream`
+        return callbacks
+
     if "source_documents" in chain.output_keys:
-        callbacks.append(SourceDocumentsWebSocketCallbackHandler(websocket=websocket))
+        callbacks.append(
+            SourceDocumentsWebSocketCallbackHandler(
+                websocket=websocket,
+                emit_on_retrieval=emit_on_retrieval,
+                max_content_length=max_content_length,
+            )
+        )
 
     if len(set(chain.output_keys) - {"source_documents"}) > 1:
         logger.warning(
@@ -0,0 +1,82 @@
+import os
+from typing import Any, Optional
+
+import httpx
+from openai import DEFAULT_CONNECTION_LIMITS, AsyncOpenAI, DefaultAsyncHttpxClient
+
+from lanarky.applications import register_shutdown_callback
+from lanarky.logging import logger
+from lanarky.utils import canonical_hash
+
+
+class OpenAIClientRegistry:
+    """Process-wide registry of pooled `AsyncOpenAI` clients.
+
+    Clients are keyed by base URL, API key and client settings, so that
+    resources created per request share one HTTP connection pool instead of
+    opening new upstream connections every time.
+    """
+
+    def __init__(self, limits: Optional[httpx.Limits] = None) -> None:
+        """Constructor method.
+
+        Args:
+            limits: Connection pool limits of the clients. Defaults to the
+                OpenAI SDK limits.
+        """
+        self.limits = limits or DEFAULT_CONNECTION_LIMITS
+
+        self._clients: dict[str, AsyncOpenAI] = {}
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def get(
+        self,
+        *,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        **kwargs: dict[str, Any],
+    ) -> AsyncOpenAI:
+        """Get a pooled client, creating it on first use.
+
+        Args:
+            api_key: The OpenAI API key. Defaults to `OPENAI_API_KEY`.
+            base_url: The API base URL. Defaults to `OPENAI_BASE_URL`.
+            **kwargs: Keyword arguments to pass to the `AsyncOpenAI` constructor.
+        """
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        base_url = base_url or os.environ.get("OPENAI_BASE_URL")
+        key = canonical_hash(dict(api_key=api_key, base_url=base_url, **kwargs))
+
+        client = self._clients.get(key)
+        if client is None or client.is_closed():
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultAsyncHttpxClient(limits=self.limits),
+                **kwargs,
+            )
+            self._clients[key] = client
+        return client
+
+    async def aclose(self) -> None:
+        """Close all clients and their connection pools."""
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.close()
+        if clients:
+            logger.debug(f"closed {len(clients)} openai client(s)")
+
+
+client_registry = OpenAIClientRegistry()
+register_shutdown_callback(client_registry.aclose)
+
+
+def get_client(**kwargs: dict[str, Any]) -> AsyncOpenAI:
+    """Get a pooled `AsyncOpenAI` client from the process-wide registry.
+
+    Args:
+        **kwargs: Keyword arguments to pass to `OpenAIClientRegistry.get`.
+    """
+    return client_registry.get(**kwargs)
@@ -1,11 +1,14 @@
 from abc import abstractmethod
-from typing import Any, Generator
+from typing import Any, Generator, Optional
 
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, AsyncStream
 from openai.types.chat import ChatCompletion, ChatCompletionChunk
 from pydantic import BaseModel, Field
 
-from lanarky.utils import model_dump
+from lanarky.cache import BaseCache
+from lanarky.utils import canonical_hash, model_dump
+
+from .clients import get_client
 
 
 class Message(BaseModel):
@@ -22,7 +25,19 @@ class OpenAIResource:
     """Base class for OpenAI resources."""
 
     def __init__(self, client: AsyncOpenAI = None):
-        self._client = client or AsyncOpenAI()
+        """Constructor method.
+
+        Args:
+            client: An AsyncOpenAI instance. Defaults to a pooled client from
+                the process-wide client registry.
+        """
+        self._client = client or get_client()
+
+    def config(self) -> dict[str, Any]:
+        """Get the configuration which determines the resource outputs."""
+        return dict(
+            resource=self.__class__.__name__, base_url=str(self._client.base_url)
+        )
 
     @abstractmethod
     async def stream_response(
@@ -40,6 +55,7 @@ class ChatCompletionResource(OpenAIResource):
         model: str = "gpt-3.5-turbo",
         stream: bool = False,
         system: str = None,
+        cache: Optional[BaseCache] = None,
         **create_kwargs: dict[str, Any],
     ):
         """Constructor method.
@@ -49,6 +65,9 @@ class ChatCompletionResource(OpenAIResource):
             model: The model to use for completions.
             stream: Whether to stream completions.
             system: A system message to prepend to the messages.
+            cache: Opt-in response cache, keyed on model, messages, system
+                message and `create_kwargs`. Only use it for deterministic
+                completions, e.g. with `temperature=0` and a fixed `seed`.
             **create_kwargs: Keyword arguments to pass to the `chat.completions.create` method.
         """
         super().__init__(client=client)
@@ -56,19 +75,34 @@ class ChatCompletionResource(OpenAIResource):
         self.model = model
         self.stream = stream
         self.system = SystemMessage(content=system) if system else None
+        self.cache = cache
         self.create_kwargs = create_kwargs
 
     async def stream_response(self, messages: list[dict]) -> Generator[str, None, None]:
         """Stream chat completions.
 
         If `stream` attribute is False, the generator will yield only one completion.
-        Otherwise, it will yield chunk completions.
+        Otherwise, it will yield chunk completions. Closing the generator closes
+        the underlying HTTP stream.
+
+        If `cache` is set, completed streams are cached and cache hits replay
+        the cached chunks without calling the API.
 
         Args:
             messages: A list of messages to use for the completion.
                 message format: {"role": "user", "content": "Hello, world!"}
         """
         messages = self._prepare_messages(messages)
+
+        key = None
+        if self.cache is not None:
+            key = self._cache_key("stream" if self.stream else "chunk", messages)
+            chunks = await self.cache.aget(key)
+            if chunks is not None:
+                for chunk in chunks:
+                    yield chunk
+                return
+
         data = await self._client.chat.completions.create(
             messages=messages,
             model=self.model,
@@ -76,17 +110,38 @@ class ChatCompletionResource(OpenAIResource):
             **self.create_kwargs,
         )
 
+        chunks = []
         if self.stream:
-            async for chunk in data:
-                if not isinstance(chunk, ChatCompletionChunk):
-                    raise TypeError(f"Unexpected data type: {type(data)}")
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            try:
+                async for chunk in data:
+                    if not isinstance(chunk, ChatCompletionChunk):
+                        raise TypeError(f"Unexpected data type: {type(data)}")
+                    if chunk.choices[0].delta.content is not None:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                if isinstance(data, AsyncStream):
+                    await data.close()
         else:
             if not isinstance(data, ChatCompletion):
                 raise TypeError(f"Unexpected data type: {type(data)}")
+            chunks.append(data.choices[0].message.content)
             yield data.choices[0].message.content
 
+        # only completed streams reach this point
+        if key is not None:
+            await self.cache.aset(key, chunks)
+
+    def config(self) -> dict[str, Any]:
+        """Get the configuration which determines the resource outputs."""
+        return dict(
+            super().config(),
+            model=self.model,
+            stream=self.stream,
+            system=self.system.content if self.system else None,
+            create_kwargs=self.create_kwargs,
+        )
+
     async def __call__(self, messages: list[dict]) -> ChatCompletion:
         """Create a chat completion.
 
@@ -98,12 +153,35 @@ class ChatCompletionResource(OpenAIResource):
             A ChatCompletion instance.
         """
         messages = self._prepare_messages(messages)
-        return await self._client.chat.completions.create(
+
+        key = None
+        if self.cache is not None:
+            key = self._cache_key("completion", messages)
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                return ChatCompletion(**cached)
+
+        completion = await self._client.chat.completions.create(
             messages=messages,
             model=self.model,
             **self.create_kwargs,
         )
 
+        if key is not None:
+            await self.cache.aset(key, model_dump(completion))
+        return completion
+
+    def _cache_key(self, kind: str, messages: list[dict]) -> str:
+        return canonical_hash(
+            dict(
+                kind=kind,
+                model=self.model,
+                messages=messages,
+                system=self.system.content if self.system else None,
+                create_kwargs=self.create_kwargs,
+            )
+        )
+
     def _prepare_messages(self, messages: list[dict]) -> list[dict]:
         if self.system is not None:
             messages = [model_dump(self.system)] + messages
@@ -4,10 +4,11 @@ from fastapi import status
 from starlette.types import Send
 
 from lanarky.adapters.openai.resources import Message
-from lanarky.events import Events, ServerSentEvent, ensure_bytes
+from lanarky.events import Events
 from lanarky.logging import logger
 from lanarky.responses import HTTPStatusDetail
 from lanarky.responses import StreamingResponse as _StreamingResponse
+from lanarky.responses import aclose_iterator
 
 from .resources import OpenAIResource
 
@@ -39,7 +40,8 @@ class StreamingResponse(_StreamingResponse):
         """Stream chat completions.
 
         If an exception occurs while iterating over the OpenAI resource, an
-        internal server error is sent to the client.
+        internal server error is sent to the client. If the client disconnects,
+        the resource stream is closed, which closes the upstream connection.
 
         Args:
             send: The ASGI send callable.
@@ -52,22 +54,20 @@ class StreamingResponse(_StreamingResponse):
             }
         )
 
+        stream = None
         try:
-            async for chunk in self.resource.stream_response(self.messages):
-                event_body = ServerSentEvent(
-                    data=chunk,
-                    event=Events.COMPLETION,
-                )
+            stream = self.resource.stream_response(self.messages)
+            async for chunk in stream:
                 await send(
                     {
                         "type": "http.response.body",
-                        "body": ensure_bytes(event_body, None),
+                        "body": self.encoder.encode(chunk, event=Events.COMPLETION),
                         "more_body": True,
                     }
                 )
         except Exception as e:
             logger.error(f"openai error: {e}")
-            error_event_body = ServerSentEvent(
+            error_event_body = self.encoder.encode(
                 data=dict(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail=HTTPStatusDetail.INTERNAL_SERVER_ERROR,
@@ -77,9 +77,12 @@ class StreamingResponse(_StreamingResponse):
             await send(
                 {
                     "type": "http.response.body",
-                    "body": ensure_bytes(error_event_body, None),
+                    "body": error_event_body,
                     "more_body": True,
                 }
             )
+        finally:
+            if stream is not None:
+                await aclose_iterator(stream)
 
         await send({"type": "http.response.body", "body": b"", "more_body": False})
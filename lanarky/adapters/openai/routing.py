@@ -1,10 +1,14 @@
-import inspect
+from functools import partial
 from typing import Any, Callable, Optional, Sequence
 
 from fastapi import params
 from fastapi.datastructures import Default
 from fastapi.routing import APIRoute, APIRouter, APIWebSocketRoute
 
+from lanarky.factories import FactoryScope, is_factory
+from lanarky.streams import Broadcast
+
+from .resources import OpenAIResource
 from .utils import build_factory_api_endpoint, build_factory_websocket_endpoint
 
 
@@ -17,6 +21,9 @@ class OpenAIAPIRoute(APIRoute):
         endpoint: Callable[..., Any],
         *,
         response_model: Any = Default(None),
+        single_flight: Optional[Broadcast] = None,
+        factory_scope: FactoryScope = FactoryScope.REQUEST,
+        pool_size: int = 4,
         **kwargs: dict[str, Any],
     ) -> None:
         """Constructor method.
@@ -25,13 +32,22 @@ class OpenAIAPIRoute(APIRoute):
             path: The path for the route.
             endpoint: The endpoint to call when the route is requested.
             response_model: The response model to use for the route.
+            single_flight: Opt-in hub to coalesce identical in-flight requests.
+            factory_scope: The lifecycle scope of the factory instances.
+            pool_size: The number of instances used with `FactoryScope.POOLED`.
             **kwargs: Keyword arguments to pass to the parent constructor.
         """
         # NOTE: OpenAIAPIRoute is initialised again when
         # router is included in app. This is a hack to
         # build the factory endpoint only once.
-        if not inspect.iscoroutinefunction(endpoint):
-            factory_endpoint = build_factory_api_endpoint(path, endpoint)
+        if is_factory(endpoint, OpenAIResource):
+            factory_endpoint = build_factory_api_endpoint(
+                path,
+                endpoint,
+                single_flight=single_flight,
+                factory_scope=factory_scope,
+                pool_size=pool_size,
+            )
             super().__init__(
                 path, factory_endpoint, response_model=response_model, **kwargs
             )
@@ -48,6 +64,8 @@ class OpenAIAPIWebSocketRoute(APIWebSocketRoute):
         endpoint: Callable[..., Any],
         *,
         name: Optional[str] = None,
+        factory_scope: FactoryScope = FactoryScope.REQUEST,
+        pool_size: int = 4,
         **kwargs: dict[str, Any],
     ) -> None:
         """Constructor method.
@@ -56,14 +74,18 @@ class OpenAIAPIWebSocketRoute(APIWebSocketRoute):
             path: The path for the route.
             endpoint: The endpoint to call when the route is requested.
             name: The name of the route.
+            factory_scope: The lifecycle scope of the factory instances.
+            pool_size: The number of instances used with `FactoryScope.POOLED`.
             **kwargs: Keyword arguments to pass to the parent constructor.
         """
         super().__init__(path, endpoint, name=name, **kwargs)
         # NOTE: OpenAIAPIRoute is initialised again when
         # router is included in app. This is a hack to
         # build the factory endpoint only once.
-        if not inspect.iscoroutinefunction(endpoint):
-            factory_endpoint = build_factory_websocket_endpoint(path, endpoint)
+        if is_factory(endpoint, OpenAIResource):
+            factory_endpoint = build_factory_websocket_endpoint(
+                path, endpoint, factory_scope=factory_scope, pool_size=pool_size
+            )
             super().__init__(path, factory_endpoint, name=name, **kwargs)
         else:
             super().__init__(path, endpoint, name=name, **kwargs)
@@ -73,10 +95,47 @@ class OpenAIAPIRouter(APIRouter):
     """APIRouter class for OpenAI resources."""
 
     def __init__(
-        self, *, route_class: type[APIRoute] = OpenAIAPIRoute, **kwargs: dict[str, Any]
+        self,
+        *,
+        route_class: type[APIRoute] = OpenAIAPIRoute,
+        single_flight: Optional[Broadcast] = None,
+        factory_scope: FactoryScope = FactoryScope.REQUEST,
+        pool_size: int = 4,
+        **kwargs: dict[str, Any],
     ):
+        """Constructor method.
+
+        Args:
+            route_class: The route class to use for API routes.
+            single_flight: Opt-in hub to coalesce identical in-flight requests.
+                Concurrent requests with the same route, configuration and
+                body share one upstream generation.
+            factory_scope: The lifecycle scope of the factory instances:
+                built per request, once (singleton) or as a bounded pool.
+            pool_size: The number of instances used with `FactoryScope.POOLED`.
+            **kwargs: Keyword arguments to pass to the parent constructor.
+        """
         super().__init__(route_class=route_class, **kwargs)
 
+        self.single_flight = single_flight
+        self.factory_scope = factory_scope
+        self.pool_size = pool_size
+
+    def add_api_route(
+        self, path: str, endpoint: Callable[..., Any], **kwargs: dict[str, Any]
+    ) -> None:
+        route_class = kwargs.pop("route_class_override", None) or self.route_class
+        if issubclass(route_class, OpenAIAPIRoute):
+            route_class = partial(
+                route_class,
+                single_flight=self.single_flight,
+                factory_scope=self.factory_scope,
+                pool_size=self.pool_size,
+            )
+        super().add_api_route(
+            path, endpoint, route_class_override=route_class, **kwargs
+        )
+
     def add_api_websocket_route(
         self,
         path: str,
@@ -95,5 +154,7 @@ class OpenAIAPIRouter(APIRouter):
             name=name,
             dependencies=current_dependencies,
             dependency_overrides_provider=self.dependency_overrides_provider,
+            factory_scope=self.factory_scope,
+            pool_size=self.pool_size,
         )
         self.routes.append(route)
@@ -1,88 +1,229 @@
+import inspect
 import re
-from typing import Any, Awaitable, Callable
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from pydantic import BaseModel, create_model
 from starlette.routing import compile_path
 
+from lanarky.applications import register_startup_callback
 from lanarky.events import Events
+from lanarky.factories import FactoryProvider, FactoryScope
 from lanarky.logging import logger
-from lanarky.utils import model_dump, model_fields
-from lanarky.websockets import WebSocket, WebsocketSession
+from lanarky.streams import Broadcast, BroadcastChannel
+from lanarky.utils import canonical_hash, model_dump, model_fields, parse_request
+from lanarky.websockets import (
+    DataMode,
+    MessagePackWebSocket,
+    WebSocket,
+    WebsocketSession,
+    get_data_mode,
+    send_json,
+)
 
 from .resources import ChatCompletion, ChatCompletionResource, Message, OpenAIResource
 from .responses import HTTPStatusDetail, StreamingResponse, status
 
 
 def build_factory_api_endpoint(
-    path: str, endpoint: Callable[..., Any]
+    path: str,
+    endpoint: Callable[..., Any],
+    single_flight: Optional[Broadcast] = None,
+    factory_scope: FactoryScope = FactoryScope.REQUEST,
+    pool_size: int = 4,
 ) -> Callable[..., Awaitable[Any]]:
     """Build a factory endpoint for API routes.
 
+    Async factories are built when the application starts up. Until then, the
+    endpoint responds with status 503.
+
     Args:
         path: The path for the route.
         endpoint: openai resource factory function.
+        single_flight: Opt-in hub to coalesce identical in-flight requests.
+        factory_scope: The lifecycle scope of the resources.
+        pool_size: The number of resources used with `FactoryScope.POOLED`.
     """
+
+    def create_response(
+        resource: OpenAIResource, request: BaseModel
+    ) -> StreamingResponse:
+        body = model_dump(request)
+        if single_flight is None:
+            response = StreamingResponse(resource=resource, **body)
+        else:
+            key = canonical_hash(dict(route=path, config=resource.config(), body=body))
+            response = StreamingResponse(
+                resource=resource, broadcast=single_flight, broadcast_key=key, **body
+            )
+        response.call_on_complete(provider.hand_off(resource))
+        return response
+
+    if inspect.iscoroutinefunction(endpoint):
+        provider = FactoryProvider(endpoint, factory_scope, pool_size)
+        compiled = register_resource_warm_up(path, provider)
+
+        async def async_factory_endpoint(
+            request: Request,
+            _: None = Depends(provider.ensure_ready),
+            resource: OpenAIResource = Depends(provider.lease_dependency),
+        ):
+            return create_response(
+                resource, await parse_request(request, compiled["request_model"])
+            )
+
+        return async_factory_endpoint
+
     resource = compile_openai_resource_factory(endpoint)
+    provider = FactoryProvider(endpoint, factory_scope, pool_size, instance=resource)
 
     # index 1 of `compile_path` contains path_format output
     model_prefix = compile_model_prefix(compile_path(path)[1], resource)
     request_model = create_request_model(resource, model_prefix)
 
     async def factory_endpoint(
-        request: request_model, resource: OpenAIResource = Depends(endpoint)
+        request: request_model,
+        resource: OpenAIResource = Depends(provider.lease_dependency),
     ):
-        return StreamingResponse(resource=resource, **model_dump(request))
+        return create_response(resource, request)
 
     return factory_endpoint
 
 
 def build_factory_websocket_endpoint(
-    path: str, endpoint: Callable[..., Any]
+    path: str,
+    endpoint: Callable[..., Any],
+    factory_scope: FactoryScope = FactoryScope.REQUEST,
+    pool_size: int = 4,
 ) -> Callable[..., Awaitable[Any]]:
     """Build a factory endpoint for WebSocket routes.
 
+    Async factories are built when the application starts up. Until then,
+    connections are closed with code 1013 (try again later).
+
+    Clients which connect with the `msgpack` subprotocol send and receive
+    messages in `DataMode.MSGPACK`.
+
     Args:
         path: The path for the route.
         endpoint: openai resource factory function.
+        factory_scope: The lifecycle scope of the resources.
+        pool_size: The number of resources used with `FactoryScope.POOLED`.
     """
-    resource = compile_openai_resource_factory(endpoint)
-
-    # index 1 of `compile_path` contains path_format output
-    model_prefix = compile_model_prefix(compile_path(path)[1], resource)
-    request_model = create_request_model(resource, model_prefix)
+    if inspect.iscoroutinefunction(endpoint):
+        provider = FactoryProvider(endpoint, factory_scope, pool_size)
+        compiled = register_resource_warm_up(path, provider)
+    else:
+        resource = compile_openai_resource_factory(endpoint)
+        provider = FactoryProvider(
+            endpoint, factory_scope, pool_size, instance=resource
+        )
+
+        # index 1 of `compile_path` contains path_format output
+        model_prefix = compile_model_prefix(compile_path(path)[1], resource)
+        compiled = {"request_model": create_request_model(resource, model_prefix)}
 
     async def factory_endpoint(
-        websocket: WebSocket, resource: OpenAIResource = Depends(endpoint)
+        websocket: WebSocket,
+        _: None = Depends(provider.ensure_ready),
+        resource: OpenAIResource = Depends(provider.dependency),
     ):
-        async with WebsocketSession().connect(websocket) as session:
-            async for data in session:
-                try:
-                    async for chunk in resource.stream_response(
-                        **model_dump(request_model(**data))
+        request_model = compiled["request_model"]
+        mode = get_data_mode(websocket)
+        sender = websocket
+        if mode == DataMode.MSGPACK:
+            sender = MessagePackWebSocket(websocket)
+        try:
+            async with WebsocketSession().connect(websocket, mode) as session:
+                async for data in session:
+                    async for event in stream_events(
+                        resource, **model_dump(request_model(**data))
                     ):
-                        await websocket.send_json(
-                            dict(
-                                data=chunk,
-                                event=Events.COMPLETION,
-                            )
-                        )
-                except Exception as e:
-                    logger.error(f"openai error: {e}")
-                    await websocket.send_json(
-                        dict(
-                            data=dict(
-                                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                detail=HTTPStatusDetail.INTERNAL_SERVER_ERROR,
-                            ),
-                            event=Events.ERROR,
-                        )
-                    )
-                await websocket.send_json(dict(data="", event=Events.END))
+                        await send_json(sender, event)
+        finally:
+            await provider.release(resource)
 
     return factory_endpoint
 
 
+def register_resource_warm_up(path: str, provider: FactoryProvider) -> dict[str, Any]:
+    """Register the startup warm-up of an async resource factory.
+
+    Args:
+        path: The path for the route.
+        provider: The provider of the resource factory.
+
+    Returns:
+        A dict which holds the `request_model` once the warm-up completed.
+    """
+    compiled: dict[str, Any] = {}
+
+    async def warm_up() -> None:
+        if compiled:
+            return
+        resource = await provider.build()
+        if not isinstance(resource, OpenAIResource):
+            raise TypeError(
+                "factory endpoint must return a LanarkyOpenAIResource instance"
+            )
+
+        # index 1 of `compile_path` contains path_format output
+        model_prefix = compile_model_prefix(compile_path(path)[1], resource)
+        compiled["request_model"] = create_request_model(resource, model_prefix)
+
+    register_startup_callback(warm_up)
+    return compiled
+
+
+async def stream_events(
+    resource: OpenAIResource, **kwargs: dict[str, Any]
+) -> AsyncIterator[dict[str, Any]]:
+    """Stream events of an OpenAI resource as dicts.
+
+    If an exception occurs, an internal server error event is sent instead.
+    The stream always ends with an `end` event.
+
+    Args:
+        resource: An OpenAIResource instance.
+        **kwargs: Keyword arguments to pass to `resource.stream_response`.
+    """
+    try:
+        async for chunk in resource.stream_response(**kwargs):
+            yield dict(data=chunk, event=Events.COMPLETION)
+    except Exception as e:
+        logger.error(f"openai error: {e}")
+        yield dict(
+            data=dict(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=HTTPStatusDetail.INTERNAL_SERVER_ERROR,
+            ),
+            event=Events.ERROR,
+        )
+    yield dict(data="", event=Events.END)
+
+
+def build_broadcast_producer(
+    resource: OpenAIResource, **kwargs: dict[str, Any]
+) -> Callable[[BroadcastChannel], Awaitable[None]]:
+    """Build a producer which publishes OpenAI resource events to a channel.
+
+    Usage:
+        ```python
+        channel = broadcast.publish(key, build_broadcast_producer(resource, **request))
+        ```
+
+    Args:
+        resource: An OpenAIResource instance.
+        **kwargs: Keyword arguments to pass to `resource.stream_response`.
+    """
+
+    async def producer(channel: BroadcastChannel) -> None:
+        async for event in stream_events(resource, **kwargs):
+            await channel.publish(event)
+
+    return producer
+
+
 def compile_openai_resource_factory(endpoint: Callable[..., Any]) -> OpenAIResource:
     """Compile an OpenAI resource factory function.
 
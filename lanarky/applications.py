@@ -1,4 +1,6 @@
-from typing import Any
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
 
 from fastapi.applications import AppType, FastAPI
 from fastapi.openapi.docs import (
@@ -8,6 +10,51 @@ from fastapi.openapi.docs import (
 )
 from fastapi.requests import Request
 from fastapi.responses import HTMLResponse, JSONResponse
+from starlette.types import Lifespan
+
+from lanarky.logging import logger
+
+_startup_callbacks: list[Callable[[], Awaitable[Any]]] = []
+_shutdown_callbacks: list[Callable[[], Awaitable[Any]]] = []
+
+
+def register_startup_callback(callback: Callable[[], Awaitable[Any]]) -> None:
+    """Register a callback to await when a Lanarky application starts up.
+
+    Used to warm up resources, such as async factories. Startup callbacks run
+    concurrently and must be safe to run more than once.
+
+    Args:
+        callback: An async callable without arguments.
+    """
+    if callback not in _startup_callbacks:
+        _startup_callbacks.append(callback)
+
+
+async def run_startup_callbacks() -> None:
+    """Await all registered startup callbacks concurrently."""
+    await asyncio.gather(*(callback() for callback in list(_startup_callbacks)))
+
+
+def register_shutdown_callback(callback: Callable[[], Awaitable[Any]]) -> None:
+    """Register a callback to await when a Lanarky application shuts down.
+
+    Used to release process-wide resources, such as pooled clients.
+
+    Args:
+        callback: An async callable without arguments.
+    """
+    if callback not in _shutdown_callbacks:
+        _shutdown_callbacks.append(callback)
+
+
+async def run_shutdown_callbacks() -> None:
+    """Await all registered shutdown callbacks."""
+    for callback in _shutdown_callbacks:
+        try:
+            await callback()
+        except Exception as e:
+            logger.error(f"shutdown callback error: {e}")
 
 
 class Lanarky(FastAPI):
@@ -18,16 +65,41 @@ class Lanarky(FastAPI):
     """
 
     def __init__(
-        self: AppType, *, title: str = "Lanarky", **kwargs: dict[str, Any]
+        self: AppType,
+        *,
+        title: str = "Lanarky",
+        readiness_url: Optional[str] = None,
+        **kwargs: dict[str, Any],
     ) -> None:
         """Constructor method.
 
         Args:
             title: The title of the application.
+            readiness_url: Optional path of a readiness probe. It responds with
+                status 200 once the startup warm-up completed and 503 before.
             **kwargs: Additional arguments to pass to the FastAPI constructor.
         """
+        self.readiness_url = readiness_url
+        self.ready = False
+
         super().__init__(title=title, **kwargs)
 
+        self.router.lifespan_context = self._wrap_lifespan(self.router.lifespan_context)
+
+    def _wrap_lifespan(self, lifespan: Lifespan[AppType]) -> Lifespan[AppType]:
+        @asynccontextmanager
+        async def lanarky_lifespan(app: AppType) -> AsyncIterator[Optional[Any]]:
+            try:
+                async with lifespan(app) as state:
+                    await run_startup_callbacks()
+                    self.ready = True
+                    yield state
+            finally:
+                self.ready = False
+                await run_shutdown_callbacks()
+
+        return lanarky_lifespan
+
     def setup(self) -> None:  # pragma: no cover
         """Setup the application.
 
@@ -87,3 +159,11 @@ class Lanarky(FastAPI):
                 )
 
             self.add_route(self.redoc_url, redoc_html, include_in_schema=False)
+        if self.readiness_url:
+
+            async def readiness(req: Request) -> JSONResponse:
+                if self.ready:
+                    return JSONResponse({"status": "ready"})
+                return JSONResponse({"status": "starting"}, status_code=503)
+
+            self.add_route(self.readiness_url, readiness, include_in_schema=False)
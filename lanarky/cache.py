@@ -0,0 +1,139 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from lanarky.utils import get_json_codec
+
+
+def json_size(value: Any) -> int:
+    """Estimate the size of a value in bytes from its JSON representation.
+
+    The value is encoded with the JSON codec of `lanarky.utils`.
+
+    Args:
+        value: The value to measure.
+    """
+    return len(get_json_codec().encode_bytes(value))
+
+
+class BaseCache(ABC):
+    """Base class for Lanarky caches.
+
+    Subclasses implement `get` and `set`. Caches backed by network services
+    should override the async `aget` and `aset` methods as well.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Get a cached value, or `None` on a cache miss.
+
+        Args:
+            key: The cache key.
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """Store a value.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+        """
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """Async version of `get`."""
+        return self.get(key)
+
+    async def aset(self, key: str, value: Any) -> None:
+        """Async version of `set`."""
+        self.set(key, value)
+
+    def stats(self) -> dict[str, int]:
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+class InMemoryCache(BaseCache):
+    """In-memory LRU cache with TTL eviction and a size cap in bytes."""
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = 1024,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = json_size,
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            maxsize: The maximum number of entries. `None` means no limit.
+            ttl: Time to live of entries, in seconds. `None` means no expiry.
+            max_bytes: The maximum total size of entries. `None` means no limit.
+            sizeof: Callable to measure the size of a value in bytes.
+        """
+        super().__init__()
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        # key -> (value, size, expires_at)
+        self._entries: OrderedDict[str, tuple[Any, int, float]] = OrderedDict()
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] < time.monotonic():
+            self._evict(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: str, value: Any) -> None:
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+
+        expires_at = (
+            time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        )
+        self._entries[key] = (value, size, expires_at)
+        self.nbytes += size
+
+        while (self.maxsize is not None and len(self._entries) > self.maxsize) or (
+            self.max_bytes is not None and self.nbytes > self.max_bytes
+        ):
+            self._evict(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return dict(super().stats(), entries=len(self._entries), bytes=self.nbytes)
+
+    def _evict(self, key: str) -> None:
+        self.nbytes -= self._entries.pop(key)[1]
+        self.evictions += 1
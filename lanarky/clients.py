@@ -1,4 +1,4 @@
-import json
+import time
 from contextlib import contextmanager
 from typing import Any, Iterator, Optional
 
@@ -6,7 +6,8 @@ import httpx
 from httpx_sse import ServerSentEvent, connect_sse
 from websockets.sync.client import connect as websocket_connect
 
-from lanarky.websockets import DataMode
+from lanarky.utils import json_dumps, json_loads
+from lanarky.websockets import DataMode, decode_msgpack, encode_msgpack
 
 
 class StreamingClient:
@@ -27,25 +28,57 @@ class StreamingClient:
         self.client = client or httpx.Client()
 
     def stream_response(
-        self, method: str, path: str, **kwargs: dict[str, Any]
+        self,
+        method: str,
+        path: str,
+        *,
+        max_reconnects: int = 3,
+        reconnect_delay: float = 0.5,
+        **kwargs: dict[str, Any],
     ) -> Iterator[ServerSentEvent]:
         """Stream data from the server.
 
+        If the connection drops after receiving events with an `id` field,
+        the client reconnects with the `Last-Event-ID` header so that a
+        resumable stream continues where it left off.
+
         Args:
             method: The HTTP method to use.
             path: The path to stream from.
+            max_reconnects: The maximum number of reconnect attempts.
+            reconnect_delay: Seconds to wait before reconnecting.
             **kwargs: The keyword arguments to pass to the HTTP client.
         """
         url = self.base_url + path
-        with connect_sse(self.client, method, url, **kwargs) as event_source:
-            for sse in event_source.iter_sse():
-                yield sse
+        headers = dict(kwargs.pop("headers", None) or {})
+        last_event_id = None
+        reconnects = 0
+
+        while True:
+            if last_event_id is not None:
+                headers["Last-Event-ID"] = last_event_id
+            try:
+                with connect_sse(
+                    self.client, method, url, headers=headers, **kwargs
+                ) as event_source:
+                    for sse in event_source.iter_sse():
+                        if sse.id:
+                            last_event_id = sse.id
+                            reconnects = 0
+                        yield sse
+                return
+            except httpx.TransportError:
+                if last_event_id is None or reconnects >= max_reconnects:
+                    raise
+                reconnects += 1
+                time.sleep(reconnect_delay)
 
 
 class WebSocketClient:
     """Test client for WebSockets.
 
-    Supports 3 data modes: JSON, TEXT, and BYTES.
+    Supports 4 data modes: JSON, TEXT, BYTES and MSGPACK. With
+    `DataMode.MSGPACK`, the client requests the `msgpack` subprotocol.
     """
 
     def __init__(
@@ -64,7 +97,10 @@ class WebSocketClient:
     @contextmanager
     def connect(self):
         """Connect to a websocket and yield data from it."""
-        with websocket_connect(self.uri) as websocket:
+        subprotocols = (
+            [DataMode.MSGPACK.value] if self.mode == DataMode.MSGPACK else None
+        )
+        with websocket_connect(self.uri, subprotocols=subprotocols) as websocket:
             self.websocket = websocket
             yield self
             self.websocket = None
@@ -77,11 +113,13 @@ class WebSocketClient:
         """
         if self.websocket:
             if self.mode == DataMode.JSON:
-                message = json.dumps(message)
+                message = json_dumps(message)
             elif self.mode == DataMode.TEXT:
                 message = str(message)
             elif self.mode == DataMode.BYTES:
                 message = message.encode("utf-8")
+            elif self.mode == DataMode.MSGPACK:
+                message = encode_msgpack(message)
             self.websocket.send(message)
 
     def receive(self, mode: DataMode = None):
@@ -94,11 +132,13 @@ class WebSocketClient:
         if self.websocket:
             response = self.websocket.recv()
             if mode == DataMode.JSON:
-                response = json.loads(response)
+                response = json_loads(response)
             elif mode == DataMode.TEXT:
                 response = str(response)
             elif mode == DataMode.BYTES:
                 response = response.decode("utf-8")
+            elif mode == DataMode.MSGPACK:
+                response = decode_msgpack(response)
             return response
 
     def stream_response(self):
@@ -109,7 +149,13 @@ class WebSocketClient:
         """
         if self.websocket:
             while True:
-                response = self.receive(mode=DataMode.JSON)
+                response = self.receive(
+                    mode=(
+                        DataMode.MSGPACK
+                        if self.mode == DataMode.MSGPACK
+                        else DataMode.JSON
+                    )
+                )
                 if response["event"] == "end":
                     break
                 yield response
@@ -1,10 +1,92 @@
+import re
+from functools import lru_cache
+from typing import Any, Optional
+
 from sse_starlette.sse import ServerSentEvent as ServerSentEvent
 from sse_starlette.sse import ensure_bytes as ensure_bytes
 
 from lanarky.utils import StrEnum
 
+LINE_SEP_EXPR = re.compile(r"\r\n|\r|\n")
+
 
 class Events(StrEnum):
     COMPLETION = "completion"
     ERROR = "error"
     END = "end"
+
+
+class ServerSentEventEncoder:
+    """Encoder for server-sent event frames.
+
+    Produces the same bytes as `ServerSentEvent.encode` without allocating
+    an intermediate event object. The `event:` prefix is cached per event type
+    and multi-line data is split into `data:` lines in a single pass.
+    """
+
+    def __init__(self, sep: Optional[str] = None) -> None:
+        """Constructor method.
+
+        Args:
+            sep: The line separator. Defaults to `\\r\\n`.
+        """
+        self.sep = sep if sep is not None else "\r\n"
+
+        self._data_sep = f"{self.sep}data: "
+        self._data_prefix = b"data: "
+        self._terminator = (self.sep * 2).encode("utf-8")
+        self._prefixes: dict[Optional[str], bytes] = {None: b""}
+
+    def encode(
+        self, data: Any = None, event: Optional[str] = None, id: Optional[str] = None
+    ) -> bytes:
+        """Encode a server-sent event frame.
+
+        Args:
+            data: The data payload. Non-string values are converted with `str`.
+            event: The event name.
+            id: The event ID.
+        """
+        prefix = self._prefixes.get(event)
+        if prefix is None:
+            prefix = self._cache_prefix(event)
+
+        if id is not None:
+            prefix = self.encode_field("id", id) + prefix
+
+        if data is None:
+            return prefix + self.sep.encode("utf-8")
+
+        if not isinstance(data, str):
+            data = str(data)
+        if "\n" in data or "\r" in data:
+            data = LINE_SEP_EXPR.sub(self._data_sep, data)
+
+        return b"".join(
+            (prefix, self._data_prefix, data.encode("utf-8"), self._terminator)
+        )
+
+    def encode_field(self, name: str, value: Any) -> bytes:
+        """Encode a single `name: value` line.
+
+        Args:
+            name: The field name.
+            value: The field value. Line separators are removed.
+        """
+        line = LINE_SEP_EXPR.sub("", f"{name}: {value}")
+        return f"{line}{self.sep}".encode("utf-8")
+
+    def _cache_prefix(self, event: str) -> bytes:
+        prefix = self.encode_field("event", event)
+        self._prefixes[event] = prefix
+        return prefix
+
+
+@lru_cache(maxsize=None)
+def get_event_encoder(sep: Optional[str] = None) -> ServerSentEventEncoder:
+    """Get the shared `ServerSentEventEncoder` for a line separator.
+
+    Args:
+        sep: The line separator. Defaults to `\\r\\n`.
+    """
+    return ServerSentEventEncoder(sep)
@@ -0,0 +1,216 @@
+import asyncio
+import inspect
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import HTTPException, WebSocketException, status
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
+
+from lanarky.utils import StrEnum
+
+
+class FactoryScope(StrEnum):
+    """Lifecycle scopes of resource and chain factories."""
+
+    REQUEST = "request"
+    SINGLETON = "singleton"
+    POOLED = "pooled"
+
+
+class FactoryProvider:
+    """Provides instances built by a factory according to its scope.
+
+    - `FactoryScope.REQUEST`: a new instance per request. The factory is used
+      as a FastAPI dependency, so its parameters are resolved from the request.
+    - `FactoryScope.SINGLETON`: a single instance shared by all requests.
+    - `FactoryScope.POOLED`: a bounded pool of instances. Every request leases
+      an instance and waits if all instances are in use.
+
+    Singleton and pooled factories are called with their default arguments.
+    Factories can be sync or async functions. Sync factories run in a thread
+    pool when called outside of FastAPI dependency injection.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[..., Any],
+        scope: FactoryScope = FactoryScope.REQUEST,
+        pool_size: int = 4,
+        instance: Optional[Any] = None,
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            factory: The resource or chain factory function.
+            scope: The lifecycle scope of the instances.
+            pool_size: The number of instances used with `FactoryScope.POOLED`.
+            instance: An already built instance, reused as singleton or as the
+                first pooled instance. Without it, the provider is not `ready`
+                until `build` is awaited.
+        """
+        if scope not in list(FactoryScope):
+            raise ValueError(
+                f"Invalid factory scope '{scope}'. Must be one of {list(FactoryScope)}"
+            )
+        if pool_size < 1:
+            raise ValueError("pool_size must be positive")
+
+        self.factory = factory
+        self.scope = scope
+        self.pool_size = pool_size
+
+        self._instance = instance if scope == FactoryScope.SINGLETON else None
+        self._pool: list[Any] = []
+        # ids of the pooled instances which are leased
+        self._leased: set[int] = set()
+        self._handed_off: set[int] = set()
+        self._size = 0
+        self._available: Optional[asyncio.Condition] = None
+        if scope == FactoryScope.POOLED and instance is not None:
+            self._pool.append(instance)
+            self._size = 1
+
+        self.ready = instance is not None
+
+    async def build(self) -> Any:
+        """Build an instance ahead of the first request and mark the provider ready.
+
+        The instance is kept as singleton or as the first pooled instance.
+        """
+        if self.scope == FactoryScope.SINGLETON and self._instance is not None:
+            instance = self._instance
+        else:
+            instance = await self._create()
+            if self.scope == FactoryScope.SINGLETON:
+                self._instance = instance
+            elif self.scope == FactoryScope.POOLED and self._size < self.pool_size:
+                self._pool.append(instance)
+                self._size += 1
+
+        self.ready = True
+        return instance
+
+    async def ensure_ready(self, connection: HTTPConnection) -> None:
+        """FastAPI dependency which rejects connections until the provider is ready."""
+        if self.ready:
+            return
+        if connection.scope["type"] == "websocket":
+            raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service Unavailable",
+        )
+
+    @property
+    def dependency(self) -> Callable[..., Any]:
+        """The FastAPI dependency which provides an instance."""
+        if self.scope == FactoryScope.REQUEST:
+            return self.factory
+        return self.acquire
+
+    @property
+    def lease_dependency(self) -> Callable[..., Any]:
+        """The FastAPI dependency which provides an instance for API routes.
+
+        Unlike `dependency`, pooled instances are released when the request
+        ends unless a response took them over with `hand_off`, e.g. if the
+        request body is invalid.
+        """
+        if self.scope == FactoryScope.POOLED:
+            return self.lease
+        return self.dependency
+
+    async def lease(self) -> AsyncIterator[Any]:
+        """FastAPI dependency with `yield` which leases a pooled instance."""
+        instance = await self.acquire()
+        try:
+            yield instance
+        finally:
+            if id(instance) in self._handed_off:
+                self._handed_off.discard(id(instance))
+            else:
+                await self.release(instance)
+
+    def hand_off(self, instance: Any) -> Callable[[], Awaitable[None]]:
+        """Hand an instance from `lease` over to a response.
+
+        Args:
+            instance: The leased instance.
+
+        Returns:
+            The async callable which releases the instance, to await when the
+            response is done.
+        """
+        if self.scope == FactoryScope.POOLED:
+            self._handed_off.add(id(instance))
+        return partial(self.release, instance)
+
+    async def acquire(self) -> Any:
+        """Get an instance. Pooled instances must be returned with `release`."""
+        if self.scope == FactoryScope.REQUEST:
+            return await self._create()
+
+        if self.scope == FactoryScope.SINGLETON:
+            if self._instance is None:
+                self._instance = await self._create()
+            return self._instance
+
+        if self._available is None:
+            self._available = asyncio.Condition()
+        async with self._available:
+            while not self._pool and self._size >= self.pool_size:
+                await self._available.wait()
+            if self._pool:
+                instance = self._pool.pop()
+                self._leased.add(id(instance))
+                return instance
+            self._size += 1
+
+        try:
+            instance = await self._create()
+            self._leased.add(id(instance))
+            return instance
+        except BaseException:
+            async with self._available:
+                self._size -= 1
+                self._available.notify()
+            raise
+
+    async def release(self, instance: Any) -> None:
+        """Return a pooled instance to the pool.
+
+        Instances which are not leased, e.g. already released, are ignored.
+
+        Args:
+            instance: An instance returned by `acquire`.
+        """
+        if self.scope != FactoryScope.POOLED or id(instance) not in self._leased:
+            return
+
+        self._leased.discard(id(instance))
+        async with self._available:
+            self._pool.append(instance)
+            self._available.notify()
+
+    async def _create(self) -> Any:
+        if inspect.iscoroutinefunction(self.factory):
+            return await self.factory()
+        return await run_in_threadpool(self.factory)
+
+
+def is_factory(endpoint: Callable[..., Any], instance_type: type) -> bool:
+    """Check if a route endpoint is a factory function.
+
+    Sync functions are factories. Async functions are factories if their return
+    annotation is a subclass of `instance_type`; otherwise they are regular
+    endpoints.
+
+    Args:
+        endpoint: The route endpoint.
+        instance_type: The base class of the factory instances.
+    """
+    if not inspect.iscoroutinefunction(endpoint):
+        return True
+    annotation = inspect.signature(endpoint).return_annotation
+    return inspect.isclass(annotation) and issubclass(annotation, instance_type)
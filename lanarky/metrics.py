@@ -0,0 +1,57 @@
+from collections import defaultdict
+from typing import Any, Callable, Union
+
+Number = Union[int, float]
+
+
+class MetricsRegistry:
+    """Process-wide registry of Lanarky metrics.
+
+    Counters are incremented by Lanarky components as they run. Collectors are
+    callables which return a dict of gauges and are evaluated on `snapshot`.
+    """
+
+    def __init__(self) -> None:
+        self._counters: dict[str, Number] = defaultdict(int)
+        self._collectors: dict[str, Callable[[], dict[str, Any]]] = {}
+
+    def increment(self, name: str, value: Number = 1) -> None:
+        """Increment a counter.
+
+        Args:
+            name: The counter name.
+            value: The amount to increment by.
+        """
+        self._counters[name] += value
+
+    def register(self, name: str, collector: Callable[[], dict[str, Any]]) -> None:
+        """Register a collector.
+
+        Args:
+            name: The collector name, used as prefix for its metrics.
+            collector: A callable returning a dict of metric values.
+        """
+        self._collectors[name] = collector
+
+    def unregister(self, name: str) -> None:
+        """Remove a collector.
+
+        Args:
+            name: The collector name.
+        """
+        self._collectors.pop(name, None)
+
+    def snapshot(self) -> dict[str, Any]:
+        """Get the current value of all counters and collectors."""
+        values: dict[str, Any] = dict(self._counters)
+        for name, collector in list(self._collectors.items()):
+            for key, value in collector().items():
+                values[f"{name}.{key}"] = value
+        return values
+
+    def reset(self) -> None:
+        """Reset all counters."""
+        self._counters.clear()
+
+
+metrics = MetricsRegistry()
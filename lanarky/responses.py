@@ -1,16 +1,603 @@
-from typing import Any
+import asyncio
+import inspect
+import math
+import time
+from collections import deque
+from datetime import datetime
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
 
+import anyio
 from fastapi import status
+from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
-from starlette.types import Send
+from starlette.types import Message, Receive, Scope, Send
 
-from lanarky.events import Events, ServerSentEvent, ensure_bytes
+from lanarky.events import Events, ServerSentEvent, ensure_bytes, get_event_encoder
 from lanarky.logging import logger
+from lanarky.metrics import metrics
+from lanarky.streams import (
+    Broadcast,
+    BroadcastChannel,
+    EventBuffer,
+    ReplayStore,
+    format_event_id,
+    parse_event_id,
+)
 from lanarky.utils import StrEnum
 
 
 class HTTPStatusDetail(StrEnum):
     INTERNAL_SERVER_ERROR = "Internal Server Error"
+    CLIENT_TOO_SLOW = "Client Too Slow"
+
+
+class CoalescingPolicy(BaseModel):
+    """Flush thresholds for coalescing streamed chunks.
+
+    Buffered chunks are flushed as soon as any one of the thresholds is reached.
+    """
+
+    max_bytes: int = 4096
+    max_events: int = 32
+    max_delay: float = 0.05
+
+
+class ChunkCoalescer:
+    """ASGI `send` wrapper which coalesces body chunks into fewer messages.
+
+    The first body chunk is always sent immediately to keep time-to-first-token
+    low. Subsequent chunks are buffered until one of the `CoalescingPolicy`
+    thresholds is reached. Any other ASGI message (including the final empty
+    body message) flushes the buffer before being sent.
+
+    If a delayed flush fails, e.g. after a client disconnect, the error is
+    raised by the next call, so that the stream stops.
+    """
+
+    def __init__(self, send: Send, policy: Optional[CoalescingPolicy] = None) -> None:
+        """Constructor method.
+
+        Args:
+            send: The ASGI send callable to wrap.
+            policy: The flush thresholds. Defaults to `CoalescingPolicy()`.
+        """
+        self._send = send
+        self.policy = policy or CoalescingPolicy()
+
+        self._buffer: list[bytes] = []
+        self._buffer_size = 0
+        self._first_chunk_sent = False
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_error: Optional[BaseException] = None
+
+    async def __call__(self, message: Message) -> None:
+        self._raise_flush_error()
+        if message["type"] != "http.response.body" or not message.get(
+            "more_body", False
+        ):
+            async with self._lock:
+                await self._flush()
+                await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        if not body:
+            return
+
+        async with self._lock:
+            if not self._first_chunk_sent:
+                self._first_chunk_sent = True
+                await self._send(message)
+                return
+
+            self._buffer.append(body)
+            self._buffer_size += len(body)
+
+            if (
+                self._buffer_size >= self.policy.max_bytes
+                or len(self._buffer) >= self.policy.max_events
+            ):
+                await self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(
+                    self.policy.max_delay, self._on_timer
+                )
+
+    async def flush(self) -> None:
+        """Send all buffered chunks as a single message."""
+        self._raise_flush_error()
+        async with self._lock:
+            await self._flush()
+
+    def close(self) -> None:
+        """Cancel pending flushes and drop buffered chunks."""
+        self._cancel_timer()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._buffer.clear()
+        self._buffer_size = 0
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        self._flush_task.add_done_callback(self._on_flush_done)
+
+    def _on_flush_done(self, task: asyncio.Task) -> None:
+        if task is self._flush_task:
+            self._flush_task = None
+        if not task.cancelled() and task.exception() is not None:
+            self._flush_error = task.exception()
+
+    def _raise_flush_error(self) -> None:
+        if self._flush_error is not None:
+            raise self._flush_error
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _flush(self) -> None:
+        self._cancel_timer()
+        if not self._buffer:
+            return
+
+        body = b"".join(self._buffer)
+        self._buffer.clear()
+        self._buffer_size = 0
+        await self._send(
+            {"type": "http.response.body", "body": body, "more_body": True}
+        )
+
+
+class BackpressurePolicy(StrEnum):
+    """Policy applied when the buffer of a slow client is full."""
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    ABORT = "abort"
+    COALESCE = "coalesce"
+
+
+class BackpressureStats:
+    """Per-stream backpressure metrics."""
+
+    def __init__(self) -> None:
+        self.blocked_seconds = 0.0
+        self.send_seconds = 0.0
+        self.dropped_messages = 0
+        self.coalesced_messages = 0
+        self.max_depth = 0
+        self.aborted = False
+
+    def dict(self) -> dict[str, Any]:
+        return dict(
+            blocked_seconds=self.blocked_seconds,
+            send_seconds=self.send_seconds,
+            dropped_messages=self.dropped_messages,
+            coalesced_messages=self.coalesced_messages,
+            max_depth=self.max_depth,
+            aborted=self.aborted,
+        )
+
+
+class BufferedSend:
+    """ASGI `send` wrapper with a bounded buffer between producer and socket.
+
+    Messages are queued and written to the socket by a separate writer task, so
+    a slow client only stalls the producer once the buffer is full. What
+    happens then depends on the `BackpressurePolicy`:
+
+    - `BLOCK`: the producer waits until the writer frees up space.
+    - `DROP_OLDEST`: the oldest buffered body chunk is dropped.
+    - `ABORT`: buffered chunks are discarded, an error event is sent and
+        `on_abort` is called to stop the producer.
+    - `COALESCE`: the chunk is appended to the last buffered body chunk, so
+        the producer never waits and no data is lost.
+    """
+
+    def __init__(
+        self,
+        send: Send,
+        *,
+        max_size: int = 64,
+        policy: BackpressurePolicy = BackpressurePolicy.BLOCK,
+        on_abort: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            send: The ASGI send callable to wrap.
+            max_size: The maximum number of buffered messages.
+            policy: The policy applied when the buffer is full.
+            on_abort: Callback to stop the producer when the stream is aborted.
+        """
+        if policy not in list(BackpressurePolicy):
+            raise ValueError(
+                f"Invalid policy '{policy}'. Must be one of {list(BackpressurePolicy)}"
+            )
+        if max_size < 1:
+            raise ValueError("max_size must be greater than 0")
+
+        self._send = send
+        self.max_size = max_size
+        self.policy = policy
+        self.on_abort = on_abort
+        self.stats = BackpressureStats()
+
+        self._queue: deque[Message] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._writer: Optional[asyncio.Task] = None
+
+    async def __call__(self, message: Message) -> None:
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._write())
+
+        final = _is_final_message(message)
+        if self.stats.aborted:
+            if final:
+                await self.drain()
+            else:
+                # checkpoint so that the cancelled producer can be interrupted
+                await asyncio.sleep(0)
+            return
+
+        if not final and len(self._queue) >= self.max_size:
+            if self.policy == BackpressurePolicy.BLOCK:
+                start = time.perf_counter()
+                while len(self._queue) >= self.max_size and not self.stats.aborted:
+                    self._not_full.clear()
+                    await self._not_full.wait()
+                blocked = time.perf_counter() - start
+                self.stats.blocked_seconds += blocked
+                metrics.increment("streaming.client_blocked_seconds", blocked)
+                if self.stats.aborted:
+                    return
+            elif self.policy == BackpressurePolicy.DROP_OLDEST:
+                self._drop_oldest()
+                # let the writer run if the producer never yields
+                await asyncio.sleep(0)
+            elif self.policy == BackpressurePolicy.COALESCE:
+                if self._coalesce(message):
+                    # let the writer run if the producer never yields
+                    await asyncio.sleep(0)
+                    return
+            else:
+                self.abort()
+                return
+
+        self._queue.append(message)
+        self._not_empty.set()
+        if len(self._queue) > self.stats.max_depth:
+            self.stats.max_depth = len(self._queue)
+
+        if final:
+            await self.drain()
+
+    def abort(self) -> None:
+        """Discard buffered chunks and end the stream with an error event."""
+        if self.stats.aborted:
+            return
+
+        logger.warning("client too slow, aborting stream")
+        self.stats.aborted = True
+        metrics.increment("streaming.aborted_streams")
+
+        pending = [m for m in self._queue if m["type"] != "http.response.body"]
+        self._queue.clear()
+        self._queue.extend(pending)
+        self._queue.append(
+            {
+                "type": "http.response.body",
+                "body": get_event_encoder().encode(
+                    data=dict(
+                        status_code=status.HTTP_408_REQUEST_TIMEOUT,
+                        detail=HTTPStatusDetail.CLIENT_TOO_SLOW,
+                    ),
+                    event=Events.ERROR,
+                ),
+                "more_body": True,
+            }
+        )
+        self._queue.append(
+            {"type": "http.response.body", "body": b"", "more_body": False}
+        )
+        self._not_empty.set()
+        self._not_full.set()
+
+        if self.on_abort is not None:
+            self.on_abort()
+
+    async def drain(self) -> None:
+        """Wait until the writer has sent the final message."""
+        if self._writer is not None:
+            await asyncio.wait([self._writer])
+
+    def close(self) -> None:
+        """Stop the writer task and drop buffered messages."""
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+        self._queue.clear()
+
+    def _drop_oldest(self) -> None:
+        for index, queued in enumerate(self._queue):
+            if queued["type"] == "http.response.body":
+                del self._queue[index]
+                self.stats.dropped_messages += 1
+                metrics.increment("streaming.dropped_messages")
+                return
+
+    def _coalesce(self, message: Message) -> bool:
+        last = self._queue[-1]
+        if last["type"] != "http.response.body" or not last.get("more_body", False):
+            return False
+
+        self._queue[-1] = {
+            "type": "http.response.body",
+            "body": last.get("body", b"") + message.get("body", b""),
+            "more_body": True,
+        }
+        self.stats.coalesced_messages += 1
+        metrics.increment("streaming.coalesced_messages")
+        return True
+
+    async def _write(self) -> None:
+        while True:
+            while not self._queue:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+
+            message = self._queue.popleft()
+            self._not_full.set()
+
+            start = time.perf_counter()
+            try:
+                await self._send(message)
+            except Exception as e:
+                logger.error(f"stream writer error: {e}")
+                self._queue.clear()
+                self.stats.aborted = True
+                self._not_full.set()
+                if self.on_abort is not None:
+                    self.on_abort()
+                return
+            elapsed = time.perf_counter() - start
+            self.stats.send_seconds += elapsed
+            metrics.increment("streaming.client_send_seconds", elapsed)
+
+            if _is_final_message(message):
+                return
+
+
+def _accepts_keyword(func: Callable[..., Any], name: str) -> bool:
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(
+        parameter.name == name or parameter.kind == parameter.VAR_KEYWORD
+        for parameter in parameters
+    )
+
+
+def _is_final_message(message: Message) -> bool:
+    return message["type"] == "http.response.body" and not message.get(
+        "more_body", False
+    )
+
+
+async def aclose_iterator(iterator: AsyncIterator) -> None:
+    """Close an async generator, even if the current task is being cancelled.
+
+    Closing the generator runs its `finally` blocks, which lets upstream
+    generators release their connections as soon as the client goes away.
+
+    Args:
+        iterator: The iterator to close. Non-generator iterators are ignored.
+    """
+    if inspect.isasyncgen(iterator):
+        with anyio.CancelScope(shield=True):
+            await iterator.aclose()
+
+
+class HeartbeatStream:
+    """ASGI `send` wrapper registered with a `HeartbeatScheduler`.
+
+    Records when data was last sent so that the scheduler can skip pings for
+    streams which are not idle.
+    """
+
+    def __init__(
+        self,
+        send: Send,
+        interval: float,
+        message_factory: Optional[Callable[[], Any]] = None,
+        sep: Optional[str] = None,
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            send: The ASGI send callable to wrap.
+            interval: Seconds of inactivity after which a ping is sent.
+            message_factory: Optional factory for custom ping messages.
+            sep: The line separator of the stream, used for all pings.
+        """
+        self._send = send
+        self.interval = interval
+        self.message_factory = message_factory
+        self.sep = sep
+
+        self.last_sent = time.monotonic()
+        self.closed = False
+        self.due_tick = 0
+        self._lock = asyncio.Lock()
+
+    async def __call__(self, message: Message) -> None:
+        if _is_final_message(message):
+            async with self._lock:
+                self.closed = True
+                await self._send(message)
+            return
+
+        self.last_sent = time.monotonic()
+        await self._send(message)
+
+    async def ping(self, default_message: bytes) -> None:
+        """Send a ping message, unless the stream is closed.
+
+        Args:
+            default_message: The ping message to send if there is no
+                `message_factory`.
+        """
+        async with self._lock:
+            if self.closed:
+                return
+            body = (
+                default_message
+                if self.message_factory is None
+                else ensure_bytes(self.message_factory(), self.sep)
+            )
+            self.last_sent = time.monotonic()
+            await self._send(
+                {"type": "http.response.body", "body": body, "more_body": True}
+            )
+
+
+class HeartbeatScheduler:
+    """Process-wide scheduler for keep-alive pings.
+
+    Replaces the per-connection ping task of `EventSourceResponse` with a
+    single task. Streams are kept in a timer wheel with one slot per `tick`,
+    so each tick only visits the streams which are due. Due streams which sent
+    data within their ping interval are rescheduled without a ping.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64) -> None:
+        """Constructor method.
+
+        Args:
+            tick: Resolution of the scheduler, in seconds.
+            slots: Number of slots in the timer wheel.
+        """
+        self.tick = tick
+        self.slots = slots
+
+        self._wheel: list[set[HeartbeatStream]] = [set() for _ in range(slots)]
+        self._streams: set[HeartbeatStream] = set()
+        self._current_tick = 0
+        self._task: Optional[asyncio.Task] = None
+        self._pending: set[asyncio.Future] = set()
+
+        self.pings_sent = 0
+        self.pings_skipped = 0
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def register(
+        self,
+        send: Send,
+        interval: float,
+        message_factory: Optional[Callable[[], Any]] = None,
+        sep: Optional[str] = None,
+    ) -> HeartbeatStream:
+        """Register a stream for keep-alive pings.
+
+        Args:
+            send: The ASGI send callable of the stream.
+            interval: Seconds of inactivity after which a ping is sent.
+            message_factory: Optional factory for custom ping messages.
+            sep: The line separator of the stream, used for all pings.
+
+        Returns:
+            The `HeartbeatStream` to use as the stream's send callable.
+        """
+        stream = HeartbeatStream(send, interval, message_factory, sep)
+        self._streams.add(stream)
+        self._schedule(stream, interval)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return stream
+
+    def unregister(self, stream: HeartbeatStream) -> None:
+        """Stop sending pings to a stream.
+
+        Args:
+            stream: The stream returned by `register`.
+        """
+        stream.closed = True
+        self._streams.discard(stream)
+        self._wheel[stream.due_tick % self.slots].discard(stream)
+
+        if not self._streams and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict[str, int]:
+        return dict(
+            streams=len(self._streams),
+            pings_sent=self.pings_sent,
+            pings_skipped=self.pings_skipped,
+        )
+
+    def _schedule(self, stream: HeartbeatStream, delay: float) -> None:
+        ticks = max(math.ceil(delay / self.tick), 1)
+        stream.due_tick = self._current_tick + ticks
+        self._wheel[stream.due_tick % self.slots].add(stream)
+
+    async def _run(self) -> None:
+        while self._streams:
+            await asyncio.sleep(self.tick)
+            self._current_tick += 1
+
+            slot = self._wheel[self._current_tick % self.slots]
+            due = [stream for stream in slot if stream.due_tick <= self._current_tick]
+            if not due:
+                continue
+
+            now = time.monotonic()
+            pings = []
+            for stream in due:
+                slot.discard(stream)
+                idle = now - stream.last_sent
+                if idle >= stream.interval:
+                    pings.append(stream)
+                    self._schedule(stream, stream.interval)
+                else:
+                    self.pings_skipped += 1
+                    self._schedule(stream, stream.interval - idle)
+
+            if pings:
+                self.pings_sent += len(pings)
+                comment = f"ping - {datetime.utcnow()}"
+                # pings are encoded once per line separator
+                messages: dict[Optional[str], bytes] = {}
+                for stream in pings:
+                    if stream.sep not in messages:
+                        messages[stream.sep] = ServerSentEvent(
+                            comment=comment, sep=stream.sep
+                        ).encode()
+                # slow clients must not delay the next tick
+                future = asyncio.gather(
+                    *(stream.ping(messages[stream.sep]) for stream in pings),
+                    return_exceptions=True,
+                )
+                self._pending.add(future)
+                future.add_done_callback(self._pending.discard)
+
+
+heartbeat_scheduler = HeartbeatScheduler()
+metrics.register("heartbeat", heartbeat_scheduler.stats)
+
+
+_producers: set[asyncio.Task] = set()
 
 
 class StreamingResponse(EventSourceResponse):
@@ -20,19 +607,301 @@ class StreamingResponse(EventSourceResponse):
     [EventSource protocol](https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events#interfaces)
     """
 
+    ABORT_DRAIN_TIMEOUT = 5
+
     def __init__(
         self,
         content: Any = iter(()),
         *args: Any,
+        coalescing: Optional[CoalescingPolicy] = None,
+        backpressure: Optional[BackpressurePolicy] = None,
+        max_buffer_size: int = 64,
+        replay: Optional[ReplayStore] = None,
+        resume_timeout: float = 30,
+        heartbeat: Optional[HeartbeatScheduler] = None,
+        broadcast: Optional[Broadcast] = None,
+        broadcast_key: Optional[str] = None,
         **kwargs: dict[str, Any],
     ) -> None:
         """Constructor method.
 
         Args:
             content: The content to stream.
+            coalescing: Opt-in policy to coalesce chunks into fewer ASGI messages.
+            backpressure: Opt-in policy for slow clients. If set, messages are
+                written to the socket from a bounded buffer of `max_buffer_size`
+                messages.
+            max_buffer_size: The buffer size used with `backpressure`.
+            replay: Opt-in store to make the stream resumable. Every event gets
+                an `id:` field and is recorded, and a request with a matching
+                `Last-Event-ID` header resumes from the store instead of
+                starting a new generation. The generation runs independently of
+                the connection and is cancelled after `resume_timeout` seconds
+                without connected readers.
+            resume_timeout: Seconds to wait for a reconnect before cancelling
+                a resumable generation.
+            heartbeat: Opt-in shared scheduler for keep-alive pings, such as
+                `heartbeat_scheduler`. Replaces the per-connection ping task.
+            broadcast: Opt-in hub to share generations. Responses with the same
+                `broadcast_key` attach to the running generation instead of
+                starting a new one, and each gets the full event sequence. The
+                background task runs once the shared generation ends.
+            broadcast_key: The key of the generation, required with `broadcast`.
         """
         super().__init__(content=content, *args, **kwargs)
 
+        if broadcast is not None:
+            if broadcast_key is None:
+                raise ValueError("broadcast_key is required with broadcast")
+            if replay is not None:
+                raise ValueError("broadcast cannot be combined with replay")
+
+        self.coalescing = coalescing
+        self.backpressure = backpressure
+        self.max_buffer_size = max_buffer_size
+        self.stream_stats: Optional[BackpressureStats] = None
+        self.replay = replay
+        self.resume_timeout = resume_timeout
+        self.heartbeat = heartbeat
+        self.broadcast = broadcast
+        self.broadcast_key = broadcast_key
+        self.encoder = get_event_encoder(self.sep)
+        self.disconnected = False
+
+        self._completion_callbacks: list[Callable[[], Awaitable[Any]]] = []
+        self._generating = False
+        self._stream_complete = False
+
+    def call_on_complete(self, callback: Callable[[], Awaitable[Any]]) -> None:
+        """Register a callback to await once the response is done with its content.
+
+        For resumable and broadcast streams, this is when the detached
+        generation ends. Otherwise, it is when the response finishes.
+
+        Args:
+            callback: An async callable without arguments.
+        """
+        self._completion_callbacks.append(callback)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self._respond(scope, receive, send)
+        finally:
+            if not self._generating:
+                with anyio.CancelScope(shield=True):
+                    await self._complete()
+
+    async def _respond(self, scope: Scope, receive: Receive, send: Send) -> None:
+        buffered_send = coalescer = None
+        with anyio.CancelScope() as cancel_scope:
+            if self.backpressure is not None:
+                buffered_send = send = BufferedSend(
+                    send,
+                    max_size=self.max_buffer_size,
+                    policy=self.backpressure,
+                    on_abort=cancel_scope.cancel,
+                )
+                self.stream_stats = buffered_send.stats
+            if self.coalescing is not None:
+                coalescer = send = ChunkCoalescer(send, self.coalescing)
+
+            try:
+                await self._run(scope, receive, send)
+            finally:
+                if coalescer is not None:
+                    coalescer.close()
+                if buffered_send is not None and not cancel_scope.cancel_called:
+                    buffered_send.close()
+
+        if cancel_scope.cancel_called:
+            # stream was aborted: deliver the error event before finishing
+            with anyio.move_on_after(self.ABORT_DRAIN_TIMEOUT):
+                await buffered_send.drain()
+            buffered_send.close()
+
+        # resumable and broadcast streams run the background task when the
+        # generation ends
+        if self.replay is None and self.broadcast is None:
+            await self._run_background()
+
+    async def _run(self, scope: Scope, receive: Receive, send: Send) -> None:
+        send = partial(self._send_tracking_completion, send)
+        heartbeat_stream = None
+        if self.heartbeat is not None:
+            heartbeat_stream = send = self.heartbeat.register(
+                send, self._ping_interval, self.ping_message_factory, self.sep
+            )
+
+        if self.replay is not None:
+            stream = self._resumable_stream(scope, send)
+        elif self.broadcast is not None:
+            self._generating = self.broadcast_key not in self.broadcast
+            channel = self.broadcast.publish(self.broadcast_key, self._broadcast)
+            stream = partial(self._stream_buffer, channel.buffer, 0, send)
+        else:
+            stream = partial(self.stream_response, send)
+
+        try:
+            async with anyio.create_task_group() as task_group:
+
+                async def wrap(func: Callable[[], Awaitable[None]]) -> None:
+                    await func()
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(wrap, stream)
+                if heartbeat_stream is None:
+                    task_group.start_soon(wrap, partial(self._ping, send))
+                task_group.start_soon(wrap, self.listen_for_exit_signal)
+
+                if self.data_sender_callable:
+                    task_group.start_soon(self.data_sender_callable)
+
+                await wrap(partial(self.listen_for_disconnect, receive))
+        finally:
+            if heartbeat_stream is not None:
+                self.heartbeat.unregister(heartbeat_stream)
+
+    async def _send_tracking_completion(self, send: Send, message: Message) -> None:
+        # the server reports `http.disconnect` once the final message is sent,
+        # which must not count as a client disconnect
+        if message["type"] == "http.response.body" and not message.get(
+            "more_body", False
+        ):
+            self._stream_complete = True
+        await send(message)
+
+    async def _run_background(self) -> None:
+        if self.background is None:
+            return
+        if self.disconnected and _accepts_keyword(self.background.func, "disconnected"):
+            self.background.kwargs.update({"disconnected": True})
+        await self.background()
+
+    async def _complete(self) -> None:
+        callbacks, self._completion_callbacks = self._completion_callbacks, []
+        for callback in callbacks:
+            await callback()
+
+    async def listen_for_disconnect(self, receive: Receive) -> None:
+        """Wait for the client to disconnect.
+
+        Returning from this method cancels `stream_response`. A disconnect
+        before the stream is complete is recorded in the `disconnected`
+        attribute and reported to background tasks which accept the
+        `disconnected` keyword argument.
+
+        Args:
+            receive: The receive function from the ASGI framework.
+        """
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                if not self._stream_complete:
+                    logger.info("client disconnected, cancelling stream")
+                    if self.replay is None:
+                        self.disconnected = True
+                break
+
+    def _resumable_stream(
+        self, scope: Scope, send: Send
+    ) -> Callable[[], Awaitable[None]]:
+        headers = dict(scope.get("headers", []))
+        last_event_id = headers.get(b"last-event-id", b"").decode("latin-1")
+        if last_event_id:
+            parsed_id = parse_event_id(last_event_id)
+            if parsed_id is not None:
+                stream_id, seq = parsed_id
+                buffer = self.replay.get(stream_id)
+                if buffer is not None and buffer.can_resume(seq):
+                    logger.info(f"resuming stream {stream_id} after event {seq}")
+                    return partial(self._stream_buffer, buffer, seq, send)
+            logger.info(f"cannot resume from event {last_event_id}, restarting")
+
+        stream_id, buffer = self.replay.create()
+        self._generating = True
+        producer = asyncio.get_running_loop().create_task(
+            self._produce(stream_id, buffer)
+        )
+        _producers.add(producer)
+        producer.add_done_callback(_producers.discard)
+        return partial(self._stream_buffer, buffer, 0, send)
+
+    async def _stream_buffer(self, buffer: EventBuffer, seq: int, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        async for _, chunk in buffer.iter_from(seq):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _produce(self, stream_id: str, buffer: EventBuffer) -> None:
+        async def record(message: Message) -> None:
+            if message["type"] != "http.response.body" or not message.get("body"):
+                return
+            event_id = format_event_id(stream_id, buffer.last_seq + 1)
+            buffer.append(self.encoder.encode_field("id", event_id) + message["body"])
+
+        async def cancel_when_orphaned(cancel_scope: anyio.CancelScope) -> None:
+            while True:
+                await anyio.sleep(self.resume_timeout / 2)
+                idle = time.monotonic() - buffer.detached_at
+                if buffer.readers == 0 and idle >= self.resume_timeout:
+                    logger.info(f"no readers left, cancelling stream {stream_id}")
+                    self.disconnected = True
+                    cancel_scope.cancel()
+                    return
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(cancel_when_orphaned, task_group.cancel_scope)
+                await self.stream_response(record)
+                task_group.cancel_scope.cancel()
+        finally:
+            buffer.close()
+
+        try:
+            await self._run_background()
+        finally:
+            await self._complete()
+
+    async def _broadcast(self, channel: BroadcastChannel) -> None:
+        async def record(message: Message) -> None:
+            if message["type"] == "http.response.body" and message.get("body"):
+                await channel.publish(message["body"])
+
+        try:
+            await self.stream_response(record)
+        except anyio.get_cancelled_exc_class():
+            self.disconnected = True
+            with anyio.CancelScope(shield=True):
+                await self._run_background()
+                await self._complete()
+            raise
+
+        try:
+            await self._run_background()
+        finally:
+            await self._complete()
+
+    def encode_content(self, data: Any) -> bytes:
+        """Encode an item of `content` into a server-sent event frame.
+
+        Args:
+            data: bytes, a `ServerSentEvent`, a dict of event fields or any
+                other value which is sent as event data.
+        """
+        if isinstance(data, bytes):
+            return data
+        if isinstance(data, dict) and data.keys() <= {"data", "event", "id"}:
+            return self.encoder.encode(**data)
+        if isinstance(data, (dict, ServerSentEvent)):
+            return ensure_bytes(data, self.sep)
+        return self.encoder.encode(data)
+
     async def stream_response(self, send: Send) -> None:
         """Streams data chunks to client by iterating over `content`.
 
@@ -52,26 +921,22 @@ class StreamingResponse(EventSourceResponse):
 
         try:
             async for data in self.body_iterator:
-                chunk = ensure_bytes(data, self.sep)
+                chunk = self.encode_content(data)
                 logger.debug(f"chunk: {chunk.decode()}")
                 await send(
                     {"type": "http.response.body", "body": chunk, "more_body": True}
                 )
         except Exception as e:
             logger.error(f"body iterator error: {e}")
-            chunk = ServerSentEvent(
+            chunk = self.encoder.encode(
                 data=dict(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail=HTTPStatusDetail.INTERNAL_SERVER_ERROR,
                 ),
                 event=Events.ERROR,
             )
-            await send(
-                {
-                    "type": "http.response.body",
-                    "body": ensure_bytes(chunk, None),
-                    "more_body": True,
-                }
-            )
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            await aclose_iterator(self.body_iterator)
 
         await send({"type": "http.response.body", "body": b"", "more_body": False})
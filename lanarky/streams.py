@@ -0,0 +1,355 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import anyio
+
+from lanarky.logging import logger
+from lanarky.metrics import metrics
+
+
+class EventBuffer:
+    """Bounded buffer of events produced by a single generation.
+
+    Every appended event gets a sequence number, starting from 1. Readers can
+    iterate the buffer from any sequence number which is still in the ring and
+    keep waiting for new events until the buffer is closed.
+    """
+
+    def __init__(self, maxlen: Optional[int] = 1024) -> None:
+        """Constructor method.
+
+        Args:
+            maxlen: The maximum number of buffered events. Older events are
+                evicted first. `None` keeps all events.
+        """
+        self._events: deque[tuple[int, Any]] = deque(maxlen=maxlen)
+        self._last_seq = 0
+        self._updated = asyncio.Event()
+
+        self.closed = False
+        self.readers = 0
+        self.updated_at = self.detached_at = time.monotonic()
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the last appended event."""
+        return self._last_seq
+
+    @property
+    def first_seq(self) -> int:
+        """Sequence number of the oldest buffered event."""
+        return self._events[0][0] if self._events else self._last_seq + 1
+
+    def append(self, event: Any) -> int:
+        """Append an event and wake up waiting readers.
+
+        Args:
+            event: The event to append.
+
+        Returns:
+            The sequence number of the event.
+        """
+        if self.closed:
+            raise RuntimeError("cannot append to a closed buffer")
+
+        self._last_seq += 1
+        self._events.append((self._last_seq, event))
+        self._notify()
+        return self._last_seq
+
+    def close(self) -> None:
+        """Mark the buffer as complete and wake up waiting readers."""
+        self.closed = True
+        self._notify()
+
+    def can_resume(self, seq: int) -> bool:
+        """Check if all events after `seq` are still buffered.
+
+        Args:
+            seq: The sequence number of the last event seen by the reader.
+        """
+        return self.first_seq - 1 <= seq <= self._last_seq
+
+    async def iter_from(self, seq: int = 0) -> AsyncIterator[tuple[int, Any]]:
+        """Iterate over events after `seq`, waiting for new events until closed.
+
+        Args:
+            seq: The sequence number of the last event seen by the reader.
+
+        Yields:
+            Tuples of sequence number and event.
+        """
+        self.readers += 1
+        try:
+            while True:
+                updated = self._updated
+                if self._events and seq < self._last_seq:
+                    start = max(seq - self.first_seq + 1, 0)
+                    for event_seq, event in list(islice(self._events, start, None)):
+                        seq = event_seq
+                        yield event_seq, event
+                    continue
+                if self.closed:
+                    return
+                await updated.wait()
+        finally:
+            self.readers -= 1
+            self.updated_at = time.monotonic()
+            if self.readers == 0:
+                self.detached_at = self.updated_at
+
+    def _notify(self) -> None:
+        self.updated_at = time.monotonic()
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+
+class ReplayStore:
+    """Registry of event buffers for resumable streams.
+
+    Buffers are evicted `ttl` seconds after their last update once they have no
+    readers, or when more than `max_streams` buffers are stored.
+    """
+
+    def __init__(
+        self, maxlen: Optional[int] = 1024, ttl: float = 300, max_streams: int = 10000
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            maxlen: The maximum number of events kept per stream.
+            ttl: Time to live of idle buffers, in seconds.
+            max_streams: The maximum number of stored buffers.
+        """
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.max_streams = max_streams
+
+        self._buffers: OrderedDict[str, EventBuffer] = OrderedDict()
+        self._evicted_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def create(self) -> tuple[str, EventBuffer]:
+        """Create a buffer for a new stream.
+
+        Returns:
+            Tuple of stream ID and buffer.
+        """
+        self.evict()
+
+        stream_id = uuid.uuid4().hex
+        buffer = EventBuffer(maxlen=self.maxlen)
+        self._buffers[stream_id] = buffer
+
+        while len(self._buffers) > self.max_streams:
+            evicted_id, _ = self._buffers.popitem(last=False)
+            logger.debug(f"replay buffer evicted: {evicted_id}")
+
+        return stream_id, buffer
+
+    def get(self, stream_id: str) -> Optional[EventBuffer]:
+        """Get the buffer of a stream, if it has not been evicted.
+
+        Args:
+            stream_id: The stream ID.
+        """
+        self.evict()
+        return self._buffers.get(stream_id)
+
+    def evict(self) -> None:
+        """Evict buffers which expired.
+
+        Runs at most once per second (or per `ttl`, if shorter).
+        """
+        now = time.monotonic()
+        if now - self._evicted_at < min(self.ttl, 1):
+            return
+        self._evicted_at = now
+
+        expired = [
+            stream_id
+            for stream_id, buffer in self._buffers.items()
+            if buffer.readers == 0 and now - buffer.updated_at > self.ttl
+        ]
+        for stream_id in expired:
+            del self._buffers[stream_id]
+
+
+class BroadcastChannel:
+    """A single generation shared by many subscribers.
+
+    Events published by the producer are recorded in an `EventBuffer`. Every
+    subscriber iterates the buffer with its own cursor, so late joiners first
+    catch up on the buffered events.
+    """
+
+    def __init__(self, key: str, maxlen: Optional[int] = None) -> None:
+        """Constructor method.
+
+        Args:
+            key: The channel key.
+            maxlen: The maximum number of buffered events. `None` keeps all
+                events, so that late joiners get the full sequence.
+        """
+        self.key = key
+        self.buffer = EventBuffer(maxlen=maxlen)
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def subscribers(self) -> int:
+        """Number of attached subscribers."""
+        return self.buffer.readers
+
+    @property
+    def closed(self) -> bool:
+        """Whether the producer has finished."""
+        return self.buffer.closed
+
+    async def publish(self, event: Any) -> None:
+        """Publish an event to all subscribers.
+
+        Args:
+            event: The event to publish.
+        """
+        self.buffer.append(event)
+
+    # duck-types `WebSocket.send_json`, so that websocket callback handlers
+    # can publish to a channel
+    send_json = publish
+
+    async def subscribe(self, seq: int = 0) -> AsyncIterator[Any]:
+        """Iterate over the events of the channel until the producer finishes.
+
+        Args:
+            seq: The sequence number of the last event seen by the subscriber.
+        """
+        async for _, event in self.buffer.iter_from(seq):
+            yield event
+
+    def cancel(self) -> None:
+        """Cancel the producer."""
+        if self.task is not None:
+            self.task.cancel()
+
+
+Producer = Callable[[BroadcastChannel], Awaitable[None]]
+
+
+class Broadcast:
+    """Hub of broadcast channels.
+
+    Runs one producer per key, no matter how many subscribers are attached.
+    Finished channels are removed from the hub, so publishing to the same key
+    afterwards starts a new generation.
+    """
+
+    def __init__(self, maxlen: Optional[int] = None, idle_timeout: float = 30) -> None:
+        """Constructor method.
+
+        Args:
+            maxlen: The maximum number of buffered events per channel.
+            idle_timeout: Seconds without subscribers after which a producer
+                is cancelled.
+        """
+        self.maxlen = maxlen
+        self.idle_timeout = idle_timeout
+
+        self._channels: dict[str, BroadcastChannel] = {}
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._channels
+
+    def get(self, key: str) -> Optional[BroadcastChannel]:
+        """Get the running channel of a key.
+
+        Args:
+            key: The channel key.
+        """
+        return self._channels.get(key)
+
+    def publish(self, key: str, producer: Producer) -> BroadcastChannel:
+        """Get the running channel of a key, or start a new one.
+
+        Args:
+            key: The channel key.
+            producer: Async callable which publishes events to the channel.
+                Only called if no channel is running for `key`.
+        """
+        channel = self._channels.get(key)
+        if channel is not None:
+            return channel
+
+        channel = BroadcastChannel(key, maxlen=self.maxlen)
+        channel.task = asyncio.get_running_loop().create_task(
+            self._produce(channel, producer)
+        )
+        self._channels[key] = channel
+        return channel
+
+    def stats(self) -> dict[str, int]:
+        return dict(
+            channels=len(self._channels),
+            subscribers=sum(channel.subscribers for channel in self._channels.values()),
+        )
+
+    async def _produce(self, channel: BroadcastChannel, producer: Producer) -> None:
+        buffer = channel.buffer
+
+        async def cancel_when_idle(cancel_scope: anyio.CancelScope) -> None:
+            while True:
+                await anyio.sleep(self.idle_timeout / 2)
+                idle = time.monotonic() - buffer.detached_at
+                if buffer.readers == 0 and idle >= self.idle_timeout:
+                    logger.info(f"no subscribers left, cancelling {channel.key}")
+                    cancel_scope.cancel()
+                    return
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(cancel_when_idle, task_group.cancel_scope)
+                await producer(channel)
+                task_group.cancel_scope.cancel()
+        except Exception as e:
+            logger.error(f"broadcast producer error: {e}")
+        finally:
+            buffer.close()
+            if self._channels.get(channel.key) is channel:
+                del self._channels[channel.key]
+
+
+broadcast = Broadcast()
+metrics.register("broadcast", broadcast.stats)
+
+
+def format_event_id(stream_id: str, seq: int) -> str:
+    """Format the ID of a resumable event.
+
+    Args:
+        stream_id: The stream ID.
+        seq: The sequence number of the event.
+    """
+    return f"{stream_id}:{seq}"
+
+
+def parse_event_id(event_id: str) -> Optional[tuple[str, int]]:
+    """Parse the ID of a resumable event.
+
+    Args:
+        event_id: The event ID, usually from the `Last-Event-ID` header.
+
+    Returns:
+        Tuple of stream ID and sequence number, or `None` if invalid.
+    """
+    stream_id, _, seq = event_id.strip().rpartition(":")
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
@@ -1,6 +1,10 @@
-from typing import Any
+import hashlib
+import json
+from typing import Any, Callable, Optional, Union
 
 import pydantic
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
 from pydantic.fields import FieldInfo
 
 try:
@@ -13,6 +17,122 @@ except ImportError:
 
 PYDANTIC_V2 = pydantic.VERSION.startswith("2.")
 
+JSONDumps = Callable[[Any], Union[str, bytes]]
+JSONLoads = Callable[[Union[str, bytes]], Any]
+
+
+def _dumps(data: Any) -> str:
+    # the same output as `WebSocket.send_json`
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class JSONCodec:
+    """JSON encoder and decoder used for websocket messages, event payloads
+    and clients.
+
+    Encoders may return `str` or UTF-8 `bytes`, so that orjson- or
+    msgspec-style functions can be used directly. Encoders should convert
+    values which are not JSON serializable, as the default encoder does with
+    `str`, and decoders should raise `ValueError` for invalid documents.
+
+    Usage:
+        ```python
+        import orjson
+
+        from lanarky.utils import set_json_codec
+
+        set_json_codec(
+            dumps=lambda data: orjson.dumps(data, default=str), loads=orjson.loads
+        )
+        ```
+    """
+
+    def __init__(
+        self, dumps: Optional[JSONDumps] = None, loads: Optional[JSONLoads] = None
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            dumps: The JSON encoder. Defaults to compact `json.dumps`.
+            loads: The JSON decoder. Defaults to `json.loads`.
+        """
+        self.dumps = dumps or _dumps
+        self.loads = loads or json.loads
+
+    def encode(self, data: Any) -> str:
+        """Encode data to a JSON string.
+
+        Args:
+            data: The JSON serializable data.
+        """
+        encoded = self.dumps(data)
+        if isinstance(encoded, bytes):
+            return encoded.decode("utf-8")
+        return encoded
+
+    def encode_bytes(self, data: Any) -> bytes:
+        """Encode data to UTF-8 JSON bytes.
+
+        Args:
+            data: The JSON serializable data.
+        """
+        encoded = self.dumps(data)
+        if isinstance(encoded, str):
+            return encoded.encode("utf-8")
+        return encoded
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        """Decode a JSON string or bytes.
+
+        Args:
+            data: The JSON document.
+        """
+        return self.loads(data)
+
+
+_json_codec = JSONCodec()
+
+
+def get_json_codec() -> JSONCodec:
+    """Get the JSON codec of Lanarky."""
+    return _json_codec
+
+
+def set_json_codec(
+    dumps: Optional[JSONDumps] = None, loads: Optional[JSONLoads] = None
+) -> JSONCodec:
+    """Set the JSON codec used by servers, callback handlers and clients.
+
+    Call it once at import time, before the application starts. Calling it
+    without arguments restores the stdlib codec.
+
+    Args:
+        dumps: The JSON encoder, returning `str` or `bytes`.
+        loads: The JSON decoder, accepting `str` and `bytes`.
+    """
+    global _json_codec
+
+    _json_codec = JSONCodec(dumps, loads)
+    return _json_codec
+
+
+def json_dumps(data: Any) -> str:
+    """Encode data to a JSON string with the JSON codec of Lanarky.
+
+    Args:
+        data: The JSON serializable data.
+    """
+    return _json_codec.encode(data)
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """Decode a JSON string or bytes with the JSON codec of Lanarky.
+
+    Args:
+        data: The JSON document.
+    """
+    return _json_codec.decode(data)
+
 
 def model_dump(model: pydantic.BaseModel, **kwargs) -> dict[str, Any]:
     """Dump a pydantic model to a dictionary.
@@ -48,3 +168,52 @@ def model_fields(model: pydantic.BaseModel) -> dict[str, FieldInfo]:
         return model.model_fields
     else:
         return model.__fields__
+
+
+def canonical_hash(data: Any) -> str:
+    """Hash JSON-like data independently of dict ordering.
+
+    Values which are not JSON serializable are hashed by their `str` value.
+    The stdlib encoder is used regardless of the JSON codec, since keys must be
+    sorted for stable hashes.
+
+    Args:
+        data: The data to hash.
+    """
+    serialized = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+async def parse_request(request: Request, model: type[pydantic.BaseModel]):
+    """Parse and validate a JSON request body.
+
+    Validation errors are raised as `RequestValidationError`, so that FastAPI
+    responds with status 422 as for declared body parameters.
+
+    Args:
+        request: The request.
+        model: A pydantic model of the request body.
+    """
+    try:
+        data = json_loads(await request.body())
+    except ValueError as e:
+        raise RequestValidationError(
+            [{"type": "json_invalid", "loc": ("body",), "msg": str(e), "input": {}}]
+        )
+
+    if not isinstance(data, dict):
+        raise RequestValidationError(
+            [
+                {
+                    "type": "dict_type",
+                    "loc": ("body",),
+                    "msg": "Input should be a valid dictionary",
+                    "input": data,
+                }
+            ]
+        )
+
+    try:
+        return model(**data)
+    except pydantic.ValidationError as e:
+        raise RequestValidationError(e.errors())
@@ -1,22 +1,100 @@
+import asyncio
+from collections import deque
 from contextlib import asynccontextmanager
-from typing import Generator
+from importlib.util import find_spec
+from typing import Any, Callable, Collection, Generator, Optional
 
 from fastapi.websockets import WebSocket, WebSocketDisconnect
 
 from lanarky.logging import logger
-from lanarky.utils import StrEnum
+from lanarky.utils import StrEnum, json_dumps, json_loads
+
+if find_spec("msgpack"):
+    import msgpack
+else:
+    msgpack = None
 
 
 class DataMode(StrEnum):
     JSON = "json"
     TEXT = "text"
     BYTES = "bytes"
+    MSGPACK = "msgpack"
+
+
+def _require_msgpack() -> None:
+    if msgpack is None:
+        raise ImportError("run `pip install lanarky[msgpack]` to use DataMode.MSGPACK")
+
+
+def encode_msgpack(data: Any) -> bytes:
+    """Encode data to MessagePack.
+
+    Values which are not serializable are converted with `str`.
+
+    Args:
+        data: The data to encode.
+    """
+    _require_msgpack()
+    return msgpack.packb(data, default=str)
+
+
+def decode_msgpack(data: bytes) -> Any:
+    """Decode MessagePack data.
+
+    Args:
+        data: The MessagePack payload.
+    """
+    _require_msgpack()
+    return msgpack.unpackb(data, raw=False)
+
+
+def get_data_mode(websocket: WebSocket) -> DataMode:
+    """Get the data mode requested by a websocket client.
+
+    Clients request `DataMode.MSGPACK` with the `msgpack` subprotocol, which
+    is only available if `msgpack` is installed. All other clients use
+    `DataMode.JSON`.
+
+    Args:
+        websocket: The websocket.
+    """
+    if msgpack is not None and DataMode.MSGPACK in websocket.scope.get(
+        "subprotocols", ()
+    ):
+        return DataMode.MSGPACK
+    return DataMode.JSON
+
+
+async def send_json(websocket: Any, data: Any) -> None:
+    """Send JSON data encoded with the JSON codec of `lanarky.utils`.
+
+    Websockets receive a text frame. Other senders, e.g. a `BufferedWebSocket`
+    or a `BroadcastChannel`, receive the data with their `send_json` method.
+
+    Args:
+        websocket: A WebSocket or an object with a `send_json` method.
+        data: The JSON serializable data.
+    """
+    if isinstance(websocket, WebSocket):
+        await websocket.send_text(json_dumps(data))
+    else:
+        await websocket.send_json(data)
+
+
+async def receive_json(websocket: WebSocket) -> Any:
+    """Receive a text frame and decode it with the JSON codec of `lanarky.utils`.
+
+    Args:
+        websocket: The websocket to receive from.
+    """
+    return json_loads(await websocket.receive_text())
 
 
 class WebsocketSession:
     """Class to handle websocket connections.
 
-    Supports 3 data modes: JSON, TEXT, and BYTES.
+    Supports 4 data modes: JSON, TEXT, BYTES and MSGPACK.
 
     To know more about WebSockets, read the
     [FastAPI documentation](https://fastapi.tiangolo.com/advanced/websockets/).
@@ -28,6 +106,9 @@ class WebsocketSession:
     ) -> Generator:
         """Connect to a websocket and yield data from it.
 
+        With `DataMode.MSGPACK`, the `msgpack` subprotocol is accepted if the
+        client requested it.
+
         Args:
             websocket: The websocket to connect to.
             mode: The data mode to use. Defaults to DataMode.JSON.
@@ -35,7 +116,17 @@ class WebsocketSession:
         Yields:
             Any: data from client side.
         """
-        await websocket.accept()
+        if mode == DataMode.MSGPACK:
+            _require_msgpack()
+            await websocket.accept(
+                subprotocol=(
+                    DataMode.MSGPACK.value
+                    if get_data_mode(websocket) == DataMode.MSGPACK
+                    else None
+                )
+            )
+        else:
+            await websocket.accept()
         try:
             if mode == DataMode.JSON:
                 yield self.iter_json(websocket)
@@ -43,6 +134,8 @@ class WebsocketSession:
                 yield self.iter_text(websocket)
             elif mode == DataMode.BYTES:
                 yield self.iter_bytes(websocket)
+            elif mode == DataMode.MSGPACK:
+                yield self.iter_msgpack(websocket)
             else:
                 raise ValueError(f"Invalid DataMode: {mode}")
         except WebSocketDisconnect:
@@ -60,5 +153,152 @@ class WebsocketSession:
 
     async def iter_json(self, websocket: WebSocket):
         while True:
-            data = await websocket.receive_json()
+            data = await receive_json(websocket)
+            yield data
+
+    async def iter_msgpack(self, websocket: WebSocket):
+        while True:
+            data = decode_msgpack(await websocket.receive_bytes())
             yield data
+
+
+class MessagePackWebSocket:
+    """`send_json` wrapper which sends messages as MessagePack binary frames.
+
+    Callback handlers and endpoints send messages with `send_json`, so they
+    are sent in `DataMode.MSGPACK` without changes. String data of the events
+    in `json_events`, which callback handlers encode as JSON, is decoded, so
+    that frames carry structured data instead of nested JSON documents.
+    """
+
+    def __init__(
+        self, websocket: WebSocket, *, json_events: Collection[str] = ()
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            websocket: The websocket to send messages to.
+            json_events: Events whose string data is JSON.
+        """
+        _require_msgpack()
+        self.websocket = websocket
+        self.json_events = frozenset(json_events)
+
+    async def send_json(self, data: Any) -> None:
+        """Send a message as a MessagePack binary frame.
+
+        Args:
+            data: The message.
+        """
+        if (
+            self.json_events
+            and isinstance(data, dict)
+            and data.get("event") in self.json_events
+            and isinstance(data.get("data"), str)
+            and data["data"]
+        ):
+            data = {**data, "data": json_loads(data["data"])}
+        await self.websocket.send_bytes(encode_msgpack(data))
+
+
+class BufferedWebSocket:
+    """`send_json` wrapper with a bounded buffer between producer and websocket.
+
+    Messages are queued and sent by a separate writer task, so the producer,
+    e.g. a chain calling its callback handlers, is not stalled by socket
+    writes. When the buffer is full, the message is merged into the last
+    buffered message with `merge`. If it cannot be merged, the producer waits
+    until the writer frees up space.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        *,
+        max_size: int = 64,
+        merge: Optional[Callable[[Any, Any], Optional[Any]]] = None,
+    ) -> None:
+        """Constructor method.
+
+        Args:
+            websocket: The websocket to send messages to.
+            max_size: The maximum number of buffered messages.
+            merge: Callable which merges two messages into one, or returns
+                `None` if they cannot be merged.
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be greater than 0")
+
+        self.websocket = websocket
+        self.max_size = max_size
+        self.merge = merge
+        self.merged_messages = 0
+
+        self._queue: deque[Any] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._empty = asyncio.Event()
+        self._empty.set()
+        self._writer: Optional[asyncio.Task] = None
+
+    async def send_json(self, data: Any) -> None:
+        """Queue a message to be sent as JSON.
+
+        Args:
+            data: The JSON serializable message.
+        """
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._write())
+        elif self._writer.done():
+            # re-raise the error of the writer, e.g. a disconnect
+            self._writer.result()
+
+        if len(self._queue) >= self.max_size and self.merge is not None:
+            merged = self.merge(self._queue[-1], data)
+            if merged is not None:
+                self._queue[-1] = merged
+                self.merged_messages += 1
+                return
+
+        while len(self._queue) >= self.max_size:
+            self._not_full.clear()
+            await self._not_full.wait()
+            if self._writer.done():
+                self._writer.result()
+
+        self._queue.append(data)
+        self._empty.clear()
+        self._not_empty.set()
+
+    async def drain(self) -> None:
+        """Wait until all buffered messages are sent."""
+        if self._writer is None:
+            return
+        waiter = asyncio.ensure_future(self._empty.wait())
+        await asyncio.wait([waiter, self._writer], return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if self._writer.done():
+            self._writer.result()
+
+    def close(self) -> None:
+        """Stop the writer task and drop buffered messages."""
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+        self._queue.clear()
+
+    async def _write(self) -> None:
+        while True:
+            while not self._queue:
+                self._empty.set()
+                self._not_empty.clear()
+                await self._not_empty.wait()
+
+            data = self._queue.popleft()
+            self._not_full.set()
+            try:
+                await send_json(self.websocket, data)
+            except BaseException:
+                # wake up a blocked producer to re-raise the error
+                self._not_full.set()
+                raise
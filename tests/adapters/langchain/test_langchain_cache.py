@@ -0,0 +1,132 @@
+import pytest
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema.document import Document
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_core.retrievers import BaseRetriever
+
+from lanarky.adapters.langchain.cache import (
+    CachedEmbeddings,
+    CachedRetriever,
+    normalize_query,
+)
+from lanarky.cache import InMemoryCache
+from lanarky.metrics import metrics
+
+
+class CountingRetriever(BaseRetriever):
+    calls: int = 0
+    search_kwargs: dict = {"k": 1}
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        self.calls += 1
+        return [Document(page_content=query, metadata={"k": self.search_kwargs["k"]})]
+
+
+class Index(list):
+    pass
+
+
+class IndexRetriever(BaseRetriever):
+    vectorstore: Index
+    search_kwargs: dict = {"k": 1}
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return [Document(page_content=self.vectorstore[0])]
+
+
+def test_normalize_query():
+    assert normalize_query("  What is  LANARKY?\n") == "what is lanarky?"
+
+
+@pytest.mark.asyncio
+async def test_cached_retriever():
+    cache = InMemoryCache(maxsize=8)
+    wrapped = CountingRetriever()
+    retriever = CachedRetriever(
+        retriever=wrapped,
+        cache=cache,
+        normalize=normalize_query,
+        metrics_name="test_retriever_cache",
+    )
+
+    [document] = retriever.invoke("What is Lanarky?")
+    assert document.page_content == "What is Lanarky?"
+    document.metadata["k"] = 42
+
+    [document] = await retriever.ainvoke("what is  lanarky?")
+    assert wrapped.calls == 1
+    # cached documents are copies
+    assert document.metadata == {"k": 1}
+
+    await retriever.ainvoke("something else")
+    assert wrapped.calls == 2
+
+    # retrievers with different search arguments do not share cache entries
+    other = CachedRetriever(
+        retriever=CountingRetriever(search_kwargs={"k": 2}), cache=cache
+    )
+    [document] = other.invoke("What is Lanarky?")
+    assert document.metadata == {"k": 2}
+
+    snapshot = metrics.snapshot()
+    assert snapshot["test_retriever_cache.hits"] == 1
+    assert snapshot["test_retriever_cache.misses"] == 3
+    metrics.unregister("test_retriever_cache")
+
+    # retrievers over different vector stores do not share cache entries
+    first = CachedRetriever(
+        retriever=IndexRetriever(vectorstore=Index(["a"])), cache=cache
+    )
+    second = CachedRetriever(
+        retriever=IndexRetriever(vectorstore=Index(["b"])), cache=cache
+    )
+    assert first.invoke("query")[0].page_content == "a"
+    assert second.invoke("query")[0].page_content == "b"
+
+    # unless they are given the same namespace
+    third = CachedRetriever(
+        retriever=IndexRetriever(vectorstore=Index(["c"])),
+        cache=cache,
+        namespace="index",
+    )
+    fourth = CachedRetriever(
+        retriever=IndexRetriever(vectorstore=Index(["d"])),
+        cache=cache,
+        namespace="index",
+    )
+    assert third.invoke("query")[0].page_content == "c"
+    assert fourth.invoke("query")[0].page_content == "c"
+
+
+@pytest.mark.asyncio
+async def test_cached_embeddings():
+    class CountingEmbeddings(FakeEmbeddings):
+        calls: int = 0
+
+        def embed_query(self, text: str) -> list[float]:
+            self.calls += 1
+            return super().embed_query(text)
+
+    wrapped = CountingEmbeddings(size=4)
+    embeddings = CachedEmbeddings(wrapped, InMemoryCache(), normalize=normalize_query)
+
+    first = embeddings.embed_query("Hello World")
+    assert await embeddings.aembed_query("hello world ") == first
+    assert wrapped.calls == 1
+
+    assert len(embeddings.embed_documents(["a", "b"])) == 2
+    assert embeddings.cache.stats()["hits"] == 1
+
+    # models with different configurations do not share cache entries
+    cache = InMemoryCache()
+    small = CachedEmbeddings(FakeEmbeddings(size=4), cache)
+    large = CachedEmbeddings(FakeEmbeddings(size=8), cache)
+    assert len(small.embed_query("Hello World")) == 4
+    assert len(large.embed_query("Hello World")) == 8
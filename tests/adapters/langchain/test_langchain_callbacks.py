@@ -1,4 +1,5 @@
-from unittest.mock import MagicMock, create_autospec, patch
+import json
+from unittest.mock import AsyncMock, MagicMock, create_autospec, patch
 
 import pytest
 from langchain.agents import AgentExecutor
@@ -11,6 +12,8 @@ from lanarky.adapters.langchain.utils import (
     get_streaming_callbacks,
     get_websocket_callbacks,
 )
+from lanarky.events import Events, ServerSentEvent, ensure_bytes
+from lanarky.utils import model_dump, model_dump_json, set_json_codec
 from lanarky.websockets import WebSocket
 
 
@@ -59,23 +62,15 @@ def test_websocket_callback(websocket: WebSocket):
 def test_callbacks_construct_message():
     callback = callbacks.StreamingCallbackHandler()
 
-    with patch("lanarky.adapters.langchain.callbacks.ServerSentEvent") as sse, patch(
-        "lanarky.adapters.langchain.callbacks.ensure_bytes"
-    ) as ensure_bytes:
-        data = "test_data"
-        event = "test_event"
-        expected_return_value = {
-            "type": "http.response.body",
-            "body": ensure_bytes.return_value,
-            "more_body": True,
-        }
-
-        result = callback._construct_message(data, event)
-
-        sse.assert_called_with(data=data, event=event)
-        ensure_bytes.assert_called_with(sse.return_value, None)
+    data = "test_data"
+    event = "test_event"
+    expected_return_value = {
+        "type": "http.response.body",
+        "body": ensure_bytes(ServerSentEvent(data=data, event=event), None),
+        "more_body": True,
+    }
 
-        assert result == expected_return_value
+    assert callback._construct_message(data, event) == expected_return_value
 
     callback = callbacks.WebSocketCallbackHandler()
 
@@ -98,6 +93,33 @@ def test_get_token():
     )
 
 
+@pytest.mark.parametrize(
+    "token", ["", " Hello", 'quote " and \\', "line\nbreak\t", "\x00\x1f", "é😀\u2028"]
+)
+def test_token_payload_encoding(token: str):
+    expected = model_dump_json(callbacks.TokenEventData(token=token))
+    assert callbacks.get_token_data(token, mode="json") == expected
+
+    data = callbacks.get_token_data(token, mode="json")
+    for event in [Events.COMPLETION, None]:
+        assert callbacks.encode_websocket_message(data, event) == json.dumps(
+            dict(data=data, event=event), separators=(",", ":"), ensure_ascii=False
+        )
+
+
+@pytest.mark.asyncio
+async def test_send_websocket_message(websocket: WebSocket):
+    await callbacks.send_websocket_message(websocket, "data", Events.COMPLETION)
+    websocket.send_text.assert_awaited_once_with('{"data":"data","event":"completion"}')
+
+    # websocket-like senders receive the message dict
+    sender = MagicMock(send_json=AsyncMock())
+    await callbacks.send_websocket_message(sender, "data", Events.COMPLETION)
+    sender.send_json.assert_awaited_once_with(
+        dict(data="data", event=Events.COMPLETION)
+    )
+
+
 @pytest.mark.asyncio
 async def test_token_callbacks(send: Send, websocket: WebSocket):
     with pytest.raises(ValueError):
@@ -149,30 +171,30 @@ async def test_token_callbacks(send: Send, websocket: WebSocket):
     await callback.on_llm_new_token("test_token")
     assert callback.streaming
     assert not callback.llm_cache_used
-    callback.websocket.send_json.assert_awaited()
+    callback.websocket.send_text.assert_awaited()
 
     callback.llm_cache_used = True
     await callback.on_llm_new_token("test_token")
     assert not callback.llm_cache_used
 
-    websocket.send_json.reset_mock()
+    websocket.send_text.reset_mock()
     callback = callbacks.TokenWebSocketCallbackHandler(
         websocket=websocket, output_key="dummy"
     )
     outputs = {"dummy": "output_data"}
     await callback.on_chain_end(outputs)
-    callback.websocket.send_json.assert_awaited()
+    callback.websocket.send_text.assert_awaited()
 
-    websocket.send_json.reset_mock()
+    websocket.send_text.reset_mock()
     callback = callbacks.TokenWebSocketCallbackHandler(
         websocket=websocket, output_key="dummy"
     )
     callback.llm_cache_used = False
     callback.streaming = True
     await callback.on_chain_end(outputs)
-    callback.websocket.send_json.assert_not_awaited()
+    callback.websocket.send_text.assert_not_awaited()
 
-    websocket.send_json.reset_mock()
+    websocket.send_text.reset_mock()
     callback = callbacks.TokenWebSocketCallbackHandler(
         websocket=websocket, output_key="dummy"
     )
@@ -214,12 +236,85 @@ async def test_source_documents_callbacks(send: Send, websocket: WebSocket):
 
     outputs = {"source_documents": [Document(page_content="test_content")]}
     await callback.on_chain_end(outputs)
-    callback.websocket.send_json.assert_awaited()
+    callback.websocket.send_text.assert_awaited()
 
-    websocket.send_json.reset_mock()
+    websocket.send_text.reset_mock()
     outputs = {"dummy": "output_data"}
     await callback.on_chain_end(outputs)
-    callback.websocket.send_json.assert_not_awaited()
+    callback.websocket.send_text.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_source_documents_callbacks_emit_on_retrieval(
+    send: Send, websocket: WebSocket
+):
+    documents = [Document(page_content="test_content", metadata={"page": 1})]
+
+    callback = callbacks.SourceDocumentsStreamingCallbackHandler(
+        send=send, emit_on_retrieval=True, max_content_length=4
+    )
+    await callback.on_retriever_end(documents)
+    message = send.call_args.args[0]
+    assert b'"page_content":"test"' in message["body"]
+    assert b'"page":1' in message["body"]
+
+    # documents are not sent again with the chain outputs
+    send.reset_mock()
+    await callback.on_chain_end({"source_documents": documents})
+    send.assert_not_awaited()
+
+    callback.reset()
+    callback.send = send
+    await callback.on_chain_end({"source_documents": documents})
+    send.assert_awaited_once()
+
+    callback = callbacks.SourceDocumentsWebSocketCallbackHandler(
+        websocket=websocket, emit_on_retrieval=True
+    )
+    await callback.on_chain_start({}, {})
+    await callback.on_retriever_end(documents)
+    await callback.on_chain_end({"source_documents": documents})
+    websocket.send_text.assert_awaited_once()
+    assert "test_content" in json.loads(websocket.send_text.call_args.args[0])["data"]
+
+    # the next message of the session sends its documents again
+    await callback.on_chain_start({}, {})
+    await callback.on_retriever_end(documents)
+    assert websocket.send_text.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_source_documents_data():
+    documents = [Document(page_content="a" * 100) for _ in range(2)]
+
+    with patch.object(callbacks, "SOURCE_DOCUMENTS_OFFLOAD_THRESHOLD", 150), patch(
+        "lanarky.adapters.langchain.callbacks.run_in_threadpool",
+        wraps=callbacks.run_in_threadpool,
+    ) as run_in_threadpool:
+        data = await callbacks.get_source_documents_data(documents)
+        run_in_threadpool.assert_awaited_once()
+        assert data.count("a" * 100) == 2
+
+        run_in_threadpool.reset_mock()
+        data = await callbacks.get_source_documents_data(
+            documents, max_content_length=10
+        )
+        run_in_threadpool.assert_not_awaited()
+        assert data.count("a" * 10) == 2
+        assert "a" * 11 not in data
+
+    # source documents are encoded with the JSON codec
+    set_json_codec(dumps=lambda data: json.dumps(data, indent=1))
+    try:
+        data = await callbacks.get_source_documents_data(documents)
+    finally:
+        set_json_codec()
+    assert data.startswith('{\n "source_documents"')
+    assert json.loads(data) == model_dump(
+        callbacks.SourceDocumentsEventData(
+            source_documents=[document.dict() for document in documents]
+        )
+    )
 
 
 @pytest.mark.asyncio
@@ -263,16 +358,55 @@ async def test_final_token_callbacks(send: Send, websocket: WebSocket):
     callback.check_if_answer_reached = MagicMock(return_value=True)
     await callback.on_llm_new_token("test_token")
     assert callback.answer_reached
-    callback.websocket.send_json.assert_awaited()
+    callback.websocket.send_text.assert_awaited()
 
-    websocket.send_json.reset_mock()
+    websocket.send_text.reset_mock()
     callback = callbacks.FinalTokenWebSocketCallbackHandler(
         websocket=websocket, stream_prefix=True
     )
     callback.check_if_answer_reached = MagicMock(return_value=False)
     await callback.on_llm_new_token("test_token")
     assert not callback.answer_reached
-    callback.websocket.send_json.assert_not_awaited()
+    callback.websocket.send_text.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_final_token_callbacks_prefix_matching(send: Send, websocket: WebSocket):
+    callback = callbacks.FinalTokenStreamingCallbackHandler(
+        send=send, answer_prefixes=["AI:"]
+    )
+    assert callback.answer_prefixes == ["FinalAnswer:", "AI:"]
+
+    def streamed_tokens() -> list[str]:
+        return [
+            json.loads(call.args[0]["body"].decode().split("data: ")[1].strip())[
+                "token"
+            ]
+            for call in send.call_args_list
+        ]
+
+    # the prefix is split differently than `answer_prefix_tokens`
+    await callback.on_llm_start()
+    for token in ["Thought: done\nFin", "al Ans", "wer: Hello", " World"]:
+        await callback.on_llm_new_token(token)
+    assert streamed_tokens() == [" Hello", " World"]
+
+    send.reset_mock()
+    await callback.on_llm_start()
+    for token in ["A", "I", ":", " Hi"]:
+        await callback.on_llm_new_token(token)
+    assert streamed_tokens() == [" Hi"]
+
+    callback = callbacks.FinalTokenWebSocketCallbackHandler(
+        websocket=websocket, answer_prefix_tokens=["Answer", ":"], stream_prefix=True
+    )
+    await callback.on_llm_start()
+    for token in ["Final", " Answer", ":", " Hi"]:
+        await callback.on_llm_new_token(token)
+    assert [
+        json.loads(json.loads(call.args[0])["data"])["token"]
+        for call in websocket.send_text.call_args_list
+    ] == ["Answer:", " Hi"]
 
 
 @pytest.mark.asyncio
@@ -298,3 +432,93 @@ async def test_get_callbacks(websocket: WebSocket):
 
     websocket_callbacks = get_websocket_callbacks(agent_factory(), websocket)
     assert len(websocket_callbacks) == 1
+
+
+def test_callback_handler_pool(send: Send):
+    prototype = callbacks.FinalTokenStreamingCallbackHandler()
+    pool = callbacks.CallbackHandlerPool([prototype], maxsize=1)
+
+    [first] = pool.acquire()
+    [second] = pool.acquire()
+    assert first is not prototype and second is not first
+    assert first.matcher is not prototype.matcher
+
+    first.send = send
+    first.streaming = True
+    first.answer_reached = True
+    first.append_to_last_tokens("Final Answer:")
+    assert first.check_if_answer_reached()
+
+    pool.release([first])
+    pool.release([second])
+    assert len(pool) == 1
+
+    # released handlers are reset and reused
+    [handler] = pool.acquire()
+    assert handler is first
+    assert handler.send is None
+    assert handler.streaming is None
+    assert handler.answer_reached is False
+    assert handler.matcher.match is None
+    assert not handler.check_if_answer_reached()
+
+
+def test_merge_token_events():
+    first = dict(
+        data=callbacks.get_token_data("Hello", callbacks.TokenStreamMode.JSON),
+        event=Events.COMPLETION,
+    )
+    second = dict(
+        data=callbacks.get_token_data(" World", callbacks.TokenStreamMode.JSON),
+        event=Events.COMPLETION,
+    )
+    assert callbacks.merge_token_events(first, second) == dict(
+        data=callbacks.get_token_data("Hello World", callbacks.TokenStreamMode.JSON),
+        event=Events.COMPLETION,
+    )
+
+    assert callbacks.merge_token_events(
+        dict(data="Hello", event=Events.COMPLETION),
+        dict(data=" World", event=Events.COMPLETION),
+        mode=callbacks.TokenStreamMode.TEXT,
+    ) == dict(data="Hello World", event=Events.COMPLETION)
+
+    end = dict(data="", event=Events.END)
+    assert callbacks.merge_token_events(first, end) is None
+
+    chunk = dict(data='{"n":1}', event=Events.COMPLETION)
+    assert callbacks.merge_token_events(first, chunk) is None
+    assert callbacks.merge_token_events(chunk, chunk) is None
+
+
+@pytest.mark.asyncio
+async def test_source_documents_callbacks_reference_mode(send: Send):
+    documents = [Document(page_content="test_content", metadata={"page": 1})]
+    document_id = callbacks.get_document_id(documents[0])
+    assert document_id == callbacks.get_document_id(
+        Document(page_content="test_content", metadata={"page": 1})
+    )
+    assert document_id != callbacks.get_document_id(Document(page_content="other"))
+
+    callback = callbacks.SourceDocumentsStreamingCallbackHandler(
+        send=send, reference_mode=True
+    )
+    await callback.on_chain_end({"source_documents": documents})
+    assert f'"id":"{document_id}"'.encode() in send.call_args.args[0]["body"]
+    assert b"test_content" in send.call_args.args[0]["body"]
+    assert callback.known_document_ids == {document_id}
+
+    # pooled copies do not share the known document IDs
+    copied = callbacks.CallbackHandlerPool([callback]).acquire()[0]
+    assert copied.known_document_ids == set()
+
+    copied.send = send
+    copied.known_document_ids = callbacks.parse_document_ids(f" {document_id}, ")
+    await copied.on_chain_end({"source_documents": documents})
+    assert b"test_content" not in send.call_args.args[0]["body"]
+
+
+def test_parse_document_ids():
+    assert callbacks.parse_document_ids(None) == set()
+    assert callbacks.parse_document_ids("") == set()
+    assert callbacks.parse_document_ids("a, b,,a") == {"a", "b"}
@@ -2,8 +2,11 @@ from unittest.mock import MagicMock, create_autospec
 
 import pytest
 from fastapi import params
+from fastapi.testclient import TestClient
 from langchain.chains import ConversationChain
+from langchain_core.runnables import RunnableLambda
 
+from lanarky import Lanarky
 from lanarky.adapters.langchain.dependencies import Depends
 
 
@@ -27,3 +30,18 @@ def test_depends_invalid_dependency():
 
     with pytest.raises(TypeError):
         Depends(lambda: MagicMock())
+
+
+def test_depends_runnable():
+    def runnable_factory():
+        # runnables which take a string get the value of the `input` key
+        return RunnableLambda(str.upper)
+
+    app = Lanarky()
+
+    @app.post("/echo")
+    async def echo(outputs: str = Depends(runnable_factory)):
+        return outputs
+
+    response = TestClient(app).post("/echo", json={"input": "hi"})
+    assert response.json() == "HI"
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Optional
+from unittest.mock import AsyncMock, call
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain.callbacks.manager import CallbackManagerForChainRun
+from langchain.chains.base import Chain
+from langchain_core.runnables import RunnableLambda
+
+from lanarky import Lanarky
+from lanarky.adapters.langchain.callbacks import TokenStreamingCallbackHandler
+from lanarky.adapters.langchain.executors import (
+    ChainExecutor,
+    ChainProcessPool,
+    ThreadSafeBridge,
+)
+from lanarky.adapters.langchain.routing import LangchainAPIRouter
+from lanarky.metrics import metrics
+
+
+class PidChain(Chain):
+    """Chain which streams the words of the query and returns its process id."""
+
+    @property
+    def input_keys(self) -> list[str]:
+        return ["query"]
+
+    @property
+    def output_keys(self) -> list[str]:
+        return ["pid"]
+
+    def _call(
+        self,
+        inputs: dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> dict[str, Any]:
+        [llm_run] = run_manager.get_child().on_llm_start({}, [inputs["query"]])
+        for token in inputs["query"].split():
+            llm_run.on_llm_new_token(token)
+        return {"pid": str(os.getpid())}
+
+
+# factory calls of the current process
+factory_calls = 0
+
+
+def pid_chain_factory() -> PidChain:
+    global factory_calls
+    factory_calls += 1
+    return PidChain()
+
+
+@pytest.mark.asyncio
+async def test_chain_executor():
+    executor = ChainExecutor(max_workers=1, name="test.executor")
+    release = threading.Event()
+
+    first = asyncio.ensure_future(executor.run(release.wait))
+    second = asyncio.ensure_future(executor.run(threading.current_thread))
+    await asyncio.sleep(0.05)
+
+    try:
+        # the second call waits for the only worker
+        assert executor.stats() == dict(
+            max_workers=1, queued=1, active=1, completed=0, max_queued=1
+        )
+        assert metrics.snapshot()["test.executor.queued"] == 1
+    finally:
+        release.set()
+    assert await first is True
+    thread = await second
+    assert thread.name.startswith("lanarky-chain")
+    assert executor.completed == 2 and executor.queued == 0
+
+    # calls which are cancelled before they start leave the queue
+    release.clear()
+    first = asyncio.ensure_future(executor.run(release.wait))
+    second = asyncio.ensure_future(executor.run(threading.current_thread))
+    await asyncio.sleep(0.05)
+    second.cancel()
+    await asyncio.sleep(0)
+    try:
+        assert executor.queued == 0
+    finally:
+        release.set()
+    assert await first is True
+    assert executor.stats()["queued"] == 0
+
+    await executor.ashutdown()
+    metrics.unregister("test.executor")
+
+    with pytest.raises(ValueError):
+        ChainExecutor(max_workers=0)
+
+
+@pytest.mark.asyncio
+async def test_thread_safe_bridge():
+    send = AsyncMock()
+
+    def produce(bridge: ThreadSafeBridge):
+        # callback handlers of sync chains run on an event loop of the thread
+        async def callbacks():
+            for i in range(5):
+                await bridge(i)
+
+        asyncio.run(callbacks())
+
+    async with ThreadSafeBridge(send) as bridge:
+        await asyncio.get_running_loop().run_in_executor(None, produce, bridge)
+        await bridge("end")
+
+    assert send.await_args_list == [*[call(i) for i in range(5)], call("end")]
+
+
+@pytest.mark.asyncio
+async def test_chain_process_pool():
+    pool = ChainProcessPool(max_workers=1)
+    handler = TokenStreamingCallbackHandler(output_key="pid", send=AsyncMock())
+
+    try:
+        await pool.warm_up(pid_chain_factory)
+        outputs = await pool.run(pid_chain_factory, {"query": "a b c"}, [handler])
+    finally:
+        pool.shutdown()
+
+    assert outputs["pid"] != str(os.getpid())
+    tokens = [c.args[0]["body"].decode() for c in handler.send.await_args_list]
+    assert len(tokens) == 3
+    assert all(f'"token":"{t}"' in body for t, body in zip("abc", tokens))
+    assert pool.stats() == dict(max_workers=1, queued=0, completed=1)
+
+
+def test_langchain_router_process_pool():
+    pool = ChainProcessPool(max_workers=2)
+    router = LangchainAPIRouter(executor=pool)
+    router.add_api_route("/chat", pid_chain_factory, methods=["POST"])
+
+    app = Lanarky()
+    app.include_router(router)
+    calls = factory_calls
+
+    with TestClient(app) as client:
+        response = client.post("/chat", json={"query": "Hello process World"})
+        client.post("/chat", json={"query": "Hello"})
+
+    # chains are built in the worker processes, not per request
+    assert factory_calls == calls
+
+    tokens = [
+        json.loads(line[len("data: ") :])["token"]
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert tokens == ["Hello", "process", "World"]
+    assert pool.completed == 2
+
+
+def test_langchain_router_process_pool_runnable():
+
+    router = LangchainAPIRouter(executor=ChainProcessPool(max_workers=1))
+
+    with pytest.raises(TypeError):
+        router.add_api_route("/chat", lambda: RunnableLambda(str), methods=["POST"])
@@ -0,0 +1,56 @@
+import pytest
+
+from lanarky.adapters.langchain.matching import AnswerPrefixMatcher, PrefixMatch
+
+
+def feed(matcher: AnswerPrefixMatcher, tokens: list[str]):
+    for token in tokens:
+        if match := matcher.feed(token):
+            return match
+    return None
+
+
+def test_answer_prefix_matcher():
+    matcher = AnswerPrefixMatcher(["Final Answer:", "AI:"])
+
+    assert feed(matcher, ["Thought", ": ok\nFinal", " Ans", "wer", ":", " Hi"]) == (
+        PrefixMatch(prefix="Final Answer:", remainder="")
+    )
+    # the matcher stops after the first match
+    assert matcher.feed("AI:") is None
+
+    matcher.reset()
+    assert feed(matcher, ["The AI", " said", "... AI: Hi"]) == PrefixMatch(
+        prefix="AI:", remainder=" Hi"
+    )
+
+    matcher.reset()
+    assert feed(matcher, ["Final", " Answ", "er"]) is None
+    assert len(matcher._text) <= len("FinalAnswer:") * 2
+
+
+def test_answer_prefix_matcher_overlapping_prefixes():
+    # fail transitions must fall back to the longest proper suffix
+    matcher = AnswerPrefixMatcher(["abab:", "bc"], ignore_whitespace=False)
+    assert feed(matcher, ["abab", "ab:", "!"]) == PrefixMatch(
+        prefix="abab:", remainder=""
+    )
+
+    matcher = AnswerPrefixMatcher(["abab:", "ba"], ignore_whitespace=False)
+    assert feed(matcher, ["ab", "ab:"]) == PrefixMatch(prefix="ba", remainder="b:")
+
+    matcher = AnswerPrefixMatcher(["aab:"], ignore_whitespace=False)
+    assert feed(matcher, ["aaa", "ab", ":!"]) == PrefixMatch(
+        prefix="aab:", remainder="!"
+    )
+
+    matcher = AnswerPrefixMatcher(["Final Answer:"], ignore_whitespace=False)
+    assert feed(matcher, ["FinalAnswer:"]) is None
+
+
+def test_answer_prefix_matcher_empty_prefixes():
+    with pytest.raises(ValueError):
+        AnswerPrefixMatcher([])
+
+    with pytest.raises(ValueError):
+        AnswerPrefixMatcher([" "])
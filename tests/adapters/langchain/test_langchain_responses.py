@@ -1,17 +1,24 @@
+import asyncio
+import threading
 from typing import Type
 from unittest.mock import AsyncMock, MagicMock, call
 
 import pytest
 from langchain.chains.base import Chain
+from langchain_core.messages import AIMessageChunk
 from starlette.background import BackgroundTask
-from starlette.types import Send
+from starlette.types import Receive, Send
 
 from lanarky.adapters.langchain.callbacks import TokenStreamingCallbackHandler
+from lanarky.adapters.langchain.executors import ChainExecutor
 from lanarky.adapters.langchain.responses import (
+    ChainRunMode,
     HTTPStatusDetail,
     StreamingResponse,
+    merge_chunks,
     status,
 )
+from lanarky.cache import InMemoryCache
 from lanarky.events import Events, ServerSentEvent, ensure_bytes
 
 
@@ -56,6 +63,48 @@ async def test_stream_response_successful(send: Send, chain: Type[Chain]):
     assert "outputs" in response.background.kwargs
 
 
+@pytest.mark.asyncio
+async def test_stream_response_cache(send: Send, chain: Type[Chain]):
+    cache = InMemoryCache()
+
+    async def acall(inputs, callbacks):
+        for token in ["Hello", " World"]:
+            await callbacks[0].on_llm_new_token(token)
+        return {"dummy": "Hello World"}
+
+    def create_response():
+        handler = TokenStreamingCallbackHandler(output_key="dummy")
+        handler.streaming = True
+        return StreamingResponse(
+            chain=chain,
+            config={"inputs": {}, "callbacks": [handler]},
+            cache=cache,
+            cache_key="key",
+        )
+
+    chain.acall = AsyncMock(side_effect=acall)
+    await create_response().stream_response(send)
+    miss_calls = send.call_args_list
+    assert len(miss_calls) == 4
+
+    send.reset_mock()
+    await create_response().stream_response(send)
+    chain.acall.assert_called_once()
+    # cache hits are replayed event by event
+    assert send.call_args_list == miss_calls
+    assert cache.stats()["hits"] == 1
+
+    # failed streams are not cached
+    chain.acall = AsyncMock(side_effect=Exception("Some error occurred"))
+    response = create_response()
+    response.cache_key = "other"
+    await response.stream_response(send)
+    assert "other" not in cache
+
+    with pytest.raises(ValueError):
+        StreamingResponse(chain=chain, config={}, cache=cache)
+
+
 @pytest.mark.asyncio
 async def test_stream_response_error(send: Send, chain: Type[Chain]):
     response = StreamingResponse(
@@ -106,3 +155,74 @@ async def test_stream_response_error(send: Send, chain: Type[Chain]):
     send.assert_has_calls(expected_calls, any_order=False)
 
     assert "error" in response.background.kwargs
+
+
+@pytest.mark.asyncio
+async def test_stream_response_client_disconnect(
+    send: Send, disconnect: Receive, chain: Type[Chain]
+):
+    cancelled = asyncio.Event()
+
+    async def acall(**kwargs):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    chain.acall = acall
+    response = StreamingResponse(
+        chain=chain,
+        config={"callbacks": []},
+        background=BackgroundTask(lambda **kwargs: None),
+    )
+    await response({"type": "http"}, disconnect, send)
+
+    assert cancelled.is_set()
+    assert response.background.kwargs == {"outputs": {}, "disconnected": True}
+
+
+@pytest.mark.asyncio
+async def test_stream_response_client_disconnect_sync(
+    send: Send, disconnect: Receive, chain: Type[Chain]
+):
+    started = threading.Event()
+    resume = threading.Event()
+
+    def call(**kwargs):
+        started.set()
+        resume.wait(5)
+        return {}
+
+    chain.side_effect = call
+    executor = ChainExecutor(max_workers=1)
+    response = StreamingResponse(
+        chain=chain,
+        config={"callbacks": []},
+        run_mode=ChainRunMode.SYNC,
+        executor=executor,
+    )
+    released = AsyncMock()
+    response.call_on_complete(released)
+    await response({"type": "http"}, disconnect, send)
+
+    # the chain still runs in the worker thread, so it is not released yet
+    assert started.is_set()
+    released.assert_not_awaited()
+
+    resume.set()
+    for _ in range(100):
+        if released.await_count:
+            break
+        await asyncio.sleep(0.01)
+    released.assert_awaited_once()
+    executor.shutdown()
+
+
+def test_merge_chunks():
+    assert merge_chunks(["Hello", " ", "World"]) == "Hello World"
+    assert merge_chunks(
+        [AIMessageChunk(content="Hello"), AIMessageChunk(content=" World")]
+    ) == AIMessageChunk(content="Hello World")
+    assert merge_chunks([{"a": 1}, {"b": 2}]) == {"b": 2}
+    assert merge_chunks([]) is None
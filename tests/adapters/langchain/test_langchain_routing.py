@@ -1,14 +1,39 @@
+import asyncio
+import json
+import random
+from functools import partial
+from typing import Any, AsyncIterator, Optional
 from unittest.mock import AsyncMock, MagicMock, create_autospec, patch
 
+import httpx
 import pytest
 from fastapi import Depends
+from fastapi.testclient import TestClient
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
 from langchain.chains import ConversationChain
+from langchain.chains.base import Chain
+from langchain.schema.document import Document
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_community.llms.fake import FakeStreamingListLLM
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
 
+from lanarky import Lanarky
+from lanarky.adapters.langchain.callbacks import get_document_id, merge_token_events
+from lanarky.adapters.langchain.executors import ChainExecutor
 from lanarky.adapters.langchain.routing import (
     LangchainAPIRoute,
     LangchainAPIRouter,
     LangchainAPIWebSocketRoute,
 )
+from lanarky.adapters.langchain.utils import run_chain
+from lanarky.cache import InMemoryCache
+from lanarky.utils import set_json_codec
+from lanarky.websockets import BufferedWebSocket
 
 
 def test_langchain_api_router():
@@ -96,3 +121,421 @@ def test_langchain_websocket_route():
             endpoint=factory_endpoint,
         )
         endpoint_mock.assert_not_called()
+
+
+class EchoChain(Chain):
+    """Chain which streams the words of the query as LLM tokens."""
+
+    @property
+    def input_keys(self) -> list[str]:
+        return ["query"]
+
+    @property
+    def output_keys(self) -> list[str]:
+        return ["answer"]
+
+    def _call(self, inputs: dict[str, Any], run_manager=None) -> dict[str, Any]:
+        raise NotImplementedError
+
+    async def _acall(
+        self,
+        inputs: dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> dict[str, Any]:
+        [llm_run] = await run_manager.get_child().on_llm_start({}, [inputs["query"]])
+        for token in inputs["query"].split():
+            await asyncio.sleep(random.random() / 100)
+            await llm_run.on_llm_new_token(token)
+        return {"answer": inputs["query"]}
+
+
+@pytest.mark.asyncio
+async def test_langchain_api_router_concurrent_streams():
+    router = LangchainAPIRouter()
+
+    @router.post("/chat")
+    def chat() -> EchoChain:
+        return EchoChain()
+
+    app = Lanarky()
+    app.include_router(router)
+
+    async def post(client: httpx.AsyncClient, i: int) -> list[str]:
+        response = await client.post(
+            "/chat", json={"query": " ".join(f"{i}-{n}" for n in range(5))}
+        )
+        return [
+            json.loads(line[len("data: ") :])["token"]
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        responses = await asyncio.gather(*(post(c, i) for i in range(200)))
+
+    # every stream receives its own tokens only, in order
+    for i, tokens in enumerate(responses):
+        assert tokens == [f"{i}-{n}" for n in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_langchain_api_router_buffer_size():
+    router = LangchainAPIRouter(buffer_size=1)
+
+    @router.post("/chat")
+    def chat() -> EchoChain:
+        return EchoChain()
+
+    app = Lanarky()
+    app.include_router(router)
+
+    query = " ".join(str(n) for n in range(20))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        response = await c.post("/chat", json={"query": query})
+
+    tokens = [
+        json.loads(line[len("data: ") :])["token"]
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert "".join(tokens) == query.replace(" ", "")
+
+
+def test_langchain_router_runnable():
+    router = LangchainAPIRouter()
+
+    def runnable_factory():
+        llm = FakeStreamingListLLM(responses=["Hello World"])
+        return PromptTemplate.from_template("{question}") | llm | StrOutputParser()
+
+    router.add_api_route("/chat", runnable_factory, methods=["POST"])
+    router.add_api_websocket_route("/ws", runnable_factory)
+
+    app = Lanarky()
+    app.include_router(router)
+    client = TestClient(app)
+
+    response = client.post("/chat", json={"question": "hi"})
+    assert response.status_code == 200
+    tokens = [
+        json.loads(line[len("data: ") :])["token"]
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert "".join(tokens) == "Hello World"
+
+    assert client.post("/chat", json={}).status_code == 422
+
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json({"question": "hi"})
+        tokens = []
+        while (event := websocket.receive_json())["event"] == "completion":
+            tokens.append(json.loads(event["data"])["token"])
+        assert event["event"] == "end"
+    assert "".join(tokens) == "Hello World"
+
+
+def test_langchain_router_string_input_runnable():
+    router = LangchainAPIRouter()
+
+    def runnable_factory():
+        return FakeListChatModel(responses=["Hello World"]) | StrOutputParser()
+
+    router.add_api_route("/chat", runnable_factory, methods=["POST"])
+    router.add_api_route("/upper", lambda: RunnableLambda(str.upper), methods=["POST"])
+    router.add_api_websocket_route("/ws", runnable_factory)
+
+    app = Lanarky()
+    app.include_router(router)
+
+    with TestClient(app) as client:
+        response = client.post("/chat", json={"input": "hi"})
+        assert response.status_code == 200
+        tokens = [
+            json.loads(line[len("data: ") :])["token"]
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert "".join(tokens) == "Hello World"
+
+        response = client.post("/upper", json={"input": "hi"})
+        assert 'data: {"token":"HI"}' in response.text
+
+        with client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"input": "hi"})
+            tokens = []
+            while (event := websocket.receive_json())["event"] == "completion":
+                tokens.append(json.loads(event["data"])["token"])
+            assert event["event"] == "end"
+        assert "".join(tokens) == "Hello World"
+
+
+@pytest.mark.asyncio
+async def test_run_chain_buffered_dict_chunks():
+    async def numbers(input: AsyncIterator[Any]) -> AsyncIterator[dict[str, int]]:
+        async for _ in input:
+            pass
+        for n in range(20):
+            yield {"n": n}
+
+    class SlowWebSocket:
+        def __init__(self) -> None:
+            self.messages = []
+
+        async def send_json(self, data: Any) -> None:
+            await asyncio.sleep(0.01)
+            self.messages.append(data)
+
+    websocket = SlowWebSocket()
+    buffered = BufferedWebSocket(websocket, max_size=1, merge=merge_token_events)
+    await run_chain(RunnableGenerator(numbers), {"input": "hi"}, buffered)
+    await buffered.drain()
+    buffered.close()
+
+    events = [message["event"] for message in websocket.messages]
+    assert events == ["completion"] * 20 + ["end"]
+    # dict chunks are never merged
+    assert [json.loads(message["data"]) for message in websocket.messages[:-1]] == [
+        {"n": n} for n in range(20)
+    ]
+
+
+class SyncEchoChain(EchoChain):
+    """Chain which streams the words of the query from a sync call."""
+
+    def _call(
+        self,
+        inputs: dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> dict[str, Any]:
+        [llm_run] = run_manager.get_child().on_llm_start({}, [inputs["query"]])
+        for token in inputs["query"].split():
+            llm_run.on_llm_new_token(token)
+        return {"answer": inputs["query"]}
+
+
+def test_langchain_router_executor():
+    executor = ChainExecutor(max_workers=2)
+    router = LangchainAPIRouter(executor=executor)
+
+    @router.post("/chat")
+    def chat() -> SyncEchoChain:
+        return SyncEchoChain()
+
+    router.add_api_websocket_route("/ws", chat)
+
+    app = Lanarky()
+    app.include_router(router)
+    client = TestClient(app)
+
+    response = client.post("/chat", json={"query": "Hello sync World"})
+    tokens = [
+        json.loads(line[len("data: ") :])["token"]
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert tokens == ["Hello", "sync", "World"]
+
+    with client.websocket_connect("/ws") as websocket:
+        websocket.send_json({"query": "Hello sync World"})
+        tokens = []
+        while (event := websocket.receive_json())["event"] == "completion":
+            tokens.append(json.loads(event["data"])["token"])
+        assert event["event"] == "end"
+    assert tokens == ["Hello", "sync", "World"]
+
+    # messages of worker threads are encoded with the JSON codec
+    set_json_codec(dumps=partial(json.dumps, indent=1))
+    try:
+        with client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"query": "Hello"})
+            assert "\n" in websocket.receive_text()
+            assert websocket.receive_json()["event"] == "end"
+    finally:
+        set_json_codec()
+
+    assert executor.completed == 3
+
+
+class RetrievalEchoChain(EchoChain):
+    """Echo chain which returns the same source documents for every query."""
+
+    @property
+    def output_keys(self) -> list[str]:
+        return ["answer", "source_documents"]
+
+    async def _acall(
+        self,
+        inputs: dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> dict[str, Any]:
+        outputs = await super()._acall(inputs, run_manager)
+        documents = [Document(page_content=f"chunk {i}") for i in range(2)]
+        return {**outputs, "source_documents": documents}
+
+
+def test_langchain_router_document_references():
+    router = LangchainAPIRouter()
+
+    @router.post("/chat")
+    def chat() -> RetrievalEchoChain:
+        return RetrievalEchoChain()
+
+    router.add_api_websocket_route("/ws", chat)
+
+    app = Lanarky()
+    app.include_router(router)
+
+    def get_source_documents(response) -> list[dict]:
+        [data] = [
+            line[len("data: ") :]
+            for line in response.text.splitlines()
+            if line.startswith("data: ") and "source_documents" in line
+        ]
+        return json.loads(data)["source_documents"]
+
+    with TestClient(app) as client:
+        response = client.post("/chat", json={"query": "hi"})
+        documents = get_source_documents(response)
+        assert all("id" not in document for document in documents)
+
+        known_id = get_document_id(Document(page_content="chunk 0"))
+        response = client.post(
+            "/chat", json={"query": "hi"}, headers={"X-Known-Documents": known_id}
+        )
+        documents = get_source_documents(response)
+        assert documents[0] == {"id": known_id}
+        assert documents[1]["page_content"] == "chunk 1"
+        assert documents[1]["id"] == get_document_id(Document(page_content="chunk 1"))
+
+        # pooled handlers do not keep the reference mode of previous requests
+        response = client.post("/chat", json={"query": "hi"})
+        documents = get_source_documents(response)
+        assert [document["page_content"] for document in documents] == [
+            "chunk 0",
+            "chunk 1",
+        ]
+        assert all("id" not in document for document in documents)
+
+        with client.websocket_connect("/ws?known_documents=") as websocket:
+            sessions = []
+            for _ in range(2):
+                websocket.send_json({"query": "hi"})
+                while (event := websocket.receive_json())["event"] != "end":
+                    if event["event"] == "source_documents":
+                        sessions.append(json.loads(event["data"])["source_documents"])
+    assert [document["page_content"] for document in sessions[0]] == [
+        "chunk 0",
+        "chunk 1",
+    ]
+    assert sessions[1] == [{"id": document["id"]} for document in sessions[0]]
+
+
+def test_langchain_router_source_documents_options():
+    router = LangchainAPIRouter(max_content_length=3)
+
+    def chat() -> RetrievalEchoChain:
+        return RetrievalEchoChain()
+
+    router.add_api_route("/chat", chat, methods=["POST"])
+    router.add_api_route("/full", chat, methods=["POST"], max_content_length=None)
+    router.add_api_websocket_route("/ws", chat)
+    router.add_api_websocket_route("/ws/full", chat, max_content_length=None)
+
+    app = Lanarky()
+    app.include_router(router)
+
+    def get_page_contents(response) -> list[str]:
+        [data] = [
+            line[len("data: ") :]
+            for line in response.text.splitlines()
+            if line.startswith("data: ") and "source_documents" in line
+        ]
+        return [
+            document["page_content"]
+            for document in json.loads(data)["source_documents"]
+        ]
+
+    def receive_page_contents(websocket) -> list[str]:
+        websocket.send_json({"query": "hi"})
+        while (event := websocket.receive_json())["event"] != "source_documents":
+            pass
+        return [
+            document["page_content"]
+            for document in json.loads(event["data"])["source_documents"]
+        ]
+
+    with TestClient(app) as client:
+        response = client.post("/chat", json={"query": "hi"})
+        assert get_page_contents(response) == ["chu", "chu"]
+        response = client.post("/full", json={"query": "hi"})
+        assert get_page_contents(response) == ["chunk 0", "chunk 1"]
+
+        with client.websocket_connect("/ws") as websocket:
+            assert receive_page_contents(websocket) == ["chu", "chu"]
+        with client.websocket_connect("/ws/full") as websocket:
+            assert receive_page_contents(websocket) == ["chunk 0", "chunk 1"]
+
+
+@pytest.mark.parametrize("buffer_size", [None, 4])
+def test_langchain_router_msgpack(buffer_size: Optional[int]):
+    msgpack = pytest.importorskip("msgpack")
+    router = LangchainAPIRouter(buffer_size=buffer_size)
+
+    def chat() -> RetrievalEchoChain:
+        return RetrievalEchoChain()
+
+    router.add_api_websocket_route("/ws", chat)
+
+    app = Lanarky()
+    app.include_router(router)
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws", subprotocols=["msgpack"]) as websocket:
+            assert websocket.accepted_subprotocol == "msgpack"
+            websocket.send_bytes(msgpack.packb({"query": "Hello World"}))
+            events = []
+            while (event := msgpack.unpackb(websocket.receive_bytes()))[
+                "event"
+            ] != "end":
+                events.append(event)
+
+    tokens = [e["data"]["token"] for e in events if e["event"] == "completion"]
+    assert tokens == ["Hello", "World"]
+    [documents] = [e["data"] for e in events if e["event"] == "source_documents"]
+    assert [d["page_content"] for d in documents["source_documents"]] == [
+        "chunk 0",
+        "chunk 1",
+    ]
+
+
+def test_langchain_router_cache():
+    cache = InMemoryCache(ttl=60)
+    router = LangchainAPIRouter()
+
+    def chat() -> RetrievalEchoChain:
+        return RetrievalEchoChain()
+
+    router.add_api_route("/chat", chat, methods=["POST"], cache=cache)
+    router.add_api_route("/uncached", chat, methods=["POST"])
+
+    app = Lanarky()
+    app.include_router(router)
+
+    with TestClient(app) as client:
+        first = client.post("/chat", json={"query": "Hello World"})
+        second = client.post("/chat", json={"query": "Hello World"})
+        client.post("/chat", json={"query": "Hello"})
+        client.post("/uncached", json={"query": "Hello World"})
+
+    events = [line for line in second.text.splitlines() if line.startswith("event:")]
+    assert events == [
+        "event: completion",
+        "event: completion",
+        "event: source_documents",
+    ]
+    assert second.text == first.text
+    assert cache.stats()["hits"] == 1
+    assert len(cache) == 2
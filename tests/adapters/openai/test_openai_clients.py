@@ -0,0 +1,28 @@
+import httpx
+import pytest
+
+from lanarky.adapters.openai.clients import OpenAIClientRegistry
+
+
+@pytest.mark.asyncio
+async def test_openai_client_registry():
+    registry = OpenAIClientRegistry(limits=httpx.Limits(max_connections=10))
+
+    client = registry.get(api_key="key", base_url="http://localhost:8000/v1")
+    assert registry.get(api_key="key", base_url="http://localhost:8000/v1") is client
+    assert (
+        registry.get(api_key="other", base_url="http://localhost:8000/v1") is not client
+    )
+    assert (
+        registry.get(api_key="key", base_url="http://localhost:8000/v1", max_retries=0)
+        is not client
+    )
+    assert len(registry) == 3
+    assert client._client._transport._pool._max_connections == 10
+
+    await registry.aclose()
+    assert len(registry) == 0
+    assert client.is_closed()
+    assert (
+        registry.get(api_key="key", base_url="http://localhost:8000/v1") is not client
+    )
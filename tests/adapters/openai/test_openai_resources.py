@@ -1,6 +1,7 @@
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from openai import AsyncStream
 from openai.types.chat import chat_completion, chat_completion_chunk
 
 from lanarky.adapters.openai.resources import (
@@ -10,6 +11,7 @@ from lanarky.adapters.openai.resources import (
     ChatCompletionResource,
     Message,
 )
+from lanarky.cache import InMemoryCache
 
 
 @pytest.mark.asyncio
@@ -105,3 +107,124 @@ async def test_chat_completion_resource_call():
     messages = [Message(role="user", content="Hello")]
     response = await chat_completion_resource(messages)
     assert response == mocked_completion
+
+
+@pytest.mark.asyncio
+async def test_chat_completion_resource_stream_closed():
+    chunk = ChatCompletionChunk(
+        id="chat-completion-id",
+        created=1700936386,
+        model="gpt-3.5-turbo-0613",
+        object="chat.completion.chunk",
+        choices=[
+            chat_completion_chunk.Choice(
+                index=0,
+                finish_reason=None,
+                delta=chat_completion_chunk.ChoiceDelta(content="Hello"),
+            )
+        ],
+    )
+
+    stream = MagicMock(spec=AsyncStream)
+    stream.__aiter__.return_value = [chunk, chunk]
+
+    chat_completion_resource = ChatCompletionResource(
+        client=MagicMock(spec=AsyncOpenAI), stream=True
+    )
+    chat_completion_resource._client.chat = MagicMock()
+    chat_completion_resource._client.chat.completions = MagicMock()
+    chat_completion_resource._client.chat.completions.create = AsyncMock(
+        return_value=stream
+    )
+
+    generator = chat_completion_resource.stream_response([])
+    assert await generator.__anext__() == "Hello"
+    await generator.aclose()
+
+    stream.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_chat_completion_resource_cache():
+    def chunk(content: str) -> ChatCompletionChunk:
+        return ChatCompletionChunk(
+            id="chat-completion-id",
+            created=1700936386,
+            model="gpt-3.5-turbo-0613",
+            object="chat.completion.chunk",
+            choices=[
+                chat_completion_chunk.Choice(
+                    index=0,
+                    finish_reason=None,
+                    delta=chat_completion_chunk.ChoiceDelta(content=content),
+                )
+            ],
+        )
+
+    async def stream():
+        for content in ["Hello", " World"]:
+            yield chunk(content)
+
+    cache = InMemoryCache()
+    chat_completion_resource = ChatCompletionResource(
+        client=MagicMock(spec=AsyncOpenAI), stream=True, cache=cache, temperature=0
+    )
+    chat_completion_resource._client.chat = MagicMock()
+    chat_completion_resource._client.chat.completions = MagicMock()
+    create = chat_completion_resource._client.chat.completions.create = AsyncMock(
+        side_effect=lambda **kwargs: stream()
+    )
+
+    messages = [dict(role="user", content="Hello")]
+
+    # incomplete streams are not cached
+    generator = chat_completion_resource.stream_response(messages)
+    assert await generator.__anext__() == "Hello"
+    await generator.aclose()
+    assert len(cache) == 0
+
+    for _ in range(2):
+        chunks = [c async for c in chat_completion_resource.stream_response(messages)]
+        assert chunks == ["Hello", " World"]
+    assert create.await_count == 2
+    assert cache.stats()["hits"] == 1
+
+    other = [dict(role="user", content="Bye")]
+    assert [c async for c in chat_completion_resource.stream_response(other)] == [
+        "Hello",
+        " World",
+    ]
+    assert create.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_chat_completion_resource_call_cache():
+    mocked_completion = ChatCompletion(
+        id="chat-completion-id",
+        created=1700936386,
+        model="gpt-3.5-turbo-0613",
+        object="chat.completion",
+        choices=[
+            chat_completion.Choice(
+                finish_reason="stop",
+                index=0,
+                message=chat_completion.ChatCompletionMessage(
+                    content="Hello! How can I assist you today?", role="assistant"
+                ),
+            )
+        ],
+    )
+
+    chat_completion_resource = ChatCompletionResource(
+        client=MagicMock(spec=AsyncOpenAI), cache=InMemoryCache()
+    )
+    chat_completion_resource._client.chat = MagicMock()
+    chat_completion_resource._client.chat.completions = MagicMock()
+    create = chat_completion_resource._client.chat.completions.create = AsyncMock(
+        return_value=mocked_completion
+    )
+
+    messages = [dict(role="user", content="Hello")]
+    assert await chat_completion_resource(messages) == mocked_completion
+    assert await chat_completion_resource(messages) == mocked_completion
+    create.assert_awaited_once()
@@ -1,7 +1,8 @@
+import asyncio
 from unittest.mock import MagicMock, call
 
 import pytest
-from starlette.types import Send
+from starlette.types import Receive, Send
 
 from lanarky.adapters.openai.resources import ChatCompletionResource
 from lanarky.adapters.openai.responses import (
@@ -97,3 +98,25 @@ async def test_stream_response_error(send: Send):
     ]
 
     send.assert_has_calls(expected_calls, any_order=False)
+
+
+@pytest.mark.asyncio
+async def test_stream_response_client_disconnect(send: Send, disconnect: Receive):
+    closed = asyncio.Event()
+
+    async def stream_response(messages):
+        try:
+            while True:
+                yield "token"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    resource = MagicMock(spec=ChatCompletionResource)
+    resource.stream_response = stream_response
+
+    response = StreamingResponse(resource=resource, messages=[])
+    await response({"type": "http"}, disconnect, send)
+
+    assert closed.is_set()
+    assert response.disconnected
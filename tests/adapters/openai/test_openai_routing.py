@@ -1,9 +1,15 @@
-from unittest.mock import create_autospec
+import asyncio
+from unittest.mock import MagicMock, create_autospec
 
+import httpx
 import pytest
+from fastapi.testclient import TestClient
 
-from lanarky.adapters.openai.resources import ChatCompletionResource
+from lanarky import Lanarky
+from lanarky.adapters.openai.resources import AsyncOpenAI, ChatCompletionResource
 from lanarky.adapters.openai.routing import OpenAIAPIRoute, OpenAIAPIRouter
+from lanarky.factories import FactoryScope
+from lanarky.streams import Broadcast
 
 
 def test_langchain_api_router():
@@ -57,3 +63,154 @@ def test_langchain_api_route():
 
     assert isinstance(route, OpenAIAPIRoute)
     assert route.path == "/test"
+
+
+@pytest.mark.asyncio
+async def test_openai_api_router_single_flight():
+    calls = 0
+    client = MagicMock(spec=AsyncOpenAI)
+
+    class Resource(ChatCompletionResource):
+        async def stream_response(self, messages):
+            nonlocal calls
+            calls += 1
+            for token in ["Hello", "World"]:
+                await asyncio.sleep(0.02)
+                yield token
+
+    router = OpenAIAPIRouter(single_flight=Broadcast())
+
+    @router.post("/chat")
+    def chat() -> Resource:
+        return Resource(client=client, stream=True)
+
+    app = Lanarky()
+    app.include_router(router)
+
+    async def post(client: httpx.AsyncClient, content: str) -> str:
+        response = await client.post(
+            "/chat", json={"messages": [{"role": "user", "content": content}]}
+        )
+        return response.text
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        responses = await asyncio.gather(
+            post(c, "hi"), post(c, "hi"), post(c, "hi"), post(c, "bye")
+        )
+
+    assert calls == 2
+    assert responses[0] == responses[1] == responses[2] == responses[3]
+    assert "data: Hello" in responses[0]
+    assert "data: World" in responses[0]
+
+
+@pytest.mark.parametrize(
+    "factory_scope,expected_calls",
+    [
+        (FactoryScope.REQUEST, 4),
+        (FactoryScope.SINGLETON, 1),
+        (FactoryScope.POOLED, 1),
+    ],
+)
+def test_openai_api_router_factory_scope(factory_scope, expected_calls):
+    calls = 0
+    client = MagicMock(spec=AsyncOpenAI)
+
+    class Resource(ChatCompletionResource):
+        async def stream_response(self, messages):
+            yield "Hello"
+
+    router = OpenAIAPIRouter(factory_scope=factory_scope, pool_size=2)
+
+    @router.post("/chat")
+    def chat() -> Resource:
+        nonlocal calls
+        calls += 1
+        return Resource(client=client)
+
+    app = Lanarky()
+    app.include_router(router)
+
+    # the factory is called once when the route is built
+    assert calls == 1
+
+    with TestClient(app) as test_client:
+        for _ in range(3):
+            response = test_client.post(
+                "/chat", json={"messages": [{"role": "user", "content": "hi"}]}
+            )
+            assert "data: Hello" in response.text
+
+    assert calls == expected_calls
+
+
+@pytest.mark.parametrize("async_factory", [False, True])
+def test_openai_api_router_pooled_invalid_request(async_factory: bool):
+    client = MagicMock(spec=AsyncOpenAI)
+
+    class Resource(ChatCompletionResource):
+        async def stream_response(self, messages):
+            yield "Hello"
+
+    router = OpenAIAPIRouter(factory_scope=FactoryScope.POOLED, pool_size=1)
+
+    if async_factory:
+
+        async def chat() -> Resource:
+            return Resource(client=client)
+
+    else:
+
+        def chat() -> Resource:
+            return Resource(client=client)
+
+    router.add_api_route("/chat", chat, methods=["POST"])
+
+    app = Lanarky()
+    app.include_router(router)
+
+    with TestClient(app) as test_client:
+        # the pooled resource is released when the request is invalid
+        for _ in range(2):
+            assert test_client.post("/chat", json={}).status_code == 422
+        response = test_client.post(
+            "/chat",
+            json={"messages": [{"role": "user", "content": "hi"}]},
+            timeout=5,
+        )
+        assert "data: Hello" in response.text
+
+
+def test_openai_api_router_async_factory():
+    calls = 0
+    client = MagicMock(spec=AsyncOpenAI)
+
+    class Resource(ChatCompletionResource):
+        async def stream_response(self, messages):
+            yield "Hello"
+
+    router = OpenAIAPIRouter()
+
+    @router.post("/chat")
+    async def chat() -> Resource:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return Resource(client=client)
+
+    app = Lanarky()
+    app.include_router(router)
+
+    # async factories are built at startup
+    assert calls == 0
+    body = {"messages": [{"role": "user", "content": "hi"}]}
+    assert TestClient(app).post("/chat", json=body).status_code == 503
+
+    with TestClient(app) as test_client:
+        assert calls == 1
+        response = test_client.post("/chat", json=body)
+        assert "data: Hello" in response.text
+
+        response = test_client.post("/chat", json={"message": "hi"})
+        assert response.status_code == 422
@@ -1,9 +1,12 @@
+import asyncio
 from typing import Iterator, Type
 from unittest.mock import AsyncMock, create_autospec
 
 import pytest
-from starlette.types import Send
+from sse_starlette.sse import AppStatus
+from starlette.types import Receive, Send
 
+from lanarky.applications import _startup_callbacks
 from lanarky.websockets import WebSocket
 
 
@@ -25,4 +28,29 @@ def body_iterator() -> Iterator[bytes]:
 def websocket() -> Type[WebSocket]:
     websocket: Type[WebSocket] = create_autospec(WebSocket)
     websocket.send_json = AsyncMock()
+    websocket.send_text = AsyncMock()
     return websocket
+
+
+@pytest.fixture(autouse=True)
+def reset_sse_app_status():
+    # sse-starlette binds its exit event to the event loop of the first test
+    AppStatus.should_exit_event = None
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_startup_callbacks():
+    # routes with async factories register warm-ups in a process-wide registry
+    callbacks = list(_startup_callbacks)
+    yield
+    _startup_callbacks[:] = callbacks
+
+
+@pytest.fixture(scope="function")
+def disconnect() -> Receive:
+    async def receive():
+        await asyncio.sleep(0.05)
+        return {"type": "http.disconnect"}
+
+    return receive
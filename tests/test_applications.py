@@ -1,7 +1,17 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock
+
 import pytest
 from fastapi.testclient import TestClient
 
 from lanarky import Lanarky
+from lanarky.applications import (
+    _shutdown_callbacks,
+    register_shutdown_callback,
+    register_startup_callback,
+)
 
 
 @pytest.fixture
@@ -25,3 +35,44 @@ def test_app_routes(app: Lanarky):
 
     response = client.get("/")
     assert response.status_code == 404
+
+
+def test_app_shutdown_callbacks():
+    events = []
+
+    @asynccontextmanager
+    async def lifespan(app):
+        events.append("startup")
+        yield
+        events.append("shutdown")
+
+    callback = AsyncMock(side_effect=lambda: events.append("callback"))
+    register_shutdown_callback(callback)
+    register_shutdown_callback(callback)
+    try:
+        with TestClient(Lanarky(lifespan=lifespan)):
+            assert events == ["startup"]
+        assert events == ["startup", "shutdown", "callback"]
+    finally:
+        _shutdown_callbacks.remove(callback)
+
+
+def test_app_startup_callbacks():
+    async def warm_up():
+        await asyncio.sleep(0.2)
+
+    for _ in range(3):
+        register_startup_callback(AsyncMock(side_effect=warm_up))
+
+    app = Lanarky(readiness_url="/ready")
+    client = TestClient(app)
+    assert client.get("/ready").status_code == 503
+
+    start = time.perf_counter()
+    with client:
+        # startup callbacks run concurrently
+        assert time.perf_counter() - start < 0.5
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ready"}
+    assert not app.ready
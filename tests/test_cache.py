@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from lanarky.cache import InMemoryCache, json_size
+
+
+def test_in_memory_cache_lru():
+    cache = InMemoryCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.stats() == dict(hits=2, misses=1, evictions=1, entries=2, bytes=0)
+
+
+def test_in_memory_cache_ttl():
+    cache = InMemoryCache(ttl=0.01)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.evictions == 1
+    assert len(cache) == 0
+
+
+def test_in_memory_cache_max_bytes():
+    cache = InMemoryCache(max_bytes=2 * json_size("aaaa"))
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    assert cache.nbytes == 2 * json_size("aaaa")
+
+    cache.set("c", "cccc")
+    assert "a" not in cache
+    assert cache.nbytes == 2 * json_size("aaaa")
+
+    # values larger than the cap are not cached
+    cache.set("d", "d" * 100)
+    assert "d" not in cache
+    assert len(cache) == 2
+
+    cache.clear()
+    assert cache.nbytes == 0
+
+
+@pytest.mark.asyncio
+async def test_in_memory_cache_async():
+    cache = InMemoryCache()
+    await cache.aset("a", [1, 2])
+    assert await cache.aget("a") == [1, 2]
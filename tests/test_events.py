@@ -0,0 +1,37 @@
+import pytest
+
+from lanarky.events import (
+    Events,
+    ServerSentEvent,
+    ServerSentEventEncoder,
+    get_event_encoder,
+)
+
+
+@pytest.mark.parametrize(
+    "data,event,id",
+    [
+        ("token", Events.COMPLETION, None),
+        ("", Events.COMPLETION, None),
+        ("line 1\nline 2\r\nline 3\rline 4", Events.COMPLETION, None),
+        ({"status_code": 500}, Events.ERROR, None),
+        ("token", None, None),
+        ("token", "custom\nevent", "42"),
+        (None, Events.END, None),
+        ("ünïcödé", Events.COMPLETION, "1"),
+    ],
+)
+@pytest.mark.parametrize("sep", [None, "\n", "\r"])
+def test_encoder_matches_server_sent_event(data, event, id, sep):
+    encoder = ServerSentEventEncoder(sep)
+    expected = ServerSentEvent(data=data, event=event, id=id, sep=sep).encode()
+
+    assert encoder.encode(data, event=event, id=id) == expected
+    # cached prefixes produce the same output
+    assert encoder.encode(data, event=event, id=id) == expected
+
+
+def test_get_event_encoder():
+    assert get_event_encoder() is get_event_encoder()
+    assert get_event_encoder("\n").sep == "\n"
+    assert get_event_encoder().sep == "\r\n"
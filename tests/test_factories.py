@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from lanarky.factories import FactoryProvider, FactoryScope, is_factory
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return object()
+
+
+@pytest.mark.asyncio
+async def test_factory_provider_request():
+    factory = Counter()
+    provider = FactoryProvider(factory)
+    assert provider.dependency is factory
+
+    assert await provider.acquire() is not await provider.acquire()
+    assert factory.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_factory_provider_singleton():
+    factory = Counter()
+    instance = factory()
+    provider = FactoryProvider(factory, FactoryScope.SINGLETON, instance=instance)
+    assert provider.dependency == provider.acquire
+
+    assert await provider.acquire() is instance
+    assert await provider.acquire() is instance
+    await provider.release(instance)
+    assert factory.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_factory_provider_pooled():
+    factory = Counter()
+    provider = FactoryProvider(factory, FactoryScope.POOLED, pool_size=2)
+
+    first = await provider.acquire()
+    second = await provider.acquire()
+    assert first is not second
+
+    # the pool is exhausted until an instance is released
+    waiter = asyncio.create_task(provider.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+
+    await provider.release(first)
+    assert await waiter is first
+    assert factory.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_factory_provider_lease():
+    factory = Counter()
+    provider = FactoryProvider(factory, FactoryScope.POOLED, pool_size=1)
+    assert provider.lease_dependency == provider.lease
+
+    # instances which are not handed off are released when the request ends
+    lease = provider.lease()
+    instance = await lease.__anext__()
+    with pytest.raises(StopAsyncIteration):
+        await lease.__anext__()
+    assert await asyncio.wait_for(provider.acquire(), 1) is instance
+    await provider.release(instance)
+
+    lease = provider.lease()
+    instance = await lease.__anext__()
+    release = provider.hand_off(instance)
+    with pytest.raises(StopAsyncIteration):
+        await lease.__anext__()
+    waiter = asyncio.create_task(provider.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+
+    # releasing twice does not add the instance to the pool twice
+    await release()
+    await release()
+    assert await waiter is instance
+    assert factory.calls == 1
+
+
+def test_factory_provider_invalid_arguments():
+    with pytest.raises(ValueError):
+        FactoryProvider(Counter(), "invalid")
+    with pytest.raises(ValueError):
+        FactoryProvider(Counter(), FactoryScope.POOLED, pool_size=0)
+
+
+@pytest.mark.asyncio
+async def test_factory_provider_build():
+    instance = object()
+
+    async def factory():
+        return instance
+
+    provider = FactoryProvider(factory, FactoryScope.SINGLETON)
+    assert not provider.ready
+
+    request = Request({"type": "http", "method": "POST", "headers": []})
+    with pytest.raises(HTTPException) as exc_info:
+        await provider.ensure_ready(request)
+    assert exc_info.value.status_code == 503
+
+    assert await provider.build() is instance
+    assert provider.ready
+    await provider.ensure_ready(request)
+    assert await provider.acquire() is instance
+
+
+def test_is_factory():
+    def sync_factory():
+        pass
+
+    async def async_factory() -> Counter:
+        pass
+
+    async def endpoint():
+        pass
+
+    assert is_factory(sync_factory, Counter)
+    assert is_factory(async_factory, Counter)
+    assert not is_factory(endpoint, Counter)
@@ -0,0 +1,15 @@
+from lanarky.metrics import MetricsRegistry
+
+
+def test_metrics_registry():
+    registry = MetricsRegistry()
+
+    registry.increment("counter")
+    registry.increment("counter", 2)
+    registry.register("collector", lambda: {"size": 10})
+
+    assert registry.snapshot() == {"counter": 3, "collector.size": 10}
+
+    registry.unregister("collector")
+    registry.reset()
+    assert registry.snapshot() == {}
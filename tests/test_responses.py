@@ -1,12 +1,23 @@
+import asyncio
 from typing import Iterator, Type
-from unittest.mock import MagicMock, call
+from unittest.mock import AsyncMock, MagicMock, call
 
 import pytest
 from fastapi import status
-from starlette.types import Send
+from starlette.background import BackgroundTask
+from starlette.types import Receive, Send
 
 from lanarky.events import Events, ServerSentEvent, ensure_bytes
-from lanarky.responses import HTTPStatusDetail, StreamingResponse
+from lanarky.responses import (
+    BackpressurePolicy,
+    BufferedSend,
+    ChunkCoalescer,
+    CoalescingPolicy,
+    HeartbeatScheduler,
+    HTTPStatusDetail,
+    StreamingResponse,
+)
+from lanarky.streams import Broadcast, BroadcastChannel, ReplayStore, parse_event_id
 
 
 @pytest.fixture
@@ -97,3 +108,475 @@ async def test_stream_response_exception(
     ]
 
     send.assert_has_calls(expected_calls, any_order=False)
+
+
+def body_message(body: bytes) -> dict:
+    return {"type": "http.response.body", "body": body, "more_body": True}
+
+
+@pytest.mark.asyncio
+async def test_chunk_coalescer_thresholds(send: Send):
+    coalescer = ChunkCoalescer(
+        send, CoalescingPolicy(max_bytes=8, max_events=3, max_delay=60)
+    )
+
+    await coalescer(body_message(b"first"))
+    send.assert_awaited_once_with(body_message(b"first"))
+
+    send.reset_mock()
+    await coalescer(body_message(b"a"))
+    await coalescer(body_message(b"b"))
+    send.assert_not_awaited()
+
+    await coalescer(body_message(b"c"))
+    send.assert_awaited_once_with(body_message(b"abc"))
+
+    send.reset_mock()
+    await coalescer(body_message(b"12345678"))
+    send.assert_awaited_once_with(body_message(b"12345678"))
+
+    send.reset_mock()
+    await coalescer(body_message(b"tail"))
+    await coalescer({"type": "http.response.body", "body": b"", "more_body": False})
+    send.assert_has_calls(
+        [
+            call(body_message(b"tail")),
+            call({"type": "http.response.body", "body": b"", "more_body": False}),
+        ],
+        any_order=False,
+    )
+    coalescer.close()
+
+
+@pytest.mark.asyncio
+async def test_chunk_coalescer_max_delay(send: Send):
+    coalescer = ChunkCoalescer(send, CoalescingPolicy(max_delay=0.01))
+
+    await coalescer(body_message(b"first"))
+    await coalescer(body_message(b"second"))
+    await coalescer(body_message(b"third"))
+    assert send.await_count == 1
+
+    await asyncio.sleep(0.05)
+    assert send.await_count == 2
+    send.assert_awaited_with(body_message(b"secondthird"))
+    coalescer.close()
+
+
+@pytest.mark.asyncio
+async def test_chunk_coalescer_delayed_flush_error(send: Send):
+    coalescer = ChunkCoalescer(send, CoalescingPolicy(max_delay=0.01))
+
+    await coalescer(body_message(b"first"))
+    send.side_effect = OSError("client disconnected")
+    await coalescer(body_message(b"second"))
+    await asyncio.sleep(0.05)
+
+    # the error of the delayed flush stops the stream
+    with pytest.raises(OSError, match="client disconnected"):
+        await coalescer(body_message(b"third"))
+    with pytest.raises(OSError, match="client disconnected"):
+        await coalescer.flush()
+    coalescer.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_response_coalescing(send: Send):
+    async def iterator():
+        for chunk in [b"Chunk 1", b"Chunk 2", b"Chunk 3"]:
+            yield chunk
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    response = StreamingResponse(
+        content=iterator(), coalescing=CoalescingPolicy(max_delay=60)
+    )
+    await response({"type": "http"}, receive, send)
+
+    assert send.await_args_list[1:] == [
+        call(body_message(b"Chunk 1")),
+        call(body_message(b"Chunk 2Chunk 3")),
+        call({"type": "http.response.body", "body": b"", "more_body": False}),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stream_response_client_disconnect(send: Send, disconnect: Receive):
+    closed = asyncio.Event()
+
+    async def iterator():
+        try:
+            while True:
+                yield b"chunk"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    response = StreamingResponse(
+        content=iterator(), background=BackgroundTask(lambda **kwargs: None)
+    )
+    await response({"type": "http"}, disconnect, send)
+
+    assert closed.is_set()
+    assert response.disconnected
+    assert response.background.kwargs == {"disconnected": True}
+
+
+@pytest.mark.asyncio
+async def test_stream_response_completed(body_iterator: Iterator[bytes]):
+    completed = asyncio.Event()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and not message["more_body"]:
+            completed.set()
+
+    async def receive():
+        # servers report a disconnect once the response is complete
+        await completed.wait()
+        return {"type": "http.disconnect"}
+
+    background = MagicMock()
+
+    def task():
+        background()
+
+    response = StreamingResponse(content=body_iterator, background=BackgroundTask(task))
+    await response({"type": "http"}, receive, send)
+
+    assert not response.disconnected
+    assert response.background.kwargs == {}
+    background.assert_called_once_with()
+
+
+def slow_send(delay: float) -> AsyncMock:
+    async def send(message):
+        await asyncio.sleep(delay)
+
+    return AsyncMock(side_effect=send)
+
+
+@pytest.mark.asyncio
+async def test_buffered_send_block():
+    send = slow_send(0.01)
+    buffered_send = BufferedSend(send, max_size=2)
+
+    for i in range(5):
+        await buffered_send(body_message(str(i).encode()))
+    await buffered_send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    assert send.await_args_list == [
+        *[call(body_message(str(i).encode())) for i in range(5)],
+        call({"type": "http.response.body", "body": b"", "more_body": False}),
+    ]
+    assert buffered_send.stats.blocked_seconds > 0
+    assert buffered_send.stats.max_depth == 3  # the final message never blocks
+    assert buffered_send.stats.dropped_messages == 0
+
+
+@pytest.mark.asyncio
+async def test_buffered_send_drop_oldest():
+    send = slow_send(0.01)
+    buffered_send = BufferedSend(
+        send, max_size=2, policy=BackpressurePolicy.DROP_OLDEST
+    )
+
+    for i in range(5):
+        await buffered_send(body_message(str(i).encode()))
+    await buffered_send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    assert buffered_send.stats.dropped_messages > 0
+    assert buffered_send.stats.blocked_seconds == 0
+    assert send.await_args_list[-2:] == [
+        call(body_message(b"4")),
+        call({"type": "http.response.body", "body": b"", "more_body": False}),
+    ]
+    assert len(send.await_args_list) == 6 - buffered_send.stats.dropped_messages
+
+
+@pytest.mark.asyncio
+async def test_buffered_send_coalesce():
+    send = slow_send(0.01)
+    buffered_send = BufferedSend(send, max_size=2, policy=BackpressurePolicy.COALESCE)
+
+    for i in range(10):
+        await buffered_send(body_message(str(i).encode()))
+    await buffered_send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    # the producer never waits and no chunk is lost
+    assert buffered_send.stats.blocked_seconds == 0
+    assert buffered_send.stats.coalesced_messages > 0
+    bodies = [c.args[0]["body"] for c in send.await_args_list]
+    assert b"".join(bodies) == b"0123456789"
+    assert len(bodies) == 11 - buffered_send.stats.coalesced_messages
+
+
+def test_buffered_send_invalid_arguments(send: Send):
+    with pytest.raises(ValueError):
+        BufferedSend(send, policy="invalid_policy")
+
+    with pytest.raises(ValueError):
+        BufferedSend(send, max_size=0)
+
+
+@pytest.mark.asyncio
+async def test_stream_response_backpressure_abort():
+    closed = asyncio.Event()
+
+    async def iterator():
+        try:
+            while True:
+                yield b"chunk"
+        finally:
+            closed.set()
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    send = slow_send(0.01)
+    response = StreamingResponse(
+        content=iterator(),
+        backpressure=BackpressurePolicy.ABORT,
+        max_buffer_size=4,
+        background=BackgroundTask(AsyncMock()),
+    )
+    await response({"type": "http"}, receive, send)
+
+    assert closed.is_set()
+    assert response.stream_stats.aborted
+    assert send.await_args_list[-2:] == [
+        call(
+            body_message(
+                ensure_bytes(
+                    ServerSentEvent(
+                        data=dict(
+                            status_code=status.HTTP_408_REQUEST_TIMEOUT,
+                            detail=HTTPStatusDetail.CLIENT_TOO_SLOW,
+                        ),
+                        event=Events.ERROR,
+                    ),
+                    None,
+                )
+            )
+        ),
+        call({"type": "http.response.body", "body": b"", "more_body": False}),
+    ]
+    response.background.func.assert_awaited_once()
+
+
+def sent_bodies(send: AsyncMock) -> list[bytes]:
+    return [
+        args[0]["body"]
+        for args, _ in send.await_args_list
+        if args[0]["type"] == "http.response.body" and args[0]["body"]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stream_response_resume(send: Send, disconnect: Receive):
+    store = ReplayStore()
+    resumed = asyncio.Event()
+
+    async def iterator():
+        yield "a"
+        yield "b"
+        await resumed.wait()
+        yield "c"
+
+    response = StreamingResponse(content=iterator(), replay=store)
+    await response({"type": "http"}, disconnect, send)
+
+    bodies = sent_bodies(send)
+    assert len(bodies) == 2
+    event_id = bodies[1].split(b"\r\n")[0].decode().removeprefix("id: ")
+    stream_id, seq = parse_event_id(event_id)
+    assert seq == 2
+    assert bodies[0] == (
+        f"id: {stream_id}:1\r\n".encode() + ensure_bytes(ServerSentEvent("a"), None)
+    )
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    content = MagicMock()
+    resumed_send = AsyncMock()
+    resumed_response = StreamingResponse(content=content, replay=store)
+    resumed.set()
+    await resumed_response(
+        {"type": "http", "headers": [(b"last-event-id", event_id.encode())]},
+        receive,
+        resumed_send,
+    )
+
+    content.__aiter__.assert_not_called()
+    assert sent_bodies(resumed_send) == [
+        f"id: {stream_id}:3\r\n".encode() + ensure_bytes(ServerSentEvent("c"), None)
+    ]
+    resumed_send.assert_awaited_with(
+        {"type": "http.response.body", "body": b"", "more_body": False}
+    )
+
+
+@pytest.mark.asyncio
+async def test_stream_response_resume_timeout(send: Send, disconnect: Receive):
+    closed = asyncio.Event()
+
+    async def iterator():
+        try:
+            while True:
+                yield "token"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    background = AsyncMock()
+    response = StreamingResponse(
+        content=iterator(),
+        replay=ReplayStore(),
+        resume_timeout=0.05,
+        background=BackgroundTask(background),
+    )
+    await response({"type": "http"}, disconnect, send)
+    assert not closed.is_set()
+    background.assert_not_awaited()
+
+    await asyncio.wait_for(closed.wait(), 1)
+    await asyncio.sleep(0.01)
+    background.assert_awaited_once_with(disconnected=True)
+
+
+def is_ping(body: bytes) -> bool:
+    return body.startswith(b": ping")
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_scheduler_skips_active_streams():
+    scheduler = HeartbeatScheduler(tick=0.01, slots=4)
+    idle_send, active_send = AsyncMock(), AsyncMock()
+
+    idle = scheduler.register(idle_send, interval=0.02)
+    active = scheduler.register(active_send, interval=0.02)
+    assert len(scheduler) == 2
+
+    for _ in range(10):
+        await active(body_message(b"data: token\r\n\r\n"))
+        await asyncio.sleep(0.01)
+
+    assert all(is_ping(body) for body in sent_bodies(idle_send))
+    assert len(sent_bodies(idle_send)) >= 2
+    assert not any(is_ping(body) for body in sent_bodies(active_send))
+    assert scheduler.stats()["pings_skipped"] > 0
+
+    await idle({"type": "http.response.body", "body": b"", "more_body": False})
+    idle_send.reset_mock()
+    await asyncio.sleep(0.05)
+    assert sent_bodies(idle_send) == []
+
+    scheduler.unregister(idle)
+    scheduler.unregister(active)
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_response_heartbeat(send: Send):
+    async def iterator():
+        yield "a"
+        await asyncio.sleep(0.1)
+        yield "b"
+
+    scheduler = HeartbeatScheduler(tick=0.01)
+    response = StreamingResponse(content=iterator(), ping=0.03, heartbeat=scheduler)
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    await response({"type": "http"}, receive, send)
+
+    bodies = sent_bodies(send)
+    assert bodies[0] == ensure_bytes(ServerSentEvent("a"), None)
+    assert bodies[-1] == ensure_bytes(ServerSentEvent("b"), None)
+    assert any(is_ping(body) for body in bodies[1:-1])
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_response_heartbeat_sep(send: Send):
+    async def iterator():
+        yield "a"
+        await asyncio.sleep(0.1)
+        yield "b"
+
+    scheduler = HeartbeatScheduler(tick=0.01)
+    response = StreamingResponse(
+        content=iterator(), ping=0.03, heartbeat=scheduler, sep="\n"
+    )
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    await response({"type": "http"}, receive, send)
+
+    pings = [body for body in sent_bodies(send) if is_ping(body)]
+    assert pings
+    # pings use the line separator of the stream
+    assert all(b"\r" not in body and body.endswith(b"\n") for body in pings)
+
+
+@pytest.mark.asyncio
+async def test_stream_response_broadcast():
+    hub = Broadcast()
+
+    async def producer(channel: BroadcastChannel):
+        await asyncio.sleep(0.01)
+        await channel.publish(dict(data="token", event=Events.COMPLETION))
+        await channel.publish(dict(data="", event=Events.END))
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    sends = [AsyncMock(), AsyncMock()]
+    await asyncio.gather(
+        *(
+            StreamingResponse(content=hub.publish("key", producer).subscribe())(
+                {"type": "http"}, receive, send
+            )
+            for send in sends
+        )
+    )
+
+    for send in sends:
+        assert sent_bodies(send) == [
+            ensure_bytes(ServerSentEvent("token", event=Events.COMPLETION), None),
+            ensure_bytes(ServerSentEvent("", event=Events.END), None),
+        ]
+
+
+def test_stream_response_broadcast_invalid_arguments():
+    with pytest.raises(ValueError):
+        StreamingResponse(broadcast=Broadcast())
+    with pytest.raises(ValueError):
+        StreamingResponse(
+            broadcast=Broadcast(), broadcast_key="key", replay=ReplayStore()
+        )
+
+
+@pytest.mark.asyncio
+async def test_stream_response_call_on_complete(send: Send):
+    async def iterator():
+        yield "a"
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    callback = AsyncMock()
+    response = StreamingResponse(content=iterator())
+    response.call_on_complete(callback)
+    await response({"type": "http"}, receive, send)
+    callback.assert_awaited_once_with()
+
+    # resumable streams complete when the detached generation ends
+    released = asyncio.Event()
+    response = StreamingResponse(content=iterator(), replay=ReplayStore())
+    response.call_on_complete(AsyncMock(side_effect=released.set))
+    await response({"type": "http"}, receive, AsyncMock())
+    await asyncio.wait_for(released.wait(), 1)
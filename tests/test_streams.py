@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from lanarky.streams import (
+    Broadcast,
+    BroadcastChannel,
+    EventBuffer,
+    ReplayStore,
+    format_event_id,
+    parse_event_id,
+)
+
+
+async def collect(buffer: EventBuffer, seq: int = 0) -> list:
+    return [event async for event in buffer.iter_from(seq)]
+
+
+@pytest.mark.asyncio
+async def test_event_buffer():
+    buffer = EventBuffer()
+    assert buffer.append("a") == 1
+    assert buffer.append("b") == 2
+
+    reader = asyncio.create_task(collect(buffer))
+    await asyncio.sleep(0)
+    assert buffer.readers == 1
+
+    buffer.append("c")
+    buffer.close()
+
+    assert await reader == [(1, "a"), (2, "b"), (3, "c")]
+    assert await collect(buffer, 2) == [(3, "c")]
+    assert buffer.readers == 0
+
+    with pytest.raises(RuntimeError):
+        buffer.append("d")
+
+
+@pytest.mark.asyncio
+async def test_event_buffer_ring():
+    buffer = EventBuffer(maxlen=2)
+    for event in ["a", "b", "c"]:
+        buffer.append(event)
+    buffer.close()
+
+    assert buffer.first_seq == 2
+    assert not buffer.can_resume(0)
+    assert buffer.can_resume(1)
+    assert buffer.can_resume(3)
+    assert not buffer.can_resume(4)
+    assert await collect(buffer, 1) == [(2, "b"), (3, "c")]
+
+
+@pytest.mark.asyncio
+async def test_replay_store():
+    store = ReplayStore(ttl=0.01, max_streams=2)
+
+    stream_id, buffer = store.create()
+    assert store.get(stream_id) is buffer
+
+    await asyncio.sleep(0.02)
+    assert store.get(stream_id) is None
+
+    stream_ids = [store.create()[0] for _ in range(3)]
+    assert len(store) == 2
+    assert store.get(stream_ids[0]) is None
+
+
+def test_event_ids():
+    assert format_event_id("stream", 3) == "stream:3"
+    assert parse_event_id("stream:3") == ("stream", 3)
+    assert parse_event_id(" stream:3\n") == ("stream", 3)
+    assert parse_event_id("stream") is None
+    assert parse_event_id("stream:abc") is None
+    assert parse_event_id(":3") is None
+
+
+async def subscribe(channel: BroadcastChannel) -> list:
+    return [event async for event in channel.subscribe()]
+
+
+@pytest.mark.asyncio
+async def test_broadcast():
+    hub = Broadcast()
+    calls = 0
+    release = asyncio.Event()
+
+    async def producer(channel: BroadcastChannel):
+        nonlocal calls
+        calls += 1
+        await channel.publish("a")
+        await release.wait()
+        await channel.send_json({"data": "b"})
+
+    channel = hub.publish("key", producer)
+    assert hub.publish("key", producer) is channel
+    early = asyncio.create_task(subscribe(channel))
+    await asyncio.sleep(0.01)
+    assert "key" in hub
+    assert hub.stats() == {"channels": 1, "subscribers": 1}
+
+    # late joiners catch up on buffered events
+    late = asyncio.create_task(subscribe(hub.get("key")))
+    release.set()
+
+    assert await early == ["a", {"data": "b"}]
+    assert await late == ["a", {"data": "b"}]
+    assert calls == 1
+    assert len(hub) == 0
+    assert channel.closed
+
+
+@pytest.mark.asyncio
+async def test_broadcast_idle_timeout():
+    hub = Broadcast(idle_timeout=0.02)
+    cancelled = asyncio.Event()
+
+    async def producer(channel: BroadcastChannel):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    channel = hub.publish("key", producer)
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.sleep(0)
+    assert channel.closed
+    assert "key" not in hub
+
+
+@pytest.mark.asyncio
+async def test_broadcast_producer_error():
+    hub = Broadcast()
+
+    async def producer(channel: BroadcastChannel):
+        await channel.publish("a")
+        raise RuntimeError("boom")
+
+    channel = hub.publish("key", producer)
+    assert await subscribe(channel) == ["a"]
+    assert len(hub) == 0
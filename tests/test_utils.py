@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from lanarky.utils import (
+    JSONCodec,
+    get_json_codec,
+    json_dumps,
+    json_loads,
+    set_json_codec,
+)
+
+
+def test_json_codec():
+    codec = JSONCodec()
+    # same output as `WebSocket.send_json`
+    assert codec.encode({"a": "naïve", "b": [1]}) == '{"a":"naïve","b":[1]}'
+    assert codec.encode_bytes({"a": 1}) == b'{"a":1}'
+    assert codec.encode({"a": object}) == f'{{"a":"{object}"}}'
+    assert codec.decode(b'{"a": 1}') == {"a": 1}
+
+    codec = JSONCodec(dumps=lambda data: json.dumps(data).encode("utf-8"))
+    assert codec.encode({"a": 1}) == '{"a": 1}'
+    assert codec.encode_bytes({"a": 1}) == b'{"a": 1}'
+
+
+def test_set_json_codec():
+    default = get_json_codec()
+    loads = []
+
+    def custom_loads(data):
+        loads.append(data)
+        return json.loads(data)
+
+    codec = set_json_codec(loads=custom_loads)
+    try:
+        assert get_json_codec() is codec
+        assert json_loads('{"a": 1}') == {"a": 1}
+        assert loads == ['{"a": 1}']
+        assert json_dumps({"a": 1}) == '{"a":1}'
+    finally:
+        set_json_codec()
+
+    assert get_json_codec() is not codec
+    assert get_json_codec().dumps is default.dumps
+
+    with pytest.raises(ValueError):
+        json_loads("{")
@@ -1,21 +1,31 @@
+import asyncio
+import json
 from typing import Type
 from unittest.mock import AsyncMock, patch
 
 import pytest
 
+from lanarky.utils import set_json_codec
 from lanarky.websockets import (
+    BufferedWebSocket,
     DataMode,
+    MessagePackWebSocket,
     WebSocket,
     WebSocketDisconnect,
     WebsocketSession,
+    get_data_mode,
+    receive_json,
+    send_json,
 )
 
 
 @pytest.mark.asyncio
 async def test_connect_json(websocket: Type[WebSocket]):
     session = WebsocketSession()
-    data_to_send = ["Hello", "World", "!"]
-    websocket.receive_json = AsyncMock(side_effect=data_to_send)
+    data_to_send = ["Hello", {"World": 1}, "!"]
+    websocket.receive_text = AsyncMock(
+        side_effect=[json.dumps(data) for data in data_to_send]
+    )
 
     async with session.connect(websocket, mode=DataMode.JSON) as data_stream:
         for expected_data in data_to_send:
@@ -56,6 +66,47 @@ async def test_invalid_data_mode(websocket: Type[WebSocket]):
             pass
 
 
+@pytest.mark.asyncio
+async def test_connect_msgpack(websocket: Type[WebSocket]):
+    msgpack = pytest.importorskip("msgpack")
+    session = WebsocketSession()
+    data_to_send = [{"query": "Hello"}, {"query": "World"}]
+    websocket.scope = {"subprotocols": ["msgpack"]}
+    websocket.receive_bytes = AsyncMock(
+        side_effect=[msgpack.packb(data) for data in data_to_send]
+    )
+
+    assert get_data_mode(websocket) == DataMode.MSGPACK
+    async with session.connect(websocket, mode=DataMode.MSGPACK) as data_stream:
+        for expected_data in data_to_send:
+            received_data = await data_stream.__anext__()
+            assert received_data == expected_data
+    websocket.accept.assert_awaited_once_with(subprotocol="msgpack")
+
+    websocket.scope = {"subprotocols": []}
+    assert get_data_mode(websocket) == DataMode.JSON
+
+
+@pytest.mark.asyncio
+async def test_message_pack_websocket(websocket: Type[WebSocket]):
+    msgpack = pytest.importorskip("msgpack")
+    websocket.send_bytes = AsyncMock()
+    sender = MessagePackWebSocket(websocket, json_events=["completion"])
+
+    await sender.send_json({"data": '{"token": "Hi"}', "event": "completion"})
+    await sender.send_json({"data": "", "event": "completion"})
+    await sender.send_json({"data": {"status": 500}, "event": "error"})
+    await send_json(sender, {"data": '{"a": 1}', "event": "end"})
+
+    sent = [msgpack.unpackb(c.args[0]) for c in websocket.send_bytes.await_args_list]
+    assert sent == [
+        {"data": {"token": "Hi"}, "event": "completion"},
+        {"data": "", "event": "completion"},
+        {"data": {"status": 500}, "event": "error"},
+        {"data": '{"a": 1}', "event": "end"},
+    ]
+
+
 @pytest.mark.asyncio
 async def test_websocket_disconnect(websocket: Type[WebSocket]):
     websocket.receive_text = AsyncMock(side_effect=WebSocketDisconnect())
@@ -68,3 +119,55 @@ async def test_websocket_disconnect(websocket: Type[WebSocket]):
                 pass
 
         logger.info.assert_called_once_with("Websocket disconnected")
+
+
+@pytest.mark.asyncio
+async def test_buffered_websocket(websocket: Type[WebSocket]):
+    async def send_text(data):
+        await asyncio.sleep(0.01)
+
+    websocket.send_text = AsyncMock(side_effect=send_text)
+
+    def merge(first, second):
+        if isinstance(first, str) and isinstance(second, str):
+            return first + second
+        return None
+
+    sender = BufferedWebSocket(websocket, max_size=2, merge=merge)
+    loop = asyncio.get_running_loop()
+
+    start = loop.time()
+    for i in range(10):
+        await sender.send_json(str(i))
+    await sender.send_json({"event": "end"})
+    # the producer is not stalled by socket writes
+    assert loop.time() - start < 0.01
+
+    await sender.drain()
+    sent = [json.loads(c.args[0]) for c in websocket.send_text.await_args_list]
+    assert "".join(sent[:-1]) == "0123456789"
+    assert sent[-1] == {"event": "end"}
+    assert sender.merged_messages > 0
+    sender.close()
+
+    with pytest.raises(ValueError):
+        BufferedWebSocket(websocket, max_size=0)
+
+
+@pytest.mark.asyncio
+async def test_json_codec(websocket: Type[WebSocket]):
+    dumps = lambda data: json.dumps(data).encode("utf-8")  # noqa: E731
+    loads = lambda data: json.loads(data)  # noqa: E731
+    set_json_codec(dumps=dumps, loads=loads)
+    try:
+        await send_json(websocket, {"data": "naïve"})
+        websocket.send_text.assert_awaited_once_with('{"data": "na\\u00efve"}')
+
+        websocket.receive_text = AsyncMock(return_value='{"data": 1}')
+        assert await receive_json(websocket) == {"data": 1}
+    finally:
+        set_json_codec()
+
+    sender = AsyncMock()
+    await send_json(sender, {"data": 1})
+    sender.send_json.assert_awaited_once_with({"data": 1})